@@ -0,0 +1,146 @@
+import pandas as pd
+import concurrent.futures
+from datetime import datetime, timedelta
+import argparse
+import time
+import logging
+from src.data_manager import DataManager
+from src.valuation_engine import ValuationEngine
+
+class HistoryBackfiller:
+    """
+    j-Quantsから過去の株価と開示を取得して時系列データを一括作成するクラス
+
+    保存済みの日付はスキップするため、途中で中断しても同じコマンドで再開できる。
+    """
+
+    # 一度に株価を取得してメモリに保持する営業日数
+    CHUNK_DAYS = 20
+
+    # 対象の市場（2022年4月の市場再編前はプライム市場の前身の市場第一部）
+    UNIVERSE_MARKETS = ('プライム', '市場第一部')
+
+    def __init__(self, engine=None, data_manager=None, max_workers=8):
+        self.engine = engine or ValuationEngine(max_workers=max_workers)
+        self.client = self.engine.client
+        self.data_manager = data_manager or DataManager()
+        self.max_workers = max_workers
+        self.logger = logging.getLogger(__name__)
+
+    def get_target_dates(self, start_date, end_date, force=False):
+        """
+        作成対象の営業日を取得
+
+        Args:
+            start_date (str): 開始日（YYYY-MM-DD形式）
+            end_date (str): 終了日（YYYY-MM-DD形式）
+            force (bool): 保存済みの日付も作り直すか
+
+        Returns:
+            list: 営業日のリスト（昇順）
+        """
+        trading_days = self.client.get_trading_calendar(start_date, end_date)
+        if not trading_days:
+            trading_days = [d.strftime('%Y-%m-%d') for d in pd.bdate_range(start_date, end_date)]
+
+        if force:
+            return trading_days
+
+        existing = set(self.data_manager.get_available_dates())
+        return [d for d in trading_days if d not in existing]
+
+    def fetch_day(self, date):
+        """
+        指定日時点の上場銘柄一覧と、対象市場の銘柄の株価を取得
+
+        銘柄の範囲は日付ごとにその日の上場銘柄一覧から決める（現在の一覧を使うと、
+        その後に上場廃止になった銘柄が抜け、後から対象市場に入った銘柄が含まれてしまう）。
+
+        Args:
+            date (str): 日付（YYYY-MM-DD形式）
+
+        Returns:
+            tuple: (上場銘柄一覧, 株価のDataFrame)
+        """
+        listed = self.engine.fetch_listed_info(date=date)
+        listed = listed[listed['market'].isin(self.UNIVERSE_MARKETS)]
+        if listed.empty:
+            return listed, None
+        return listed, self.client.get_daily_quotes_snapshot(date=date, codes=listed['code'].tolist())
+
+    def run(self, start_date, end_date, force=False):
+        """
+        指定期間の時系列データを作成
+
+        Args:
+            start_date (str): 開始日（YYYY-MM-DD形式）
+            end_date (str): 終了日（YYYY-MM-DD形式）
+            force (bool): 保存済みの日付も作り直すか
+
+        Returns:
+            int: 保存した日数
+        """
+        started = time.time()
+
+        target_dates = self.get_target_dates(start_date, end_date, force=force)
+        if not target_dates:
+            self.logger.info("作成対象の日付はありません（すべて保存済み）")
+            return 0
+
+        self.logger.info(f"{len(target_dates)}営業日分の時系列データを作成します ({target_dates[0]} ～ {target_dates[-1]})")
+
+        # 期間の先頭時点で有効な開示まで含めて一括取得
+        lookback_start = (datetime.strptime(target_dates[0], '%Y-%m-%d')
+                          - timedelta(days=self.engine.STATEMENT_LOOKBACK_DAYS)).strftime('%Y-%m-%d')
+        statements = self.engine.prepare_statements(
+            self.engine.fetch_statements(target_dates[-1], start_date=lookback_start)
+        )
+
+        saved = 0
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                for i in range(0, len(target_dates), self.CHUNK_DAYS):
+                    chunk = target_dates[i:i + self.CHUNK_DAYS]
+                    snapshots = executor.map(self.fetch_day, chunk)
+
+                    for date, (listed, quotes) in zip(chunk, snapshots):
+                        if quotes is None or quotes.empty:
+                            self.logger.warning(f"{date}の株価データがないためスキップします")
+                            continue
+
+                        fundamentals = self.engine.latest_fundamentals(statements, as_of=date)
+                        snapshot = self.engine.compute(quotes, fundamentals, listed)
+                        self.data_manager.save_daily_data(snapshot, date=date, save_metadata=False)
+                        saved += 1
+
+                    # メタデータは日ごとではなくチャンクごとにまとめて書き込む
+                    if saved:
+                        self.data_manager.commit_metadata()
+                    self.logger.info(f"進捗: {min(i + self.CHUNK_DAYS, len(target_dates))}/{len(target_dates)}営業日")
+        finally:
+            # 中断時もそれまでに保存した日付を記録し、再開時にスキップできるようにする
+            if saved:
+                self.data_manager.commit_metadata()
+
+        self.logger.info(f"時系列データの作成完了: {saved}日分 ({time.time() - started:.1f}秒)")
+        return saved
+
+def main():
+    """
+    メイン実行関数
+    """
+    today = datetime.now()
+    parser = argparse.ArgumentParser(description='j-Quantsから過去の時系列データを作成（再開可能）')
+    parser.add_argument('--start', type=str, default=(today - timedelta(days=365)).strftime('%Y-%m-%d'),
+                        help='開始日（YYYY-MM-DD、省略時は1年前）')
+    parser.add_argument('--end', type=str, default=today.strftime('%Y-%m-%d'), help='終了日（YYYY-MM-DD、省略時は今日）')
+    parser.add_argument('--workers', type=int, default=8, help='並列取得数')
+    parser.add_argument('--force', action='store_true', help='保存済みの日付も作り直す')
+    args = parser.parse_args()
+
+    backfiller = HistoryBackfiller(max_workers=args.workers)
+    saved = backfiller.run(args.start, args.end, force=args.force)
+    print(f"{saved}日分の時系列データを作成しました")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import time
+import tempfile
+from pathlib import Path
+import argparse
+import logging
+from src.config import config
+from src.jquants_client import JQuantsClient
+from src.response_cache import ResponseCache
+from src.jquants_stub_server import StubDataset, StubState, start_server
+from src.token_store import TokenStore
+
+class ClientBenchmark:
+    """
+    スタブサーバーに対してJQuantsClientのスループットを計測するクラス
+    """
+
+    def __init__(self, base_url, use_cache=False):
+        self.base_url = base_url
+        self.use_cache = use_cache
+        self.work_dir = Path(tempfile.mkdtemp(prefix='jquants_bench_'))
+        self.logger = logging.getLogger(__name__)
+
+    def create_client(self):
+        """
+        スタブサーバーに接続するクライアントを作成（トークンとレスポンスキャッシュは作業ディレクトリに保存）
+        """
+        config.jquants_base_url = self.base_url
+        if not config.jquants_refresh_token:
+            config.jquants_refresh_token = 'stub-refresh-token'
+
+        # スタブの合成データが本番のキャッシュに入らないよう、キャッシュも作業ディレクトリに分ける
+        cache = ResponseCache(self.work_dir / 'jquants_responses.sqlite') if self.use_cache else None
+        client = JQuantsClient(cache=cache, use_cache=self.use_cache)
+        client.token_store = TokenStore(config.jquants_refresh_token,
+                                        token_file=self.work_dir / 'jquants_token.json')
+        return client
+
+    def measure(self, name, func):
+        """
+        1つの操作の所要時間とリクエスト統計を計測
+
+        Args:
+            name (str): 操作名
+            func (callable): クライアントを受け取って実行する関数
+
+        Returns:
+            dict: 計測結果
+        """
+        client = self.create_client()
+        started = time.perf_counter()
+        result = func(client)
+        elapsed = time.perf_counter() - started
+
+        stats = dict(client.request_stats)
+        return {
+            'name': name,
+            'elapsed': elapsed,
+            'records': len(result) if result is not None else 0,
+            'requests': stats['requests'],
+            'requests_per_sec': stats['requests'] / elapsed if elapsed else 0,
+            'retries': stats['retries'],
+            'throttled': stats['throttled'],
+            'errors': stats['errors'],
+        }
+
+    def run(self, sample_size=50):
+        """
+        代表的な操作を計測
+
+        Args:
+            sample_size (int): 財務情報・少数銘柄株価で使う銘柄数
+
+        Returns:
+            list: 計測結果のリスト
+        """
+        prime_codes = self.create_client().get_prime_stock_codes()
+        sample_codes = prime_codes[:sample_size]
+
+        return [
+            self.measure('get_prime_stock_codes', lambda c: c.get_prime_stock_codes()),
+            self.measure('get_stock_prices (snapshot)', lambda c: c.get_stock_prices(prime_codes)),
+            self.measure('get_stock_prices (20 codes)', lambda c: c.get_stock_prices(prime_codes[:20])),
+            self.measure(f'get_financial_statements ({len(sample_codes)} codes)',
+                         lambda c: c.get_financial_statements(sample_codes)),
+        ]
+
+def print_results(results):
+    """
+    計測結果を表形式で表示
+    """
+    print(f"{'操作':<40} {'時間(秒)':>9} {'件数':>7} {'リクエスト':>10} {'req/s':>8} {'リトライ':>8} {'429':>5} {'5xx':>5}")
+    for r in results:
+        print(f"{r['name']:<40} {r['elapsed']:>9.3f} {r['records']:>7} {r['requests']:>10} "
+              f"{r['requests_per_sec']:>8.1f} {r['retries']:>8} {r['throttled']:>5} {r['errors']:>5}")
+
+def main():
+    """
+    メイン実行関数
+    """
+    parser = argparse.ArgumentParser(description='ローカルスタブサーバーを使ったJQuantsClientのベンチマーク')
+    parser.add_argument('--base-url', type=str, default=None, help='起動済みサーバーのURL（省略時は内蔵スタブを起動）')
+    parser.add_argument('--codes', type=int, default=1600, help='合成データの銘柄数')
+    parser.add_argument('--days', type=int, default=20, help='合成データの営業日数')
+    parser.add_argument('--latency-ms', type=float, default=20, help='応答遅延（ミリ秒）')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='429を返す確率')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='500を返す確率')
+    parser.add_argument('--rate-limit', type=int, default=None, help='1秒あたりの最大リクエスト数')
+    parser.add_argument('--page-size', type=int, default=1000, help='1ページのレコード数')
+    parser.add_argument('--sample', type=int, default=50, help='財務情報を取得する銘柄数')
+    parser.add_argument('--use-cache', action='store_true', help='レスポンスキャッシュを有効にする')
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        dataset = StubDataset(num_codes=args.codes, days=args.days)
+        state = StubState(dataset, latency_ms=args.latency_ms, throttle_rate=args.throttle_rate,
+                          error_rate=args.error_rate, rate_limit=args.rate_limit, page_size=args.page_size)
+        server, base_url = start_server(state)
+
+    try:
+        benchmark = ClientBenchmark(base_url, use_cache=args.use_cache)
+        print_results(benchmark.run(sample_size=args.sample))
+        if server is not None:
+            print(f"サーバー統計: {state.stats}")
+    finally:
+        if server is not None:
+            server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,7 @@ class Config:
         
         # j-Quants API Configuration
         self.jquants_refresh_token = os.getenv('JQUANTS_REFRESH_TOKEN')
+        self.jquants_base_url = os.getenv('JQUANTS_BASE_URL', 'https://api.jquants.com/v1')
         
         # Database Configuration
         self.database_url = os.getenv('DATABASE_URL')
@@ -32,6 +33,18 @@ class Config:
         self.output_file = os.getenv('OUTPUT_FILE', 'data/output.csv')
         self.backup_dir = os.getenv('BACKUP_DIR', 'data/backup/')
         
+        # History Storage Configuration
+        self.history_backend = os.getenv('HISTORY_BACKEND', 'csv')
+        self.history_keyframe_interval = int(os.getenv('HISTORY_KEYFRAME_INTERVAL', '7'))
+        self.history_frame_cache_size = int(os.getenv('HISTORY_FRAME_CACHE_SIZE', '64'))
+        self.history_load_workers = int(os.getenv('HISTORY_LOAD_WORKERS', '4'))
+        
+        # Cache Configuration
+        self.cache_dir = os.getenv('CACHE_DIR', '.cache')
+        self.jquants_cache_enabled = os.getenv('JQUANTS_CACHE_ENABLED', 'true').lower() == 'true'
+        self.jquants_cache_max_mb = int(os.getenv('JQUANTS_CACHE_MAX_MB', '256'))
+        self.processing_cache_size = int(os.getenv('PROCESSING_CACHE_SIZE', '4'))
+        
         # ログディレクトリの作成
         self._setup_logging()
     
@@ -69,7 +82,8 @@ class Config:
             dict: j-Quants設定辞書
         """
         return {
-            'refresh_token': self.jquants_refresh_token
+            'refresh_token': self.jquants_refresh_token,
+            'base_url': self.jquants_base_url
         }
     
     def is_development(self):
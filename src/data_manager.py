@@ -1,66 +1,242 @@
 import pandas as pd
+import numpy as np
 import os
 import json
+import bisect
+import concurrent.futures
 from datetime import datetime, timedelta
 from pathlib import Path
 import logging
 from src.config import config
+from src.history_store import create_history_store, store_for_filename
+from src.frame_cache import FrameCache
+from src.rollup_store import RollupStore
+from src.sector_master import load_sector_map
+from src.history_archive import HistoryArchive
+from src.frame_schema import normalize_codes
+from src.storage import file_lock, write_json_atomic
+
+# プロセス内で共有するメタデータのキャッシュ（ファイルパス → (更新時刻, メタデータ)）
+_METADATA_CACHE = {}
 
 class DataManager:
     """
     時系列データ管理クラス
     """
     
-    def __init__(self):
+    def __init__(self, backend=None):
         self.history_dir = Path("data/history")
         self.history_dir.mkdir(parents=True, exist_ok=True)
         
         self.logger = logging.getLogger(__name__)
         
-        # 履歴メタデータファイル
+        # 日次データ・アーカイブを更新するプロセスを直列化するロック
+        self.writer_lock = self.history_dir / "history"
+        
+        # 日次データの保存形式（csv / parquet）
+        self.store = create_history_store(backend or config.history_backend, self.history_dir)
+        
+        # 読み込み済み日次データのLRUキャッシュ
+        self.frame_cache = FrameCache(config.history_frame_cache_size)
+        self.load_workers = config.history_load_workers
+        
+        # 保持期間を過ぎた日次データの年別アーカイブ
+        self.archive = HistoryArchive(self.history_dir / "archive")
+        
+        # 市場全体・業種別の日次/週次/月次集計（save_metadata=Falseの間の分はcommit_metadataでまとめて書き込む）
+        self.rollups = RollupStore(self.history_dir / "rollups")
+        self._pending_rollups = {}
+        
+        # 履歴メタデータファイル（保存形式の移行は commit_metadata を使うため、集計の準備後に行う）
         self.metadata_file = self.history_dir / "metadata.json"
         self._load_metadata()
+        self._migrate_files()
     
     def _load_metadata(self):
         """
-        メタデータを読み込み
+        メタデータを読み込み（同じプロセス内では更新時刻が変わらない限りキャッシュを使う）
         """
-        if self.metadata_file.exists():
-            with open(self.metadata_file, 'r', encoding='utf-8') as f:
-                self.metadata = json.load(f)
-        else:
-            self.metadata = {
+        cache_key = str(self.metadata_file.resolve())
+        mtime = self.metadata_file.stat().st_mtime_ns if self.metadata_file.exists() else None
+        cached = _METADATA_CACHE.get(cache_key)
+        
+        if mtime is None:
+            metadata = {
                 'last_update': None,
                 'total_files': 0,
                 'data_points': 0,
-                'file_list': []
+                'files': {}
             }
+        elif cached is not None and cached[0] == mtime:
+            metadata = cached[1]
+        else:
+            with open(self.metadata_file, 'r', encoding='utf-8') as f:
+                metadata = json.load(f)
+            
+            # 旧形式（file_listのリスト）からの変換
+            if 'file_list' in metadata:
+                metadata['files'] = {item['date']: item for item in metadata.pop('file_list')}
+                metadata['data_points'] = sum(item['rows'] for item in metadata['files'].values())
+            _METADATA_CACHE[cache_key] = (mtime, metadata)
+        
+        # キャッシュを書き換えないよう各エントリを複製して使う
+        self.metadata = dict(metadata, files={date: dict(item) for date, item in metadata['files'].items()})
+        self.dates = sorted(self.metadata['files'])
+        self._metadata_mtime = mtime
+        self._changed_dates = set()
+    
+    def _check_metadata(self):
+        """
+        他のプロセス・インスタンスがメタデータを更新していれば読み直す（未保存の変更がある場合を除く）
+        """
+        if self._changed_dates or not self.metadata_file.exists():
+            return
+        if self.metadata_file.stat().st_mtime_ns != self._metadata_mtime:
+            self._load_metadata()
+    
+    def _put_file(self, file_info):
+        """
+        日付をキーにファイル情報を登録（既存の日付は置き換え）
+        """
+        date = file_info['date']
+        previous = self.metadata['files'].get(date)
+        if previous is None:
+            bisect.insort(self.dates, date)
+        else:
+            self.metadata['data_points'] -= previous['rows']
+        
+        self.metadata['files'][date] = file_info
+        self.metadata['data_points'] += file_info['rows']
+        self._changed_dates.add(date)
+    
+    def _drop_file(self, date):
+        """
+        日付のファイル情報を削除
+        """
+        previous = self.metadata['files'].pop(date, None)
+        if previous is None:
+            return
+        
+        del self.dates[bisect.bisect_left(self.dates, date)]
+        self.metadata['data_points'] -= previous['rows']
+        self._changed_dates.add(date)
+    
+    def _is_archived(self, date):
+        """
+        日付のデータがアーカイブに移されているか
+        """
+        return self.metadata['files'].get(date, {}).get('archived', False)
+    
+    def _source(self, date):
+        """
+        日付のデータを読み込む先（アーカイブまたは現在のストア）
+        """
+        return self.archive if self._is_archived(date) else self.store
+    
+    def _migrate_files(self):
+        """
+        現在のストアと異なる形式で保存されている日次データを変換
+        （例: Parquetストアに切り替えた際の既存CSVの移行）
+        """
+        migrated = 0
+        with file_lock(self.writer_lock):
+            for item in self.metadata['files'].values():
+                filename = self.store.filename(item['date'])
+                if item['filename'] == filename or item.get('archived'):
+                    continue
+                
+                old_store = store_for_filename(item['filename'], self.history_dir)
+                if old_store.name == self.store.name:
+                    # 差分ストアで基準のキーフレームが変わった場合はファイル名だけを更新
+                    item['filename'] = filename
+                    self._changed_dates.add(item['date'])
+                    migrated += 1
+                    continue
+                
+                data = old_store.read(item['date'])
+                if data is None:
+                    continue
+                
+                filepath = self.store.write(item['date'], data)
+                old_store.delete(item['date'])
+                
+                item['filename'] = self.store.filename(item['date'])
+                item['file_size'] = filepath.stat().st_size
+                self._changed_dates.add(item['date'])
+                migrated += 1
+        
+        if migrated:
+            self.commit_metadata()
+            self.logger.info(f"{migrated}件の日次データを{self.store.name}形式に移行しました")
     
     def _save_metadata(self):
         """
-        メタデータを保存
+        メタデータを日付順・コンパクトなJSONで一時ファイルに書き込み、置き換える
         """
-        with open(self.metadata_file, 'w', encoding='utf-8') as f:
-            json.dump(self.metadata, f, ensure_ascii=False, indent=2)
+        metadata = dict(self.metadata, files={date: self.metadata['files'][date] for date in self.dates})
+        
+        write_json_atomic(metadata, self.metadata_file, separators=(',', ':'))
+        
+        self._metadata_mtime = self.metadata_file.stat().st_mtime_ns
+        self._changed_dates = set()
+        _METADATA_CACHE[str(self.metadata_file.resolve())] = (
+            self._metadata_mtime,
+            dict(metadata, files={date: dict(item) for date, item in metadata['files'].items()})
+        )
     
-    def save_daily_data(self, data, date=None):
+    def _refresh_totals(self):
+        """
+        メタデータの集計値を更新（データポイント数は登録・削除時に差分で更新済み）
+        """
+        self.metadata['last_update'] = datetime.now().isoformat()
+        self.metadata['total_files'] = len(self.dates)
+    
+    def commit_metadata(self):
+        """
+        メモリ上のメタデータを集計してファイルに書き込む
+        （save_daily_dataをsave_metadata=Falseで連続実行した後に呼び出す）
+        
+        他のプロセスが先にメタデータを更新していた場合は、その内容を読み直して
+        このインスタンスで変更した日付だけを上書きしてから書き込む。
+        """
+        with file_lock(self.metadata_file):
+            if self.metadata_file.exists() and self.metadata_file.stat().st_mtime_ns != self._metadata_mtime:
+                changes = {date: self.metadata['files'].get(date) for date in self._changed_dates}
+                self._load_metadata()
+                for date, item in changes.items():
+                    if item is None:
+                        self._drop_file(date)
+                    else:
+                        self._put_file(item)
+            
+            self._refresh_totals()
+            self._save_metadata()
+            
+            if self._pending_rollups:
+                self.rollups.add_daily_rows(pd.concat(self._pending_rollups.values(), ignore_index=True))
+                self._pending_rollups = {}
+    
+    def save_daily_data(self, data, date=None, save_metadata=True):
         """
         日次データを保存
         
         Args:
             data (pd.DataFrame): 保存するデータ
             date (str): 日付（YYYY-MM-DD形式、Noneの場合は今日）
+            save_metadata (bool): メタデータを即時に書き込むか（Falseの場合はcommit_metadataで書き込む）
         """
         if date is None:
             date = datetime.now().strftime('%Y-%m-%d')
         
-        # ファイル名を生成
-        filename = f"daily_{date}.csv"
-        filepath = self.history_dir / filename
-        
         try:
-            # データを保存
-            data.to_csv(filepath, index=False, encoding='utf-8-sig')
+            # データを保存（差分ストアではキーフレームか差分かで名前が変わるため保存後に取得）
+            # 差分・辞書ストアは複数ファイルを更新するため、書き込み側をロックで直列化する
+            with file_lock(self.writer_lock):
+                filepath = self.store.write(date, data)
+                filename = self.store.filename(date)
+            
+            # その日の集計を作成
+            self._pending_rollups[date] = self.rollups.compute_daily(date, data, load_sector_map())
             
             # メタデータを更新
             file_info = {
@@ -72,23 +248,11 @@ class DataManager:
                 'created_at': datetime.now().isoformat()
             }
             
-            # 既存のエントリを更新または新規追加
-            existing_index = None
-            for i, item in enumerate(self.metadata['file_list']):
-                if item['date'] == date:
-                    existing_index = i
-                    break
-            
-            if existing_index is not None:
-                self.metadata['file_list'][existing_index] = file_info
-            else:
-                self.metadata['file_list'].append(file_info)
-            
-            self.metadata['last_update'] = datetime.now().isoformat()
-            self.metadata['total_files'] = len(self.metadata['file_list'])
-            self.metadata['data_points'] = sum(item['rows'] for item in self.metadata['file_list'])
+            # 日付をキーに登録（既存の日付は置き換え）
+            self._put_file(file_info)
             
-            self._save_metadata()
+            if save_metadata:
+                self.commit_metadata()
             
             self.logger.info(f"日次データを保存しました: {filename} ({len(data)}行)")
             
@@ -106,12 +270,12 @@ class DataManager:
         Returns:
             pd.DataFrame: データ（存在しない場合はNone）
         """
-        filename = f"daily_{date}.csv"
-        filepath = self.history_dir / filename
+        source = self._source(date)
+        filename = source.filename(date)
         
-        if filepath.exists():
+        if source.exists(date):
             try:
-                data = pd.read_csv(filepath, encoding='utf-8-sig')
+                data = source.read(date)
                 self.logger.info(f"日次データを読み込みました: {filename} ({len(data)}行)")
                 return data
             except Exception as e:
@@ -128,11 +292,8 @@ class DataManager:
         Returns:
             list: 日付のリスト（降順）
         """
-        dates = []
-        for item in self.metadata['file_list']:
-            dates.append(item['date'])
-        
-        return sorted(dates, reverse=True)
+        self._check_metadata()
+        return self.dates[::-1]
     
     def get_time_series_data(self, start_date=None, end_date=None, columns=None):
         """
@@ -157,21 +318,20 @@ class DataManager:
         if end_date is None:
             end_date = available_dates[0]
         
-        # 日付範囲内のデータを取得
-        data_list = []
-        for date in available_dates:
-            if start_date <= date <= end_date:
-                data = self.load_daily_data(date)
-                if data is not None:
-                    # 日付列を追加
-                    data['date'] = date
-                    data_list.append(data)
-        
-        if not data_list:
-            return pd.DataFrame()
+        # 日付範囲内のファイルだけを、指定列だけ読み込む
+        target_dates = self.dates[bisect.bisect_left(self.dates, start_date):bisect.bisect_right(self.dates, end_date)]
+        # アーカイブ済みの日付を含む場合も日単位で読み込み先を切り替えて読む
+        if self.store.cache_frames or any(self._is_archived(date) for date in target_dates):
+            frames = self._read_frames(target_dates, columns)
+            loaded_dates = [date for date in target_dates if date in frames]
+            combined_data = self._concat_frames([frames[date] for date in loaded_dates])
+            if not combined_data.empty:
+                combined_data['date'] = np.repeat(loaded_dates, [len(frames[date]) for date in loaded_dates])
+        else:
+            combined_data = self.store.read_range(target_dates, columns)
         
-        # データを結合
-        combined_data = pd.concat(data_list, ignore_index=True)
+        if combined_data.empty:
+            return pd.DataFrame()
         
         # 列を指定した場合はフィルタリング
         if columns:
@@ -182,39 +342,251 @@ class DataManager:
         self.logger.info(f"時系列データを取得しました: {len(combined_data)}行 ({start_date} ～ {end_date})")
         return combined_data
     
-    def cleanup_old_files(self, keep_days=365):
+    def _read_frames(self, dates, columns=None):
+        """
+        複数日のデータをキャッシュ経由で読み込み（キャッシュにない日は並列に読み込む）
+        
+        Args:
+            dates (list): 日付のリスト
+            columns (list): 取得する列名のリスト
+        
+        Returns:
+            dict: 日付 → データ（キャッシュと共有するため呼び出し側で変更しないこと）
+        """
+        column_key = tuple(columns) if columns else None
+        frames = {}
+        missing = []
+        for date in dates:
+            # 読み込み前の状態で記録し、読み込み中に更新された場合は次回の取得で無効になるようにする
+            stamp = FrameCache.file_stamp(self._source(date).path(date))
+            frame = self.frame_cache.get((date, column_key), stamp)
+            if frame is None:
+                missing.append((date, stamp))
+            else:
+                frames[date] = frame
+        
+        if not missing:
+            return frames
+        
+        def load(date, stamp):
+            frame = self._source(date).read(date, columns)
+            if frame is not None:
+                self.frame_cache.set((date, column_key), stamp, frame)
+            return frame
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(min(self.load_workers, len(missing)), 1)) as executor:
+            loaded = executor.map(lambda item: load(*item), missing)
+            for (date, _), frame in zip(missing, loaded):
+                if frame is not None:
+                    frames[date] = frame
+        
+        self.logger.debug(f"日次データを読み込みました: {len(missing)}日分（キャッシュ: {len(dates) - len(missing)}日分）")
+        return frames
+    
+    @staticmethod
+    def _concat_frames(frames):
+        """
+        日次データを結合（カテゴリ型の列はカテゴリを揃え、コードを連結してカテゴリ型のまま結合する）
+        """
+        if not frames:
+            return pd.DataFrame()
+        
+        columns = list(dict.fromkeys(column for frame in frames for column in frame.columns))
+        categorical_columns = [
+            column for column in columns
+            if all(isinstance(frame[column].dtype, pd.CategoricalDtype) for frame in frames if column in frame.columns)
+        ]
+        
+        combined = pd.concat([frame.drop(columns=categorical_columns, errors='ignore') for frame in frames],
+                             ignore_index=True)
+        for column in categorical_columns:
+            categories = pd.Index([])
+            for frame in frames:
+                if column in frame.columns:
+                    categories = categories.union(frame[column].cat.categories)
+            
+            codes = []
+            for frame in frames:
+                if column not in frame.columns:
+                    codes.append(np.full(len(frame), -1, dtype=np.int32))
+                    continue
+                # 末尾に-1を足し、欠損値のコード(-1)がそのまま-1に写るようにする
+                mapping = np.append(categories.get_indexer(frame[column].cat.categories), -1)
+                codes.append(mapping[frame[column].cat.codes.to_numpy()])
+            
+            combined[column] = pd.Categorical.from_codes(np.concatenate(codes), categories=categories)
+        
+        return combined[columns]
+    
+    def get_cache_statistics(self):
+        """
+        日次データキャッシュの統計情報を取得
+        
+        Returns:
+            dict: ヒット数・ミス数・無効化数・破棄数・エントリ数・ヒット率
+        """
+        return self.frame_cache.get_statistics()
+    
+    def get_code_history(self, codes, start_date=None, end_date=None, columns=None):
+        """
+        指定銘柄の期間データを取得
+        
+        Args:
+            codes (list): 証券コードのリスト
+            start_date (str): 開始日（YYYY-MM-DD形式）
+            end_date (str): 終了日（YYYY-MM-DD形式）
+            columns (list): 取得する列名のリスト
+        
+        Returns:
+            pd.DataFrame: code, date 順のデータ
+        """
+        codes = normalize_codes(pd.Series(codes, dtype=object)).tolist()
+        if columns and 'code' not in columns:
+            columns = ['code'] + list(columns)
+        
+        archived = any(self._is_archived(date) for date in self.dates
+                       if (start_date is None or date >= start_date) and (end_date is None or date <= end_date))
+        if hasattr(self.store, 'read_code_history') and not archived:
+            return self.store.read_code_history(codes, start_date, end_date, columns)
+        
+        data = self.get_time_series_data(start_date, end_date, columns)
+        if data.empty:
+            return data
+        
+        data = data[data['code'].isin(codes)]
+        return data.sort_values(['code', 'date']).reset_index(drop=True)
+    
+    def get_cross_section(self, date=None, columns=None):
+        """
+        指定日の全銘柄のデータを取得
+        
+        Args:
+            date (str): 日付（YYYY-MM-DD形式、Noneの場合は最新日）
+            columns (list): 取得する列名のリスト
+        
+        Returns:
+            pd.DataFrame: データ（存在しない場合は空）
+        """
+        if date is None:
+            available_dates = self.get_available_dates()
+            if not available_dates:
+                return pd.DataFrame()
+            date = available_dates[0]
+        
+        data = self._source(date).read(date, columns)
+        if data is None:
+            return pd.DataFrame()
+        
+        data['date'] = date
+        return data
+    
+    def get_latest_per_code(self, columns=None):
+        """
+        銘柄ごとに最新日のデータを取得
+        
+        Args:
+            columns (list): 取得する列名のリスト
+        
+        Returns:
+            pd.DataFrame: 銘柄ごとに1行のデータ
+        """
+        if columns and 'code' not in columns:
+            columns = ['code'] + list(columns)
+        
+        if hasattr(self.store, 'read_latest_per_code'):
+            return self.store.read_latest_per_code(columns)
+        
+        data = self.get_time_series_data(columns=columns)
+        if data.empty:
+            return data
+        
+        return data.sort_values('date').drop_duplicates('code', keep='last').sort_values('code').reset_index(drop=True)
+    
+    def get_rollups(self, granularity='daily', start_date=None, end_date=None, scope=RollupStore.ALL, metrics=None):
         """
-        古いファイルを削除
+        集計表を取得（集計が未登録の日付があれば先に集計する）
         
         Args:
-            keep_days (int): 保持する日数
+            granularity (str): 'daily'、'weekly' または 'monthly'
+            start_date (str): 開始日（YYYY-MM-DD形式）
+            end_date (str): 終了日（YYYY-MM-DD形式）
+            scope (str): 'all'（市場全体）または33業種区分（Noneの場合はすべて）
+            metrics (list): 指標のリスト
+        
+        Returns:
+            pd.DataFrame: date, scope, metric, count, sum, sum_sq, mean, median, std 列の集計行
+        """
+        registered = self.rollups.dates()
+        missing = [date for date in self.get_available_dates() if date not in registered]
+        if missing:
+            sector_map = load_sector_map()
+            columns = ['code'] + RollupStore.METRICS
+            frames = self._read_frames(missing, columns)
+            rows = [self.rollups.compute_daily(date, data, sector_map) for date, data in frames.items() if data is not None]
+            if rows:
+                self.rollups.add_daily_rows(pd.concat(rows, ignore_index=True))
+            self.logger.info(f"集計表に{len(missing)}日分を取り込みました")
+        
+        return self.rollups.read(granularity, start_date, end_date, scope, metrics)
+    
+    def cleanup_old_files(self, keep_days=365, mode='delete'):
         """
+        古いファイルを削除、またはアーカイブに圧縮
+        
+        Args:
+            keep_days (int): 日次ファイルのまま保持する日数
+            mode (str): 'delete'（削除）または 'compact'（年別アーカイブに移して読み込み可能なまま残す）
+        """
+        if mode not in ('delete', 'compact'):
+            raise ValueError(f"未知のクリーンアップモード: {mode}")
+        
         cutoff_date = datetime.now() - timedelta(days=keep_days)
         cutoff_date_str = cutoff_date.strftime('%Y-%m-%d')
         
-        files_to_remove = []
-        for item in self.metadata['file_list']:
-            if item['date'] < cutoff_date_str:
-                files_to_remove.append(item)
-        
-        for item in files_to_remove:
-            filepath = self.history_dir / item['filename']
-            if filepath.exists():
-                filepath.unlink()
-                self.logger.info(f"古いファイルを削除しました: {item['filename']}")
-        
-        # メタデータから削除
-        self.metadata['file_list'] = [
-            item for item in self.metadata['file_list'] 
-            if item['date'] >= cutoff_date_str
-        ]
+        self._check_metadata()
+        old_items = [self.metadata['files'][date] for date in self.dates[:bisect.bisect_left(self.dates, cutoff_date_str)]]
+        files_to_remove = [item for item in old_items if not item.get('archived')]
         
-        self.metadata['total_files'] = len(self.metadata['file_list'])
-        self.metadata['data_points'] = sum(item['rows'] for item in self.metadata['file_list'])
+        with file_lock(self.writer_lock):
+            if mode == 'compact':
+                # 年ごとに読み込んでアーカイブに追記してから日次ファイルを消す
+                years = sorted({item['date'][:4] for item in files_to_remove})
+                for year in years:
+                    year_items = [item for item in files_to_remove if item['date'][:4] == year]
+                    frames = {item['date']: self.store.read(item['date']) for item in year_items}
+                    self.archive.add({date: data for date, data in frames.items() if data is not None})
+            
+            # 差分ストアでは差分をキーフレームより先に消すよう新しい日付から削除
+            for item in reversed(files_to_remove):
+                if self.store.exists(item['date']):
+                    self.store.delete(item['date'])
+                    self.logger.info(f"古いファイルを削除しました: {item['filename']}")
+                
+                if mode == 'compact' and self.archive.exists(item['date']):
+                    # メタデータにはアーカイブ先を記録して残す
+                    self._put_file(dict(item, filename=self.archive.filename(item['date']), archived=True))
+                else:
+                    # メタデータから削除
+                    self._drop_file(item['date'])
+            
+            if mode == 'delete':
+                # アーカイブ済みの古い日付も削除
+                archived_dates = [item['date'] for item in old_items if item.get('archived')]
+                self.archive.remove(archived_dates)
+                for date in archived_dates:
+                    self._drop_file(date)
+                self.rollups.remove([item['date'] for item in old_items])
+            
+            # キーフレームの削除で基準が付け替わった差分のファイル名を更新
+            for item in self.metadata['files'].values():
+                if not item.get('archived') and item['filename'] != self.store.filename(item['date']):
+                    item['filename'] = self.store.filename(item['date'])
+                    self._changed_dates.add(item['date'])
         
-        self._save_metadata()
+        self.commit_metadata()
         
-        self.logger.info(f"古いファイルのクリーンアップ完了: {len(files_to_remove)}件削除")
+        action = 'アーカイブ' if mode == 'compact' else '削除'
+        self.logger.info(f"古いファイルのクリーンアップ完了: {len(files_to_remove)}件{action}")
     
     def get_statistics(self):
         """
@@ -223,7 +595,8 @@ class DataManager:
         Returns:
             dict: 統計情報
         """
-        if not self.metadata['file_list']:
+        self._check_metadata()
+        if not self.dates:
             return {
                 'total_files': 0,
                 'total_data_points': 0,
@@ -231,17 +604,16 @@ class DataManager:
                 'average_daily_records': 0
             }
         
-        dates = [item['date'] for item in self.metadata['file_list']]
-        total_records = sum(item['rows'] for item in self.metadata['file_list'])
+        total_records = self.metadata['data_points']
         
         return {
-            'total_files': len(self.metadata['file_list']),
+            'total_files': len(self.dates),
             'total_data_points': total_records,
             'date_range': {
-                'start': min(dates),
-                'end': max(dates)
+                'start': self.dates[0],
+                'end': self.dates[-1]
             },
-            'average_daily_records': total_records / len(self.metadata['file_list']) if self.metadata['file_list'] else 0
+            'average_daily_records': total_records / len(self.dates)
         }
 
 def main():
@@ -1,80 +1,304 @@
 import pandas as pd
 import os
+import hashlib
 import pickle
-from datetime import datetime, timedelta
+import argparse
+from pathlib import Path
+from src.config import config
+from src.frame_schema import apply_schema, get_schema_statistics
+from src.indicators import SECTOR_INDICATORS, add_row_indicators, add_sector_indicators
+from src.output_store import OutputStore
+from src.sector_master import SectorMaster
+from src.storage import atomic_write, file_hash
 
-def get_cache_path():
-    """キャッシュファイルのパスを取得"""
-    return 'data/processed_data_cache.pkl'
+try:
+    import pyarrow  # noqa: F401 (Parquetでのキャッシュ保存に使用)
+except ImportError:
+    pyarrow = None
 
-def is_cache_valid():
-    """キャッシュが有効かどうかをチェック（24時間以内）"""
-    cache_path = get_cache_path()
-    if not os.path.exists(cache_path):
-        return False
-    
-    # キャッシュファイルの更新時刻をチェック
-    cache_time = datetime.fromtimestamp(os.path.getmtime(cache_path))
-    return datetime.now() - cache_time < timedelta(hours=24)
+# 処理内容を変えたら上げる（キャッシュのキーに含まれ、古い処理結果は使われなくなる）
+PROCESSING_VERSION = 5
+
+CACHE_DIR = Path('data/processed_cache')
+
+# 入力行の内容のハッシュを保持する列（差分処理で前回の結果と比較する）
+ROW_HASH_COLUMN = '_row_hash'
 
-def save_cache(data):
-    """データをキャッシュに保存"""
-    cache_path = get_cache_path()
-    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
-    with open(cache_path, 'wb') as f:
-        pickle.dump(data, f)
+def get_cache_key(sector_master):
+    """入力（output.csvとジャーナル、業種マスタ）の内容と処理バージョンから決まるキャッシュキー"""
+    output_store = OutputStore('data/output.csv')
+    master_path = sector_master.ensure()
+    parts = [
+        f"v{PROCESSING_VERSION}",
+        file_hash(output_store.path),
+        file_hash(output_store.journal_path),
+        file_hash(master_path) if master_path else '',
+    ]
+    return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()[:32]
 
-def load_cache():
-    """キャッシュからデータを読み込み"""
-    cache_path = get_cache_path()
-    with open(cache_path, 'rb') as f:
-        return pickle.load(f)
+def get_cache_path(key):
+    """キャッシュファイルのパスを取得（pyarrowがあればParquet、なければpickle）"""
+    suffix = 'parquet' if pyarrow is not None else 'pkl'
+    return CACHE_DIR / f"v{PROCESSING_VERSION}-{key}.{suffix}"
 
-def process_data():
+def load_previous_state():
     """
-    データの処理（キャッシュ機能付き）
+    同じ処理バージョンで最後に使われた処理結果（差分処理の基準）
+
+    Returns:
+        tuple: (キャッシュキー, 処理結果)（ない場合は (None, None)）
     """
-    # キャッシュが有効な場合はキャッシュを使用
-    if is_cache_valid():
-        print("有効なキャッシュを使用します")
-        return load_cache()
-    
-    print("データを処理中...")
-    
-    # データの読み込みとマージ
-    scraping_df = pd.read_csv('data/output.csv')
+    entries = sorted(
+        (p for p in CACHE_DIR.glob(f"v{PROCESSING_VERSION}-*") if p.suffix in ('.parquet', '.pkl')),
+        key=lambda p: p.stat().st_mtime, reverse=True
+    )
+    for path in entries:
+        key = path.name.split('-', 1)[1].rsplit('.', 1)[0]
+        previous = load_cache(key)
+        if previous is not None and ROW_HASH_COLUMN in previous.columns:
+            return key, previous
+    return None, None
 
+def save_cache(key, merged_df):
+    """処理結果をキャッシュに保存し、古いエントリを削除"""
+    cache_path = get_cache_path(key)
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    with atomic_write(cache_path, 'wb') as f:
+        if cache_path.suffix == '.parquet':
+            merged_df.to_parquet(f, index=False)
+        else:
+            pickle.dump(merged_df, f, protocol=pickle.HIGHEST_PROTOCOL)
+    evict_cache()
+
+def load_cache(key):
+    """キャッシュから処理結果を読み込み（ない場合はNone）。使用した時刻を更新時刻として記録する"""
+    cache_path = get_cache_path(key)
+    if not cache_path.exists():
+        return None
+
+    try:
+        if cache_path.suffix == '.parquet':
+            merged_df = pd.read_parquet(cache_path)
+        else:
+            with open(cache_path, 'rb') as f:
+                merged_df = pickle.load(f)
+    except Exception as e:
+        print(f"キャッシュの読み込みに失敗したため再処理します: {e}")
+        return None
+
+    os.utime(cache_path)
+    return merged_df
+
+def evict_cache(max_entries=None):
+    """最近使われていないキャッシュから削除し、max_entries件までにする"""
+    max_entries = max_entries or config.processing_cache_size
+    entries = sorted(
+        (p for p in CACHE_DIR.glob('*') if p.suffix in ('.parquet', '.pkl')),
+        key=lambda p: p.stat().st_mtime, reverse=True
+    )
+    for stale in entries[max_entries:]:
+        stale.unlink()
+
+# 欠損していると表示できない列（欠損した行は業種ごとのデータから除く）
+REQUIRED_COLUMNS = ['expected_roe', 'expected_per', 'price', 'expected_dividend_yield']
+
+def valid_rows(data):
+    """必須列がそろっている（表示・業種内の比較の対象になる）行"""
+    return data[REQUIRED_COLUMNS].notna().all(axis=1)
+
+def split_by_sector(merged_df):
+    """業種ごとのデータに分割（欠損値のある行は除く）"""
+    merged_df = merged_df[valid_rows(merged_df)].drop(columns=[ROW_HASH_COLUMN], errors='ignore')
+    grouped_data = {}
+    for genre, group_df in merged_df.groupby('33業種区分', observed=True):
+        grouped_data[genre] = group_df
+    return grouped_data
+
+def row_hashes(data):
+    """
+    行の内容のハッシュ（uint64）
+
+    読み込み方によって列の型が変わっても（空の列がfloatかobjectか等）同じ値になるよう、
+    数値列はfloat64、それ以外は文字列にそろえてからハッシュする。
+    """
+    canonical = {}
+    for column in sorted(c for c in data.columns if c != ROW_HASH_COLUMN):
+        values = data[column]
+        if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            canonical[column] = values.astype('float64')
+        else:
+            numeric = pd.to_numeric(values, errors='coerce')
+            if values.isna().all() or numeric.notna().sum() == values.notna().sum():
+                canonical[column] = numeric.astype('float64')
+            else:
+                canonical[column] = values.astype(object).where(values.notna(), None).astype(str)
+    return pd.util.hash_pandas_object(pd.DataFrame(canonical, index=data.index), index=False).to_numpy()
+
+def derive_columns(data):
+    """
+    行単位の指標の計算（変更された行だけに適用できる）
+
+    欠損値のある行も残し、前回の処理結果として行ハッシュを比較できるようにする。
+    """
+    # 理論PBR（pbr_indicator）・益利回り・PBRギャップ
+    return add_row_indicators(data)
+
+def derive_sector_columns(data, sectors=None):
+    """
+    業種内の相対指標の計算（業種単位で計算し直す）
+
+    Args:
+        data (pd.DataFrame): 行単位の指標を計算済みのデータ
+        sectors (set): 計算し直す業種（Noneの場合はすべて）
+    """
+    if sectors is None:
+        return add_sector_indicators(data, mask=valid_rows(data))
+
+    target = data['33業種区分'].isin(sectors)
+    if target.any():
+        subset = add_sector_indicators(data[target], mask=valid_rows(data[target]))
+        data.loc[target, SECTOR_INDICATORS] = subset[SECTOR_INDICATORS]
+    return data
+
+def load_input(sector_master):
+    """output.csv（ジャーナルを含む）を読み込み、型をそろえて業種を付与"""
+    # 部分実行の結果（ジャーナル）も反映した最新の値を読む
+    return prepare_input(OutputStore('data/output.csv').read(), sector_master)
+
+def prepare_input(scraping_df, sector_master):
+    """取得結果の型をそろえて業種と行ハッシュを付与（ファイルを経由せずに渡す場合も使う）"""
     # 列名の正規化（想定列がそろっているか最終チェック）
     expected_columns = ['code', 'name', 'price', 'expected_roe', 'expected_per', 'expected_dividend_yield', 'actual_pbr']
     missing_columns = [c for c in expected_columns if c not in scraping_df.columns]
     if missing_columns:
         raise ValueError(f"data/output.csv に必須列がありません: {missing_columns}")
 
-    # 証券コードを4桁文字列に正規化
-    scraping_df['code'] = scraping_df['code'].astype(str).str.strip().str.replace(".0", "", regex=False)
-    scraping_df['code'] = scraping_df['code'].apply(lambda x: str(int(x)).zfill(4) if x.isdigit() else x)
-    
-    type_data = pd.read_excel('data/data_j.xls')
-    # 業種データのコード列も文字列に統一
-    type_data['コード'] = type_data['コード'].astype(str).str.strip().str.replace(".0", "", regex=False)
-    type_data['コード'] = type_data['コード'].apply(lambda x: str(int(x)).zfill(4) if x.isdigit() else x)
-    
-    merged_df = pd.merge(scraping_df, type_data[['コード', '33業種区分']], left_on='code', right_on='コード', how='left')
-    merged_df.drop('コード', axis=1, inplace=True)
+    # 証券コードを4桁文字列、指標をfloat32にそろえる
+    # （apply_schema は渡したDataFrameを書き換えるため、呼び出し元のDataFrameはコピーしてから渡す）
+    scraping_df = apply_schema(scraping_df.copy(), report=True, label='output.csv')
+    scraping_df = scraping_df.assign(**{'33業種区分': sector_master.lookup(scraping_df['code']).astype('category')})
 
-    # 欠損値処理
-    merged_df.dropna(subset=['expected_roe', 'expected_per', 'price', 'expected_dividend_yield'], inplace=True)
+    # 差分処理のため、入力行の内容のハッシュを持たせる
+    return scraping_df.assign(**{ROW_HASH_COLUMN: row_hashes(scraping_df)})
 
-    # PBR指標の追加
-    merged_df['pbr_indicator'] = merged_df['expected_roe'] * merged_df['expected_per'] / 100
+def process_incremental(scraping_df, previous):
+    """
+    前回の処理結果との差分だけを処理
 
-    # データの分割
-    grouped_data = {}
-    for genre, group_df in merged_df.groupby('33業種区分'):
-        grouped_data[genre] = group_df
+    証券コードと行ハッシュが前回と同じ行は前回の結果をそのまま使い、
+    変わった行（新規・更新）だけ行単位の指標を計算する。業種内の指標は
+    呼び出し側で影響を受けた業種だけ計算し直す。
+
+    Returns:
+        tuple: (処理結果, 影響を受けた業種の集合)
+    """
+    previous = previous.set_index('code')
+    previous_hash = previous[ROW_HASH_COLUMN].reindex(scraping_df['code'])
+    unchanged = previous_hash.to_numpy() == scraping_df[ROW_HASH_COLUMN].to_numpy()
+
+    changed_rows = scraping_df[~unchanged]
+    removed_codes = previous.index.difference(scraping_df['code'])
+    touched_codes = previous.index.intersection(pd.Index(changed_rows['code']).append(removed_codes))
+
+    affected = set(changed_rows['33業種区分'].dropna()) | set(previous.loc[touched_codes, '33業種区分'].dropna())
+    print(f"差分処理: 変更{len(changed_rows)}件, 削除{len(removed_codes)}件, 影響する業種{len(affected)}件")
+
+    # 入力の並び順を保って前回の結果と新しい計算結果を合わせる
+    kept = previous.loc[scraping_df.loc[unchanged, 'code']].reset_index()
+    kept.index = scraping_df.index[unchanged]
+    merged_df = pd.concat([kept, derive_columns(changed_rows)]).sort_index()
+    merged_df['33業種区分'] = merged_df['33業種区分'].astype('category')
+
+    # 列の並びは全件処理と同じ（入力の列の後に派生列）にする
+    columns = list(scraping_df.columns)
+    columns += [c for c in merged_df.columns if c not in columns]
+    return merged_df[columns], affected
+
+# 直前に返した処理結果（キャッシュキー → 業種ごとのデータ）。差分処理で影響のない業種のデータを使い回す
+_LAST_GROUPS = {}
+
+def process_frame(scraping_df, incremental=True):
+    """
+    prepare_input 済みの取得結果を処理（キャッシュの保存はしない）
+
+    Args:
+        scraping_df (pd.DataFrame): prepare_input の戻り値
+        incremental (bool): 前回の処理結果との差分だけを処理するか
+
+    Returns:
+        tuple: (処理結果, 業種ごとのデータ)
+    """
+    previous_key, previous = load_previous_state() if incremental else (None, None)
+    if previous is None:
+        merged_df = derive_sector_columns(derive_columns(scraping_df))
+        return merged_df, split_by_sector(merged_df)
+
+    merged_df, affected = process_incremental(scraping_df, previous)
+    merged_df = derive_sector_columns(merged_df, affected)
+
+    # 影響を受けた業種だけ分割し直し、ほかは前回の結果の分割済みデータを使い回す
+    reusable = _LAST_GROUPS.get('groups') if _LAST_GROUPS.get('key') == previous_key else None
+    if reusable is None:
+        return merged_df, split_by_sector(merged_df)
+
+    sectors = merged_df['33業種区分']
+    grouped_data = {genre: frame for genre, frame in reusable.items() if genre not in affected}
+    valid = merged_df[REQUIRED_COLUMNS].notna().all(axis=1)
+    for genre in affected:
+        group_df = merged_df[valid & (sectors == genre)].drop(columns=[ROW_HASH_COLUMN])
+        if not group_df.empty:
+            grouped_data[genre] = group_df
+    return merged_df, dict(sorted(grouped_data.items()))
+
+def store_result(key, merged_df, grouped_data):
+    """処理結果をキャッシュに保存し、次回の差分処理で使い回せるよう記録"""
+    save_cache(key, merged_df)
+    _LAST_GROUPS.update(key=key, groups=grouped_data)
+
+def process_data(incremental=True):
+    """
+    データの処理（キャッシュ機能付き）
+
+    Args:
+        incremental (bool): キャッシュと前回の処理結果を使うか（Falseの場合はキャッシュがあっても全件を処理し直す）
+    """
+    # 入力の内容と処理バージョンが同じならキャッシュを使用
+    # 業種マスタは data_j.xls が変わった場合だけ作り直される
+    sector_master = SectorMaster()
+    key = get_cache_key(sector_master)
+    if incremental and _LAST_GROUPS.get('key') == key:
+        print("有効なキャッシュを使用します")
+        return dict(_LAST_GROUPS['groups'])
+    cached = load_cache(key) if incremental else None
+    if cached is not None:
+        print("有効なキャッシュを使用します")
+        grouped_data = split_by_sector(cached)
+        _LAST_GROUPS.update(key=key, groups=grouped_data)
+        return dict(grouped_data)
+    
+    print("データを処理中...")
+    saved_before = get_schema_statistics()['bytes_saved']
+    
+    # データの読み込みと業種の付与
+    merged_df, grouped_data = process_frame(load_input(sector_master), incremental)
 
     # 結果をキャッシュに保存
-    save_cache(grouped_data)
-    print("データ処理完了、キャッシュに保存しました")
+    store_result(key, merged_df, grouped_data)
+    saved = get_schema_statistics()['bytes_saved'] - saved_before
+    print(f"データ処理完了、キャッシュに保存しました（型の最適化で{saved / 1024:.1f}KB削減）")
     
-    return grouped_data
\ No newline at end of file
+    return dict(grouped_data)
+
+def main():
+    """
+    メイン実行関数
+    """
+    parser = argparse.ArgumentParser(description='data/output.csv を業種ごとに処理してキャッシュに保存')
+    parser.add_argument('--full', action='store_true', help='キャッシュと前回の処理結果を使わずに全件を処理し直す')
+    args = parser.parse_args()
+
+    grouped_data = process_data(incremental=not args.full)
+    print(f"{len(grouped_data)}業種, {sum(len(df) for df in grouped_data.values())}銘柄")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import threading
+from collections import OrderedDict
+
+class FrameCache:
+    """
+    読み込み済みの日次データを保持するLRUキャッシュクラス
+
+    エントリはファイルの (更新時刻, サイズ) と一緒に保存し、取得時に
+    ファイルが変わっていれば無効として扱う。複数スレッドから利用できる。
+    """
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'evictions': 0}
+
+    @staticmethod
+    def file_stamp(path):
+        """
+        ファイルの (更新時刻, サイズ)。存在しない場合はNone
+        """
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self, key, stamp):
+        """
+        キャッシュから取得
+
+        Args:
+            key (tuple): キー
+            stamp (tuple): 現在のファイルの (更新時刻, サイズ)
+
+        Returns:
+            pd.DataFrame: データ（ない場合・ファイルが変わっている場合はNone）
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+
+            if stamp is None or entry[0] != stamp:
+                del self._entries[key]
+                self.stats['invalidations'] += 1
+                self.stats['misses'] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[1]
+
+    def set(self, key, stamp, frame):
+        """
+        キャッシュに保存（上限を超えた場合は最も古く使われたエントリを破棄）
+        """
+        if self.max_entries <= 0 or stamp is None:
+            return
+
+        with self._lock:
+            self._entries[key] = (stamp, frame)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_statistics(self):
+        """
+        キャッシュ統計情報を取得
+
+        Returns:
+            dict: 統計情報
+        """
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {
+                **self.stats,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hit_rate': self.stats['hits'] / lookups if lookups else 0.0
+            }
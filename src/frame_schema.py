@@ -0,0 +1,129 @@
+"""
+スクレイピング結果・日次データの列の型をそろえる読み込み層
+
+- code: 4桁の文字列（"1301"、1301.0、" 01301" はすべて "1301"）
+- 指標列: float32
+- 業種など値の種類が少ない文字列列: カテゴリ型
+
+変換はすべて列単位のベクトル演算で行い、行ごとの apply は使わない。
+"""
+import numpy as np
+import pandas as pd
+import logging
+
+# float32で保持する指標列
+METRIC_COLUMNS = [
+    'price', 'last_price', 'expected_per', 'expected_dividend_yield',
+    'expected_roe', 'actual_pbr', 'pbr_indicator'
+]
+
+# カテゴリ型で保持する列
+CATEGORY_COLUMNS = ['33業種区分']
+
+logger = logging.getLogger(__name__)
+
+# 型変換で削減したメモリの累計（報告を有効にした変換のみ）
+_STATISTICS = {'frames': 0, 'bytes_before': 0, 'bytes_after': 0}
+
+def normalize_codes(codes):
+    """
+    証券コードの列を4桁の文字列にそろえる（ベクトル化版）
+
+    "1301"、1301、1301.0、" 01301"、j-Quantsの5桁コード "13010" はすべて "1301" になる。
+    数字以外を含むコード（例: "130A"、"130A0"）は jquants_client.normalize_code と同じく
+    末尾の0を落とす以外は前後の空白だけを取り除く。欠損値は欠損のまま返す。
+
+    Args:
+        codes (pd.Series): 証券コードの列
+
+    Returns:
+        pd.Series: 正規化した証券コード
+    """
+    codes = pd.Series(codes)
+    missing = codes.isna()
+    text = codes.astype(str).str.strip().str.replace(r'\.0$', '', regex=True)
+    text = text.where(~((text.str.len() == 5) & text.str.endswith('0')), text.str[:4])
+    digits = text.str.isdigit()
+    normalized = text.str.lstrip('0').str.zfill(4)
+    result = pd.Series(np.where(digits, normalized, text), index=codes.index, dtype=object)
+    return result.mask(missing, np.nan)
+
+def apply_schema(data, code_column='code', code_dtype='string', report=False, label=None):
+    """
+    DataFrameの列の型をスキーマにそろえる（渡したDataFrameを書き換えて返す）
+
+    Args:
+        data (pd.DataFrame): データ
+        code_column (str): 証券コードの列名
+        code_dtype (str): 証券コードの型（'string' または 'category'）
+        report (bool): 削減したメモリをログに出すか（DEBUGログが有効な場合は常に出す）
+        label (str): ログに出すデータの名前
+
+    Returns:
+        pd.DataFrame: 型をそろえたデータ
+    """
+    if data is None or data.empty:
+        return data
+
+    report = report or logger.isEnabledFor(logging.DEBUG)
+    if report:
+        before = int(data.memory_usage(deep=True).sum())
+
+    if code_column in data.columns:
+        data[code_column] = normalize_codes(data[code_column]).astype(code_dtype)
+
+    for column in METRIC_COLUMNS:
+        if column in data.columns and data[column].dtype != np.float32:
+            data[column] = pd.to_numeric(data[column], errors='coerce').astype(np.float32)
+
+    for column in CATEGORY_COLUMNS:
+        if column in data.columns and not isinstance(data[column].dtype, pd.CategoricalDtype):
+            data[column] = data[column].astype('category')
+
+    if report:
+        after = int(data.memory_usage(deep=True).sum())
+        _STATISTICS['frames'] += 1
+        _STATISTICS['bytes_before'] += before
+        _STATISTICS['bytes_after'] += after
+        saved = before - after
+        logger.info(
+            f"{label or 'データ'}: {before / 1024:.1f}KB → {after / 1024:.1f}KB"
+            f"（{saved / 1024:.1f}KB削減, {saved / before * 100 if before else 0:.0f}%）"
+        )
+
+    return data
+
+def read_typed_csv(filepath_or_buffer, columns=None, code_dtype='string', report=False, label=None, **kwargs):
+    """
+    CSVを読み込み、列の型をスキーマにそろえる
+
+    Args:
+        filepath_or_buffer (str or Path or file-like): CSV
+        columns (list): 読み込む列（Noneの場合はすべて。存在しない列は無視）
+        code_dtype (str): 証券コードの型（'string' または 'category'）
+        report (bool): 削減したメモリをログに出すか
+        label (str): ログに出すデータの名前
+        **kwargs: pd.read_csv に渡す引数
+
+    Returns:
+        pd.DataFrame: 型をそろえたデータ
+    """
+    kwargs.setdefault('encoding', 'utf-8-sig')
+    dtype = kwargs.pop('dtype', {}) or {}
+    # 証券コードは数値として解釈させない（"0072" や "130A" を保つ）
+    dtype = {'code': str, **dtype}
+    usecols = (lambda c: c in columns) if columns else None
+
+    data = pd.read_csv(filepath_or_buffer, usecols=usecols, dtype=dtype, **kwargs)
+    return apply_schema(data, code_dtype=code_dtype, report=report, label=label or str(filepath_or_buffer))
+
+def get_schema_statistics():
+    """
+    型変換で削減したメモリの累計
+
+    Returns:
+        dict: 変換したデータ数と変換前後のバイト数
+    """
+    stats = dict(_STATISTICS)
+    stats['bytes_saved'] = stats['bytes_before'] - stats['bytes_after']
+    return stats
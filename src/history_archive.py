@@ -0,0 +1,198 @@
+import gzip
+import io
+import json
+import os
+from pathlib import Path
+import logging
+from src.frame_schema import read_typed_csv
+from src.storage import atomic_write, write_json_atomic
+
+class HistoryArchive:
+    """
+    保持期間を過ぎた日次データを年ごとの圧縮アーカイブにまとめるクラス
+
+    archive/history_YYYY.csv.gz には1日分のCSVを1つのgzipメンバーとして追記し、
+    history_YYYY.index.json に日付ごとの (オフセット, 長さ, 行数) を記録する。
+    インデックスが正本のため、追記途中で中断しても未登録の末尾は無視される。
+    1日分の読み込みはインデックスの位置から該当メンバーだけを展開する。
+    アーカイブ済みの日付を置き換える場合は、詰め直した本体を別名
+    （history_YYYY.rN.csv.gz）で書いてからインデックスを切り替えるため、
+    途中で中断してもインデックスと本体の対応は崩れない。
+    """
+
+    def __init__(self, archive_dir):
+        self.archive_dir = Path(archive_dir)
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        self.logger = logging.getLogger(__name__)
+        self._indexes = {}
+
+    def archive_path(self, year):
+        """
+        年のアーカイブ本体のパス（インデックスが参照している世代のファイル）
+        """
+        self._load_index(year)
+        cached = self._indexes.get(year)
+        name = cached[2] if cached is not None else None
+        return self.archive_dir / (name or f"history_{year}.csv.gz")
+
+    def index_path(self, year):
+        return self.archive_dir / f"history_{year}.index.json"
+
+    def filename(self, date):
+        """
+        日付を含むアーカイブのファイル名（履歴ディレクトリからの相対パス）
+        """
+        return f"{self.archive_dir.name}/{self.archive_path(date[:4]).name}"
+
+    def path(self, date):
+        return self.archive_path(date[:4])
+
+    def _load_index(self, year):
+        """
+        アーカイブのインデックスを読み込み（更新時刻が変わらない限りメモリ上のものを使う）
+        """
+        index_path = self.index_path(year)
+        if not index_path.exists():
+            return {}
+
+        mtime = index_path.stat().st_mtime_ns
+        cached = self._indexes.get(year)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        with open(index_path, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+        index = saved['dates']
+        self._indexes[year] = (mtime, index, saved.get('file'))
+        return index
+
+    def _save_index(self, year, index, file_name=None):
+        """
+        インデックスを保存（file_name を指定した場合は参照する本体を切り替える）
+        """
+        index_path = self.index_path(year)
+        file_name = file_name or self.archive_path(year).name
+        write_json_atomic({'file': file_name, 'dates': dict(sorted(index.items()))}, index_path,
+                          separators=(',', ':'))
+        self._indexes[year] = (index_path.stat().st_mtime_ns, index, file_name)
+
+    def _next_archive_path(self, year):
+        """
+        詰め直した本体を書く、現在の世代の次のファイルのパス
+        """
+        current = self.archive_path(year).name
+        parts = current.split('.')
+        generation = int(parts[1][1:]) + 1 if len(parts) == 4 and parts[1].startswith('r') else 1
+        return self.archive_dir / f"history_{year}.r{generation}.csv.gz"
+
+    def _remove_stale_files(self, year):
+        """
+        インデックスが参照していない世代の本体を削除
+        """
+        current = self.archive_path(year)
+        for path in self.archive_dir.glob(f"history_{year}*.csv.gz"):
+            if path != current:
+                path.unlink()
+
+    def dates(self):
+        """
+        アーカイブ済みの日付（昇順）
+        """
+        dates = []
+        for index_path in self.archive_dir.glob("history_*.index.json"):
+            dates.extend(self._load_index(index_path.name[8:12]))
+        return sorted(dates)
+
+    def exists(self, date):
+        return date in self._load_index(date[:4])
+
+    def add(self, frames):
+        """
+        日次データをアーカイブに追加（アーカイブ済みの日付は置き換え）
+
+        Args:
+            frames (dict): 日付 → データ
+
+        Returns:
+            int: 追加した日数
+        """
+        by_year = {}
+        for date, data in frames.items():
+            by_year.setdefault(date[:4], {})[date] = data
+
+        for year, year_frames in by_year.items():
+            index = dict(self._load_index(year))
+            members = {
+                date: (gzip.compress(data.to_csv(index=False).encode('utf-8')), len(data))
+                for date, data in sorted(year_frames.items())
+            }
+
+            if any(date in index for date in year_frames):
+                # 置き換えがある場合は、残す日付と新しい日付を次の世代のファイルに詰め直し、
+                # 書き終えてからインデックスを切り替える（切り替え前に中断しても元の本体とインデックスが残る）
+                kept = {date: self._read_member(year, index[date]) for date in index if date not in year_frames}
+                archive_path = self._next_archive_path(year)
+                index = {}
+                with atomic_write(archive_path, 'wb') as f:
+                    for date, member in sorted({**kept, **members}.items()):
+                        index[date] = [f.tell(), len(member[0]), member[1]]
+                        f.write(member[0])
+                self._save_index(year, index, archive_path.name)
+                self._remove_stale_files(year)
+            else:
+                archive_path = self.archive_path(year)
+                with open(archive_path, 'ab') as f:
+                    # 前回中断した書き込みの残りがあれば、その後ろに追記する（インデックスに載らないため無害）
+                    f.seek(0, os.SEEK_END)
+                    for date, member in members.items():
+                        index[date] = [f.tell(), len(member[0]), member[1]]
+                        f.write(member[0])
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._save_index(year, index)
+
+            self.logger.info(f"{len(year_frames)}日分を{archive_path.name}にアーカイブしました")
+
+        return len(frames)
+
+    def _read_member(self, year, entry):
+        """
+        アーカイブから1日分の圧縮データをそのまま取り出す
+
+        Returns:
+            tuple: (gzipメンバーのバイト列, 行数)
+        """
+        offset, length, rows = entry
+        with open(self.archive_path(year), 'rb') as f:
+            f.seek(offset)
+            return f.read(length), rows
+
+    def read(self, date, columns=None):
+        """
+        アーカイブから1日分のデータを読み込み
+
+        Returns:
+            pd.DataFrame: データ（アーカイブにない場合はNone）
+        """
+        entry = self._load_index(date[:4]).get(date)
+        if entry is None:
+            return None
+
+        member, _ = self._read_member(date[:4], entry)
+        return read_typed_csv(io.BytesIO(gzip.decompress(member)), columns, encoding='utf-8', label=date)
+
+    def remove(self, dates):
+        """
+        日付をアーカイブのインデックスから外す（本体は次の置き換え時に詰め直される）
+        """
+        by_year = {}
+        for date in dates:
+            by_year.setdefault(date[:4], []).append(date)
+
+        for year, year_dates in by_year.items():
+            index = dict(self._load_index(year))
+            if not any(date in index for date in year_dates):
+                continue
+            for date in year_dates:
+                index.pop(date, None)
+            self._save_index(year, index)
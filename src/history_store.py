@@ -0,0 +1,682 @@
+import pandas as pd
+import io
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+from pathlib import Path
+import logging
+from src.config import config
+from src.frame_schema import apply_schema, normalize_codes, read_typed_csv
+from src.string_dictionary import StringDictionary
+from src.storage import atomic_write, write_csv_atomic
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# 文字列として保存する列（それ以外は数値列として扱う）
+TEXT_COLUMNS = [
+    'code', 'name', 'stock_name', 'current_url',
+    'last_news_text', 'last_news_url',
+    'last_disclosure', 'last_disclosure_text', 'last_disclosure_url'
+]
+
+class CsvHistoryStore:
+    """
+    日次データを1日1ファイルのCSVで保存するストア
+    """
+
+    name = 'csv'
+
+    # 1日1ファイルのため、DataManagerが日単位でキャッシュ・並列読み込みする
+    cache_frames = True
+
+    def __init__(self, history_dir):
+        self.history_dir = Path(history_dir)
+        self.logger = logging.getLogger(__name__)
+
+    def filename(self, date):
+        """
+        日付に対応するファイル名（履歴ディレクトリからの相対パス）
+        """
+        return f"daily_{date}.csv"
+
+    def path(self, date):
+        return self.history_dir / self.filename(date)
+
+    def exists(self, date):
+        return self.path(date).exists()
+
+    def write(self, date, data):
+        """
+        日次データを書き込み
+
+        Returns:
+            Path: 書き込んだファイル
+        """
+        filepath = self.path(date)
+        write_csv_atomic(data, filepath)
+        return filepath
+
+    def read(self, date, columns=None):
+        """
+        日次データを読み込み（列を指定した場合はその列だけを解析する）
+
+        Returns:
+            pd.DataFrame: データ（存在しない場合はNone）
+        """
+        filepath = self.path(date)
+        if not filepath.exists():
+            return None
+
+        return read_typed_csv(filepath, columns, label=filepath.name)
+
+    def read_range(self, dates, columns=None):
+        """
+        複数日のデータを読み込み、date列を付けて結合
+
+        Returns:
+            pd.DataFrame: データ
+        """
+        frames = []
+        for date in dates:
+            data = self.read(date, columns)
+            if data is not None:
+                data['date'] = date
+                frames.append(data)
+
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True)
+
+    def delete(self, date):
+        filepath = self.path(date)
+        if filepath.exists():
+            filepath.unlink()
+
+class ParquetHistoryStore(CsvHistoryStore):
+    """
+    日次データを日付でパーティション分割したParquetで保存するストア
+
+    列の型を固定して保存し、読み込み時は必要な列と日付のファイルだけを読む。
+    """
+
+    name = 'parquet'
+
+    def __init__(self, history_dir):
+        if pq is None:
+            raise ImportError("Parquetストアにはpyarrowが必要です")
+        super().__init__(history_dir)
+
+    def filename(self, date):
+        return f"parquet/date={date}/part-0.parquet"
+
+    @staticmethod
+    def prepare_frame(data):
+        """
+        保存用に列の型を揃える（文字列列はstring、それ以外は数値）
+        """
+        typed = data.copy()
+        for column in typed.columns:
+            if column in TEXT_COLUMNS:
+                typed[column] = typed[column].astype('string')
+            elif typed[column].dtype == object:
+                converted = pd.to_numeric(typed[column], errors='coerce')
+                # 数値に変換できない値が含まれる列は文字列のまま保存
+                if converted.notna().sum() == typed[column].notna().sum():
+                    typed[column] = converted
+                else:
+                    typed[column] = typed[column].astype('string')
+
+        if 'code' in typed.columns:
+            typed['code'] = normalize_codes(typed['code']).astype('string')
+        return typed
+
+    def write(self, date, data):
+        filepath = self.path(date)
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+
+        table = pa.Table.from_pandas(self.prepare_frame(data), preserve_index=False)
+        with atomic_write(filepath, 'wb') as f:
+            pq.write_table(table, f, compression='zstd')
+        return filepath
+
+    def read(self, date, columns=None):
+        filepath = self.path(date)
+        if not filepath.exists():
+            return None
+
+        if columns:
+            available = set(pq.ParquetFile(filepath).schema_arrow.names)
+            columns = [c for c in columns if c in available]
+
+        return apply_schema(pq.read_table(filepath, columns=columns or None).to_pandas())
+
+    def read_range(self, dates, columns=None):
+        tables = []
+        for date in dates:
+            filepath = self.path(date)
+            if not filepath.exists():
+                continue
+
+            read_columns = None
+            if columns:
+                available = set(pq.ParquetFile(filepath).schema_arrow.names)
+                read_columns = [c for c in columns if c in available]
+
+            table = pq.read_table(filepath, columns=read_columns)
+            tables.append(table.append_column('date', pa.array([date] * table.num_rows, pa.string())))
+
+        if not tables:
+            return pd.DataFrame()
+
+        try:
+            combined = pa.concat_tables(tables, promote_options='default')
+        except TypeError:  # pyarrow < 14
+            combined = pa.concat_tables(tables, promote=True)
+        return apply_schema(combined.to_pandas())
+
+    def delete(self, date):
+        filepath = self.path(date)
+        if filepath.exists():
+            filepath.unlink()
+            try:
+                filepath.parent.rmdir()
+            except OSError:
+                pass
+
+class SqliteHistoryStore(CsvHistoryStore):
+    """
+    日次データを1つのSQLiteデータベースに保存するストア
+
+    (code, date) と (date) にインデックスを張り、銘柄別の期間検索・
+    日付別の横断検索・銘柄ごとの最新値検索を高速に行う。
+    """
+
+    name = 'sqlite'
+
+    # 期間の読み込みは1回のクエリで済むため日単位のキャッシュは使わない
+    cache_frames = False
+
+    # クエリごとのレイテンシ目標（秒）。超えた場合は警告を出す
+    LATENCY_TARGETS = {
+        'code_history': 0.05,
+        'cross_section': 0.1,
+        'latest_per_code': 0.3,
+    }
+
+    # 1回の銘柄別クエリで渡す銘柄コードの最大数（SQLiteの変数上限は古い版で999）
+    CODE_CHUNK = 500
+
+    def __init__(self, history_dir):
+        super().__init__(history_dir)
+        self.db_path = self.history_dir / 'history.sqlite'
+        self._init_db()
+
+    def _connect(self):
+        conn = sqlite3.connect(str(self.db_path), timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """
+        1トランザクション分の接続（終了時にコミットまたはロールバックし、接続を閉じる）
+        """
+        with closing(self._connect()) as conn:
+            with conn:
+                yield conn
+
+    def _init_db(self):
+        with self._transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS history (
+                    code TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    PRIMARY KEY (code, date)
+                ) WITHOUT ROWID
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_history_date ON history (date)')
+
+    def _columns(self, conn):
+        return [row[1] for row in conn.execute('PRAGMA table_info(history)')]
+
+    def _ensure_columns(self, conn, data):
+        """
+        データに含まれる列がテーブルになければ追加
+        """
+        existing = set(self._columns(conn))
+        for column in data.columns:
+            if column not in existing:
+                column_type = 'TEXT' if column in TEXT_COLUMNS or data[column].dtype == object else 'REAL'
+                conn.execute(f'ALTER TABLE history ADD COLUMN "{column}" {column_type}')
+
+    def _select(self, conn, columns):
+        """
+        SELECT句の列リストを作成（存在しない列は除外）
+        """
+        available = self._columns(conn)
+        if columns:
+            selected = [c for c in columns if c in available and c != 'date']
+        else:
+            selected = [c for c in available if c != 'date']
+        return ', '.join(f'"{c}"' for c in selected + ['date'])
+
+    def _query(self, name, sql, params=()):
+        """
+        クエリを実行し、レイテンシ目標を超えた場合は警告する
+        """
+        started = time.perf_counter()
+        with closing(self._connect()) as conn:
+            result = apply_schema(pd.read_sql_query(sql, conn, params=params))
+        elapsed = time.perf_counter() - started
+
+        target = self.LATENCY_TARGETS.get(name)
+        if target is not None and elapsed > target:
+            self.logger.warning(f"{name}クエリがレイテンシ目標を超えました: {elapsed * 1000:.1f}ms (目標 {target * 1000:.0f}ms)")
+        return result
+
+    def filename(self, date):
+        return 'history.sqlite'
+
+    def exists(self, date):
+        with self._transaction() as conn:
+            return conn.execute('SELECT 1 FROM history WHERE date = ? LIMIT 1', (date,)).fetchone() is not None
+
+    def write(self, date, data):
+        typed = ParquetHistoryStore.prepare_frame(data) if 'code' in data.columns else data.copy()
+        typed = typed.drop(columns=['date'], errors='ignore')
+        typed.insert(1, 'date', date)
+        typed = typed.astype(object).where(typed.notna(), None)
+
+        column_list = ', '.join(f'"{c}"' for c in typed.columns)
+        placeholders = ', '.join('?' for _ in typed.columns)
+
+        # 1日分をまとめて1トランザクションで置き換える
+        with self._transaction() as conn:
+            self._ensure_columns(conn, data.assign(date=date))
+            conn.execute('DELETE FROM history WHERE date = ?', (date,))
+            conn.executemany(f'INSERT INTO history ({column_list}) VALUES ({placeholders})',
+                             typed.itertuples(index=False, name=None))
+        return self.db_path
+
+    def read(self, date, columns=None):
+        with self._transaction() as conn:
+            select = self._select(conn, columns)
+        data = self._query('cross_section', f'SELECT {select} FROM history WHERE date = ? ORDER BY code', (date,))
+        if data.empty:
+            return None
+        return data.drop(columns=['date'])
+
+    def read_range(self, dates, columns=None):
+        if not dates:
+            return pd.DataFrame()
+
+        with self._transaction() as conn:
+            select = self._select(conn, columns)
+            return apply_schema(pd.read_sql_query(
+                f'SELECT {select} FROM history WHERE date BETWEEN ? AND ? ORDER BY date, code',
+                conn, params=(min(dates), max(dates))
+            ))
+
+    def read_code_history(self, codes, start_date=None, end_date=None, columns=None):
+        """
+        指定銘柄の期間データを取得（(code, date) インデックスを使用）
+        """
+        with self._transaction() as conn:
+            select = self._select(conn, columns)
+
+        # SQLiteのパラメータ数の上限を超えないよう、銘柄を分割して問い合わせる
+        codes = list(dict.fromkeys(codes))
+        frames = []
+        for start in range(0, max(len(codes), 1), self.CODE_CHUNK):
+            chunk = codes[start:start + self.CODE_CHUNK]
+            placeholders = ', '.join('?' for _ in chunk)
+            frames.append(self._query(
+                'code_history',
+                f'SELECT {select} FROM history WHERE code IN ({placeholders}) '
+                f'AND date BETWEEN ? AND ? ORDER BY code, date',
+                (*chunk, start_date or '0000-00-00', end_date or '9999-99-99')
+            ))
+        if len(frames) == 1:
+            return frames[0]
+        return pd.concat(frames, ignore_index=True).sort_values(['code', 'date'], ignore_index=True)
+
+    def read_latest_per_code(self, columns=None):
+        """
+        銘柄ごとに最新日のデータを取得
+        """
+        with self._transaction() as conn:
+            select = ', '.join(f'h.{c}' for c in self._select(conn, columns).split(', '))
+        return self._query(
+            'latest_per_code',
+            f'SELECT {select} FROM history h '
+            f'JOIN (SELECT code, MAX(date) AS max_date FROM history GROUP BY code) m '
+            f'ON h.code = m.code AND h.date = m.max_date ORDER BY h.code'
+        )
+
+    def delete(self, date):
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM history WHERE date = ?', (date,))
+
+class DeltaCsvHistoryStore(CsvHistoryStore):
+    """
+    N日ごとに全量のキーフレームを、その間の日は差分だけを保存するストア
+
+    キーフレームは通常のCSVストアと同じ daily_YYYY-MM-DD.csv、差分は
+    delta_YYYY-MM-DD_from_<キーフレーム日>.csv.gz に (code, column, value) の
+    縦持ちで保存する。差分は常にキーフレームに対する差なので、復元は
+    キーフレームと差分1ファイルの読み込みで済む。
+    """
+
+    name = 'delta'
+
+    # 差分ファイル内のメタ情報の列名（実データの列名とは衝突しない）
+    META_BASE = '__base__'
+    META_COLUMNS = '__columns__'
+    META_ORDER = '__order__'
+    META_DELETED = '__deleted__'
+
+    def __init__(self, history_dir, keyframe_interval=7):
+        super().__init__(history_dir)
+        self.keyframe_interval = max(int(keyframe_interval), 1)
+
+    def _keyframe_path(self, date):
+        return self.history_dir / f"daily_{date}.csv"
+
+    def _delta_path(self, date):
+        matches = sorted(self.history_dir.glob(f"delta_{date}_from_*.csv.gz"))
+        return matches[0] if matches else None
+
+    def _keyframe_dates(self):
+        return sorted(p.name[6:16] for p in self.history_dir.glob("daily_*.csv"))
+
+    def _dependents(self, keyframe_date):
+        """
+        指定キーフレームを基準とする差分の日付
+        """
+        return sorted(p.name[6:16] for p in self.history_dir.glob(f"delta_*_from_{keyframe_date}.csv.gz"))
+
+    def filename(self, date):
+        delta_path = self._delta_path(date)
+        if delta_path is not None:
+            return delta_path.name
+        return self._keyframe_path(date).name
+
+    def path(self, date):
+        return self.history_dir / self.filename(date)
+
+    @staticmethod
+    def _as_text(data):
+        """
+        CSVに書いた場合と同じ文字列表現のデータに変換
+        """
+        return pd.read_csv(io.StringIO(data.to_csv(index=False)), dtype=str, keep_default_na=False)
+
+    def _read_text(self, date):
+        """
+        指定日のデータを文字列のまま復元
+        """
+        keyframe_path = self._keyframe_path(date)
+        if keyframe_path.exists():
+            return pd.read_csv(keyframe_path, dtype=str, keep_default_na=False, encoding='utf-8-sig')
+
+        delta_path = self._delta_path(date)
+        if delta_path is None:
+            return None
+
+        delta = pd.read_csv(delta_path, dtype=str, keep_default_na=False)
+        meta = delta[delta['column'].str.startswith('__')]
+        cells = delta[~delta['column'].str.startswith('__')]
+        meta_values = dict(zip(meta['column'], meta['value']))
+
+        base = pd.read_csv(self._keyframe_path(meta_values[self.META_BASE]),
+                           dtype=str, keep_default_na=False, encoding='utf-8-sig')
+        columns = meta_values[self.META_COLUMNS].split('\t') if self.META_COLUMNS in meta_values else list(base.columns)
+
+        result = base.set_index('code')
+        deleted = meta.loc[meta['column'] == self.META_DELETED, 'code']
+        result = result.drop(index=deleted)
+
+        new_codes = pd.Index(cells['code'].unique()).difference(result.index)
+        result = result.reindex(index=result.index.append(new_codes),
+                                columns=[c for c in columns if c != 'code'], fill_value='')
+
+        if not cells.empty:
+            changes = cells.pivot(index='code', columns='column', values='value')
+            result.update(changes)
+
+        if self.META_ORDER in meta_values:
+            result = result.loc[meta_values[self.META_ORDER].split('\t')]
+
+        result.index.name = 'code'
+        return result.reset_index()[columns]
+
+    def _encode(self, base, data, base_date):
+        """
+        キーフレームとの差分を (code, column, value) の縦持ちデータに変換
+        """
+        base_indexed = base.set_index('code')
+        new_indexed = data.set_index('code')
+
+        entries = [('', self.META_BASE, base_date)]
+        if list(data.columns) != list(base.columns):
+            entries.append(('', self.META_COLUMNS, '\t'.join(data.columns)))
+
+        for code in base_indexed.index.difference(new_indexed.index):
+            entries.append((code, self.META_DELETED, ''))
+
+        common = new_indexed.index.intersection(base_indexed.index, sort=False)
+        added = new_indexed.index.difference(base_indexed.index, sort=False)
+        value_columns = list(new_indexed.columns)
+
+        # 共通の銘柄は値が変わったセルだけを記録
+        aligned_base = base_indexed.reindex(index=common, columns=value_columns, fill_value='')
+        current = new_indexed.loc[common, value_columns]
+        changed = current.stack()[(current != aligned_base).stack()]
+        frames = [pd.DataFrame(entries, columns=['code', 'column', 'value'])]
+        if not changed.empty:
+            changed = changed.reset_index()
+            changed.columns = ['code', 'column', 'value']
+            frames.append(changed)
+
+        # 新規の銘柄はすべての値を記録
+        if len(added):
+            new_rows = new_indexed.loc[added, value_columns].stack().reset_index()
+            new_rows.columns = ['code', 'column', 'value']
+            frames.append(new_rows)
+
+        # 行の並びが既定（キーフレーム順＋新規銘柄）と異なる場合だけ順序を記録
+        default_order = list(base_indexed.index[base_indexed.index.isin(common)]) + list(added)
+        if list(new_indexed.index) != default_order:
+            frames.append(pd.DataFrame([('', self.META_ORDER, '\t'.join(new_indexed.index))],
+                                       columns=['code', 'column', 'value']))
+
+        return pd.concat(frames, ignore_index=True)
+
+    def _write_keyframe(self, date, text):
+        filepath = self._keyframe_path(date)
+        write_csv_atomic(text, filepath)
+        return filepath
+
+    def _write_text(self, date, text):
+        """
+        文字列表現のデータを、キーフレームまたは差分として書き込み
+        """
+        delta_path = self._delta_path(date)
+        if delta_path is not None:
+            delta_path.unlink()
+
+        # 既存のキーフレームを置き換える場合は、依存する差分を復元してから基準を付け替える
+        if self._keyframe_path(date).exists():
+            dependents = [(d, self._read_text(d)) for d in self._dependents(date)]
+            filepath = self._write_keyframe(date, text)
+            for dependent_date, dependent in dependents:
+                self._write_text(dependent_date, dependent)
+            return filepath
+
+        base_dates = [d for d in self._keyframe_dates() if d < date]
+        unique_codes = 'code' in text.columns and text['code'].is_unique
+        if (not base_dates or not unique_codes
+                or len(self._dependents(base_dates[-1])) >= self.keyframe_interval - 1):
+            return self._write_keyframe(date, text)
+
+        base_date = base_dates[-1]
+        base = pd.read_csv(self._keyframe_path(base_date), dtype=str, keep_default_na=False, encoding='utf-8-sig')
+        if 'code' not in base.columns or not base['code'].is_unique:
+            return self._write_keyframe(date, text)
+
+        filepath = self.history_dir / f"delta_{date}_from_{base_date}.csv.gz"
+        with atomic_write(filepath, 'wb') as f:
+            self._encode(base, text, base_date).to_csv(f, index=False, compression='gzip')
+        return filepath
+
+    def write(self, date, data):
+        return self._write_text(date, self._as_text(data))
+
+    def exists(self, date):
+        return self._keyframe_path(date).exists() or self._delta_path(date) is not None
+
+    def read(self, date, columns=None):
+        text = self._read_text(date)
+        if text is None:
+            return None
+
+        # 文字列から通常のCSV読み込みと同じ型で復元
+        return read_typed_csv(io.StringIO(text.to_csv(index=False)), columns, encoding='utf-8', label=date)
+
+    def delete(self, date):
+        delta_path = self._delta_path(date)
+        if delta_path is not None:
+            delta_path.unlink()
+            return
+
+        keyframe_path = self._keyframe_path(date)
+        if not keyframe_path.exists():
+            return
+
+        # キーフレームを消す場合は依存する差分を復元して書き直す
+        dependents = [(d, self._read_text(d)) for d in self._dependents(date)]
+        for dependent_date, _ in dependents:
+            self._delta_path(dependent_date).unlink()
+        keyframe_path.unlink()
+        for dependent_date, dependent in dependents:
+            self._write_text(dependent_date, dependent)
+
+class DictionaryCsvHistoryStore(CsvHistoryStore):
+    """
+    銘柄名・ニュース・開示などの文字列を共有辞書のIDに置き換えて保存するストア
+
+    日次ファイル dict_YYYY-MM-DD.csv には文字列列の代わりに整数IDを保存し、
+    文字列本体は履歴ディレクトリの strings.jsonl に1度だけ保存する。
+    読み込み時は文字列列をカテゴリ型で返す。
+    """
+
+    name = 'dict'
+
+    # 辞書で符号化する列
+    DICTIONARY_COLUMNS = [c for c in TEXT_COLUMNS if c != 'code']
+
+    def __init__(self, history_dir):
+        super().__init__(history_dir)
+        self.dictionary = StringDictionary(self.history_dir / 'strings.jsonl')
+
+    def filename(self, date):
+        return f"dict_{date}.csv"
+
+    def write(self, date, data):
+        encoded = data.copy()
+        for column in self.DICTIONARY_COLUMNS:
+            if column in encoded.columns:
+                encoded[column] = self.dictionary.encode(encoded[column])
+
+        filepath = self.path(date)
+        write_csv_atomic(encoded, filepath)
+        return filepath
+
+    def _read_encoded(self, date, columns=None):
+        """
+        文字列列をIDのまま読み込み
+        """
+        filepath = self.path(date)
+        if not filepath.exists():
+            return None
+
+        usecols = (lambda c: c in columns) if columns else None
+        dtype = {column: 'int32' for column in self.DICTIONARY_COLUMNS}
+        return pd.read_csv(filepath, encoding='utf-8-sig', usecols=usecols, dtype=dtype)
+
+    def _decode(self, data):
+        for column in self.DICTIONARY_COLUMNS:
+            if column in data.columns:
+                data[column] = self.dictionary.decode(data[column].to_numpy())
+        return apply_schema(data)
+
+    def read(self, date, columns=None):
+        data = self._read_encoded(date, columns)
+        if data is None:
+            return None
+        return self._decode(data)
+
+    def read_range(self, dates, columns=None):
+        # IDのまま結合してから一度だけ復号し、全期間で同じカテゴリを共有する
+        frames = []
+        for date in dates:
+            data = self._read_encoded(date, columns)
+            if data is not None:
+                data['date'] = date
+                frames.append(data)
+
+        if not frames:
+            return pd.DataFrame()
+        return self._decode(pd.concat(frames, ignore_index=True))
+
+def create_history_store(backend, history_dir):
+    """
+    バックエンド名からストアを作成（pyarrowがない場合はCSVにフォールバック）
+
+    Args:
+        backend (str): 'csv'、'parquet'、'sqlite'、'delta' または 'dict'
+        history_dir (Path): 履歴ディレクトリ
+
+    Returns:
+        CsvHistoryStore: ストア
+    """
+    if backend == 'parquet':
+        if pq is not None:
+            return ParquetHistoryStore(history_dir)
+        logging.getLogger(__name__).warning("pyarrowがインストールされていないためCSVストアを使用します")
+    elif backend == 'sqlite':
+        return SqliteHistoryStore(history_dir)
+    elif backend == 'delta':
+        return DeltaCsvHistoryStore(history_dir, config.history_keyframe_interval)
+    elif backend == 'dict':
+        return DictionaryCsvHistoryStore(history_dir)
+    elif backend != 'csv':
+        raise ValueError(f"未知の履歴ストア: {backend}")
+
+    return CsvHistoryStore(history_dir)
+
+def store_for_filename(filename, history_dir):
+    """
+    メタデータに記録されたファイル名から、そのファイルを扱うストアを作成
+
+    Args:
+        filename (str): メタデータのファイル名
+        history_dir (Path): 履歴ディレクトリ
+
+    Returns:
+        CsvHistoryStore: ストア
+    """
+    if filename.endswith('.parquet'):
+        return ParquetHistoryStore(history_dir)
+    if filename.endswith('.sqlite'):
+        return SqliteHistoryStore(history_dir)
+    if filename.startswith('delta_'):
+        return DeltaCsvHistoryStore(history_dir, config.history_keyframe_interval)
+    if filename.startswith('dict_'):
+        return DictionaryCsvHistoryStore(history_dir)
+    return CsvHistoryStore(history_dir)
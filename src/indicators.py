@@ -0,0 +1,135 @@
+"""
+バリュエーション指標をまとめて算出するエンジン
+
+行単位の指標（理論PBR、益利回り、PBRギャップ）はNumPyの列演算で、
+業種内の相対指標（中央値・zスコア・パーセンタイル）は groupby().transform で
+全銘柄を一度に計算する。日付の列を group_columns に加えれば、複数日の履歴も
+日付×業種ごとに同じ処理で計算できる。
+"""
+import numpy as np
+import pandas as pd
+from src.storage import write_csv_atomic
+
+SECTOR_COLUMN = '33業種区分'
+
+# 業種内の相対指標を計算する列
+SECTOR_METRICS = ['actual_pbr', 'expected_per', 'expected_roe', 'expected_dividend_yield']
+
+# 行単位の指標の列
+ROW_INDICATORS = ['pbr_indicator', 'earnings_yield', 'pbr_gap', 'pbr_gap_ratio']
+
+# 業種内の相対指標の列（指標ごとに中央値・zスコア・パーセンタイル）
+SECTOR_INDICATORS = [
+    f"{metric}_sector_{stat}" for metric in SECTOR_METRICS for stat in ('median', 'z', 'pct')
+]
+
+def _values(data, column):
+    """列をfloat64の配列として取り出す（列がなければ欠損値）"""
+    if column not in data.columns:
+        return np.full(len(data), np.nan)
+    return pd.to_numeric(data[column], errors='coerce').to_numpy(dtype='float64')
+
+def add_row_indicators(data):
+    """
+    行単位の指標を追加（変更された行だけに適用してよい）
+
+    - pbr_indicator: 期待ROE × 期待PER / 100（理論PBR）
+    - earnings_yield: 益利回り（100 / 期待PER、%。PERが正の場合のみ）
+    - pbr_gap: 実績PBR − 理論PBR
+    - pbr_gap_ratio: 実績PBR / 理論PBR − 1
+
+    Args:
+        data (pd.DataFrame): 指標列を持つデータ
+
+    Returns:
+        pd.DataFrame: 指標を追加したデータ
+    """
+    roe = _values(data, 'expected_roe')
+    per = _values(data, 'expected_per')
+    pbr = _values(data, 'actual_pbr')
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        implied = roe * per / 100
+        earnings_yield = np.where(per > 0, 100 / per, np.nan)
+        gap_ratio = np.where(implied > 0, pbr / implied - 1, np.nan)
+
+    return data.assign(
+        pbr_indicator=implied.astype(np.float32),
+        earnings_yield=earnings_yield.astype(np.float32),
+        pbr_gap=(pbr - implied).astype(np.float32),
+        pbr_gap_ratio=gap_ratio.astype(np.float32),
+    )
+
+def add_sector_indicators(data, group_columns=(SECTOR_COLUMN,), mask=None):
+    """
+    業種内の相対指標を追加
+
+    指標ごとに業種内の中央値、zスコア（(値 − 平均) / 標準偏差）、パーセンタイル（0〜1）を
+    列として追加する。mask で除外した行と業種が欠損した行は計算に含めず、欠損値になる。
+
+    Args:
+        data (pd.DataFrame): 指標列と group_columns の列を持つデータ
+        group_columns (tuple): グループ化する列（履歴の場合は ('date', '33業種区分')）
+        mask (pd.Series): 計算に含める行（Noneの場合はすべて）
+
+    Returns:
+        pd.DataFrame: 指標を追加したデータ
+    """
+    group_columns = list(group_columns)
+    metrics = [m for m in SECTOR_METRICS if m in data.columns]
+
+    included = data[group_columns].notna().all(axis=1)
+    if mask is not None:
+        included &= mask
+
+    if not metrics or not included.any():
+        return data.assign(**{column: np.float32(np.nan) for column in SECTOR_INDICATORS})
+
+    subset = data.loc[included]
+    values = subset[metrics].apply(pd.to_numeric, errors='coerce').astype('float64')
+    grouped = values.groupby([subset[c] for c in group_columns], observed=True, sort=False)
+
+    median = grouped.transform('median')
+    mean = grouped.transform('mean')
+    std = grouped.transform('std')
+    z = (values - mean) / std.where(std > 0)
+    pct = grouped.rank(pct=True)
+
+    # 計算に含めなかった行は reindex で欠損値になる
+    columns = {column: np.float32(np.nan) for column in SECTOR_INDICATORS}
+    for metric in metrics:
+        for stat, table in (('median', median), ('z', z), ('pct', pct)):
+            columns[f"{metric}_sector_{stat}"] = table[metric].reindex(data.index).astype(np.float32)
+    return data.assign(**columns)
+
+def compute_indicators(data, group_columns=(SECTOR_COLUMN,), mask=None):
+    """
+    行単位・業種内の指標をまとめて算出
+
+    Args:
+        data (pd.DataFrame): 指標列と group_columns の列を持つデータ
+        group_columns (tuple): 業種内の指標をグループ化する列
+        mask (pd.Series): 業種内の指標の計算に含める行
+
+    Returns:
+        pd.DataFrame: 指標を追加したデータ
+    """
+    return add_sector_indicators(add_row_indicators(data), group_columns, mask)
+
+def export_indicators(data, path='data/indicators.csv'):
+    """
+    銘柄ごとの指標をCSVに出力
+
+    Args:
+        data (pd.DataFrame or dict): 指標を追加したデータ（業種 → データの辞書も可）
+        path (str): 出力先
+    """
+    if isinstance(data, dict):
+        data = pd.concat(list(data.values()), ignore_index=True) if data else pd.DataFrame()
+
+    columns = ['code', 'name', SECTOR_COLUMN, *SECTOR_METRICS, *ROW_INDICATORS, *SECTOR_INDICATORS]
+    export = data[[c for c in columns if c in data.columns]]
+    if 'code' in export.columns:
+        export = export.sort_values('code')
+    write_csv_atomic(export, path, float_format='%.6g')
+    return path
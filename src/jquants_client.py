@@ -3,28 +3,69 @@ import json
 import time
 from datetime import datetime, timedelta
 import logging
+import threading
+import pandas as pd
 from src.config import config
+from src.response_cache import ResponseCache
+from src.token_store import TokenStore
+
+
+def normalize_code(code):
+    """
+    j-Quantsの5桁コード（例: 72030）を4桁の証券コードに正規化
+
+    Args:
+        code: 証券コード
+
+    Returns:
+        str: 正規化済みの証券コード
+    """
+    code = str(code).strip()
+    if code.endswith('.0'):
+        code = code[:-2]
+    if len(code) == 5 and code.endswith('0'):
+        code = code[:4]
+    return code.zfill(4) if code.isdigit() else code
+
 
 class JQuantsClient:
     """
     j-Quants APIクライアントクラス
     """
     
-    def __init__(self):
-        self.base_url = "https://api.jquants.com/v1"
+    # IDトークンの有効期限のこの時間前から再認証する
+    TOKEN_REFRESH_MARGIN = timedelta(minutes=30)
+    
+    # 429・5xx応答をリトライする際の待機時間の上限（秒）
+    MAX_RETRY_WAIT = 30
+    
+    def __init__(self, cache=None, use_cache=True):
         self.session = requests.Session()
         self.id_token = None
         self.token_expires_at = None
         
+        # リクエスト数・リトライ数の統計
+        self.request_stats = {'requests': 0, 'retries': 0, 'throttled': 0, 'errors': 0}
+        self._stats_lock = threading.Lock()
+        
         # ロガーの設定
         self.logger = logging.getLogger(__name__)
         
+        # レスポンスキャッシュ（無効化されている場合はNone）
+        if cache is None and use_cache and config.jquants_cache_enabled:
+            cache = ResponseCache()
+        self.cache = cache
+        
         # 設定の取得
         self.jquants_config = config.get_jquants_config()
+        self.base_url = self.jquants_config['base_url'].rstrip('/')
         
         if not self.jquants_config['refresh_token']:
             self.logger.error("j-Quants API設定が不完全です")
             raise ValueError("j-Quants API設定が不完全です")
+        
+        # プロセス間で共有するIDトークンストア
+        self.token_store = TokenStore(self.jquants_config['refresh_token'])
     
     def authenticate(self):
         """
@@ -39,7 +80,7 @@ class JQuantsClient:
                 'refreshtoken': self.jquants_config["refresh_token"]
             }
             
-            response = self.session.post(url, params=params, timeout=config.timeout)
+            response = self._request('post', url, params=params)
             response.raise_for_status()
             
             data = response.json()
@@ -51,6 +92,9 @@ class JQuantsClient:
             # トークンの有効期限を設定（24時間）
             self.token_expires_at = datetime.now() + timedelta(hours=24)
             
+            # 他のプロセスが再利用できるように保存
+            self.token_store.save(self.id_token, self.token_expires_at)
+            
             self.logger.info("j-Quants API認証が成功しました")
             return True
             
@@ -58,39 +102,239 @@ class JQuantsClient:
             self.logger.error(f"j-Quants API認証に失敗: {e}")
             return False
     
+    def _is_token_valid(self, expires_at):
+        """
+        IDトークンが再認証不要な期間内かどうかを判定
+        """
+        return expires_at is not None and datetime.now() < expires_at - self.TOKEN_REFRESH_MARGIN
+    
     def _ensure_authenticated(self):
         """
         認証状態を確認し、必要に応じて再認証を実行
+        
+        共有トークンストアに有効なIDトークンがあればそれを使用し、
+        有効期限が近い場合のみロックを取得して再認証する。
         """
-        if (not self.id_token or 
-            (self.token_expires_at and datetime.now() >= self.token_expires_at)):
+        if self.id_token and self._is_token_valid(self.token_expires_at):
+            return True
+        
+        stored = self.token_store.load()
+        if stored and self._is_token_valid(stored[1]):
+            self.id_token, self.token_expires_at = stored
+            self.logger.debug("共有ストアのIDトークンを使用します")
+            return True
+        
+        with self.token_store.lock():
+            # ロック待ちの間に他のプロセスが再認証していればそれを使う
+            stored = self.token_store.load()
+            if stored and self._is_token_valid(stored[1]):
+                self.id_token, self.token_expires_at = stored
+                return True
+            
             return self.authenticate()
-        return True
     
-    def get_listed_info(self):
+    def _count(self, key):
         """
-        上場企業情報を取得
+        リクエスト統計をスレッドセーフに加算
+        """
+        with self._stats_lock:
+            self.request_stats[key] += 1
+    
+    def _request(self, method, url, **kwargs):
+        """
+        HTTPリクエストを実行し、429（レート制限）と5xxは待機してリトライする
+        
+        Args:
+            method (str): 'get' または 'post'
+            url (str): URL
         
         Returns:
-            list: 上場企業情報のリスト
+            requests.Response: レスポンス
         """
-        if not self._ensure_authenticated():
-            return None
+        for attempt in range(config.max_retries + 1):
+            self._count('requests')
+            response = getattr(self.session, method)(url, timeout=config.timeout, **kwargs)
+            
+            status = response.status_code
+            if status != 429 and status < 500:
+                return response
+            
+            if status == 429:
+                self._count('throttled')
+            else:
+                self._count('errors')
+            
+            if attempt == config.max_retries:
+                break
+            
+            # Retry-Afterが指定されていれば従い、なければ指数バックオフ
+            try:
+                wait = float(response.headers.get('Retry-After'))
+            except (TypeError, ValueError):
+                wait = 0.5 * (2 ** attempt)
+            
+            self._count('retries')
+            self.logger.warning(f"HTTP {status} のため{wait:.1f}秒後にリトライします ({attempt + 1}/{config.max_retries})")
+            time.sleep(min(wait, self.MAX_RETRY_WAIT))
         
-        try:
-            url = f"{self.base_url}/listed/info"
-            headers = {
-                'Authorization': f'Bearer {self.id_token}'
-            }
+        return response
+    
+    def _get_paginated(self, endpoint, params, data_key):
+        """
+        ページネーションに対応したGETリクエストを実行し、全ページのレコードを返す
+        
+        Args:
+            endpoint (str): エンドポイント（例: 'prices/daily_quotes'）
+            params (dict): クエリパラメータ
+            data_key (str): レスポンス中のレコード配列のキー
+        
+        Yields:
+            list: 1ページ分のレコード
+        """
+        url = f"{self.base_url}/{endpoint}"
+        headers = {
+            'Authorization': f'Bearer {self.id_token}'
+        }
+        params = dict(params)
+        token_refreshed = False
+        
+        while True:
+            response = self._request('get', url, headers=headers, params=params)
+            
+            # 共有トークンが失効していた場合は破棄して1回だけ再認証する
+            if response.status_code == 401 and not token_refreshed:
+                self.token_store.invalidate(self.id_token)
+                self.id_token = None
+                if not self._ensure_authenticated():
+                    raise RuntimeError("j-Quants API認証に失敗しました")
+                headers['Authorization'] = f'Bearer {self.id_token}'
+                token_refreshed = True
+                continue
             
-            response = self.session.get(url, headers=headers, timeout=config.timeout)
             response.raise_for_status()
             
             data = response.json()
+            yield data.get(data_key) or []
+            
+            pagination_key = data.get('pagination_key')
+            if not pagination_key:
+                break
+            params['pagination_key'] = pagination_key
+    
+    def _get_records(self, endpoint, params, data_key):
+        """
+        キャッシュを確認したうえで全ページのレコードを取得
+        
+        キャッシュにヒットした場合は認証もリクエストも行わない。
+        
+        Args:
+            endpoint (str): エンドポイント
+            params (dict): クエリパラメータ
+            data_key (str): レスポンス中のレコード配列のキー
+        
+        Returns:
+            list: レコードのリスト
+        """
+        if self.cache is not None:
+            cached = self.cache.get(endpoint, params, base_url=self.base_url)
+            if cached is not None:
+                self.logger.debug(f"キャッシュを使用します: {endpoint} {params}")
+                return cached
+        
+        if not self._ensure_authenticated():
+            raise RuntimeError("j-Quants API認証に失敗しました")
+        
+        records = []
+        for page in self._get_paginated(endpoint, params, data_key):
+            records.extend(page)
+        
+        # 空の結果（未公開の日付など）はキャッシュしない
+        if self.cache is not None and records:
+            self.cache.set(endpoint, params, records, base_url=self.base_url)
+        
+        return records
+    
+    def get_trading_calendar(self, from_date, to_date):
+        """
+        取引カレンダーから営業日を取得
+        
+        Args:
+            from_date (str): 開始日（YYYY-MM-DD形式）
+            to_date (str): 終了日（YYYY-MM-DD形式）
+        
+        Returns:
+            list: 営業日のリスト（昇順、取得失敗時はNone）
+        """
+        try:
+            params = {'from': from_date, 'to': to_date}
+            calendar = self._get_records('markets/trading_calendar', params, 'trading_calendar')
+            
+            # HolidayDivision: 1=営業日, 2=東証半日立会日
+            trading_days = [
+                item['Date'] for item in calendar
+                if str(item.get('HolidayDivision')) in ('1', '2')
+            ]
+            return sorted(trading_days)
             
-            if 'info' in data:
-                self.logger.info(f"j-Quantsから{len(data['info'])}件の上場企業情報を取得しました")
-                return data['info']
+        except Exception as e:
+            self.logger.error(f"取引カレンダーの取得に失敗: {e}")
+            return None
+    
+    def get_recent_trading_days(self, date=None, count=5):
+        """
+        指定日以前の直近営業日を新しい順に取得
+        
+        Args:
+            date (str): 基準日（YYYY-MM-DD形式、Noneの場合は今日）
+            count (int): 取得する営業日数
+        
+        Returns:
+            list: 営業日のリスト（降順）
+        """
+        base = datetime.strptime(date, '%Y-%m-%d') if date else datetime.now()
+        from_date = (base - timedelta(days=count * 2 + 14)).strftime('%Y-%m-%d')
+        to_date = base.strftime('%Y-%m-%d')
+        
+        trading_days = self.get_trading_calendar(from_date, to_date)
+        if not trading_days:
+            # カレンダーが取得できない場合は土日を除いた平日で代用
+            self.logger.warning("取引カレンダーを取得できないため平日で代用します")
+            trading_days = [
+                d.strftime('%Y-%m-%d')
+                for d in pd.bdate_range(from_date, to_date)
+            ]
+        
+        return sorted(trading_days, reverse=True)[:count]
+    
+    def resolve_trading_date(self, date=None):
+        """
+        指定日以前で最も新しい営業日を取得
+        
+        Args:
+            date (str): 基準日（YYYY-MM-DD形式、Noneの場合は今日）
+        
+        Returns:
+            str: 営業日（YYYY-MM-DD形式）
+        """
+        trading_days = self.get_recent_trading_days(date, count=1)
+        return trading_days[0] if trading_days else None
+    
+    def get_listed_info(self, date=None):
+        """
+        上場企業情報を取得
+        
+        Args:
+            date (str): 基準日（YYYY-MM-DD形式。Noneの場合は最新）
+        
+        Returns:
+            list: 上場企業情報のリスト
+        """
+        try:
+            info = self._get_records('listed/info', {'date': date} if date else {}, 'info')
+            
+            if info:
+                self.logger.info(f"j-Quantsから{len(info)}件の上場企業情報を取得しました")
+                return info
             else:
                 self.logger.warning("j-Quantsから有効な上場企業情報を取得できませんでした")
                 return None
@@ -138,10 +382,63 @@ class JQuantsClient:
         
         return prime_codes
     
+    def get_daily_quotes_snapshot(self, date=None, codes=None, max_fallback_days=5):
+        """
+        指定営業日の全銘柄の株価を一括取得（全市場スナップショット）
+        
+        日付を指定して銘柄コードを指定しない場合、daily_quotesは全上場銘柄を
+        ページネーション付きで返すため、銘柄ごとのリクエストが不要になる。
+        
+        Args:
+            date (str): 日付（YYYY-MM-DD形式、Noneの場合は直近の営業日）
+            codes (list): 絞り込む証券コードのリスト（Noneの場合は全銘柄）
+            max_fallback_days (int): 日付未指定時、データ未公開の場合に遡る営業日数
+        
+        Returns:
+            pd.DataFrame: 株価データ（取得失敗時はNone）
+        """
+        try:
+            if date:
+                candidate_dates = [date]
+            else:
+                # 当日分が未公開の場合に備えて直近の営業日から順に試す
+                candidate_dates = self.get_recent_trading_days(count=max_fallback_days)
+            
+            snapshot = pd.DataFrame()
+            for candidate in candidate_dates:
+                records = self._get_records('prices/daily_quotes', {'date': candidate}, 'daily_quotes')
+                
+                if records:
+                    snapshot = pd.DataFrame.from_records(records)
+                    self.logger.info(f"{candidate}の株価スナップショットを取得しました: {len(snapshot)}件")
+                    break
+                
+                self.logger.warning(f"{candidate}の株価データがありません")
+            
+            if snapshot.empty:
+                self.logger.warning("j-Quantsから有効な株価スナップショットを取得できませんでした")
+                return snapshot
+            
+            # 証券コードを4桁に正規化し、対象銘柄にローカルで絞り込む
+            snapshot['code'] = snapshot['Code'].map(normalize_code)
+            if codes is not None:
+                target_codes = {normalize_code(code) for code in codes}
+                snapshot = snapshot[snapshot['code'].isin(target_codes)].reset_index(drop=True)
+                self.logger.info(f"対象銘柄に絞り込みました: {len(snapshot)}件")
+            
+            return snapshot
+            
+        except Exception as e:
+            self.logger.error(f"株価スナップショットの取得に失敗: {e}")
+            return None
+    
     def get_stock_prices(self, codes, date=None):
         """
         株価情報を取得
         
+        銘柄数によらず全市場スナップショットを取得してローカルで絞り込む
+        （銘柄ごとのリクエストは行わず、リクエスト数はページ数だけになる）。
+        
         Args:
             codes (list): 証券コードのリスト
             date (str): 日付（YYYY-MM-DD形式、Noneの場合は最新）
@@ -149,97 +446,46 @@ class JQuantsClient:
         Returns:
             list: 株価情報のリスト
         """
-        if not self._ensure_authenticated():
-            return None
-        
         if not codes:
             return []
         
-        try:
-            # 日付の設定（最新の営業日を取得するか、過去の日付を使用）
-            if not date:
-                # 最新の営業日を取得するか、過去の日付を使用
-                # 例: 2024年12月31日（年末の営業日）
-                date = '2024-12-30'
-            
-            url = f"{self.base_url}/prices/daily_quotes"
-            headers = {
-                'Authorization': f'Bearer {self.id_token}'
-            }
-            
-            # 一度に取得する銘柄数を制限（API制限を考慮）
-            batch_size = 10
-            all_prices = []
-            
-            for i in range(0, len(codes), batch_size):
-                batch_codes = codes[i:i + batch_size]
-                
-                params = {
-                    'date': date,
-                    'code': ','.join(map(str, batch_codes))
-                }
-                
-                self.logger.info(f"株価情報取得中: {len(batch_codes)}件 (バッチ {i//batch_size + 1})")
-                
-                response = self.session.get(url, headers=headers, params=params, timeout=config.timeout)
-                response.raise_for_status()
-                
-                data = response.json()
-                
-                if 'daily_quotes' in data and data['daily_quotes']:
-                    all_prices.extend(data['daily_quotes'])
-                    self.logger.info(f"バッチ {i//batch_size + 1} で{len(data['daily_quotes'])}件の株価情報を取得")
-                else:
-                    self.logger.warning(f"バッチ {i//batch_size + 1} で株価情報を取得できませんでした")
-                
-                # API制限を考慮して少し待機
-                time.sleep(0.1)
-            
-            if all_prices:
-                self.logger.info(f"j-Quantsから合計{len(all_prices)}件の株価情報を取得しました")
-                return all_prices
-            else:
-                self.logger.warning("j-Quantsから有効な株価情報を取得できませんでした")
-                return None
-                
-        except Exception as e:
-            self.logger.error(f"株価情報の取得に失敗: {e}")
+        snapshot = self.get_daily_quotes_snapshot(date=date, codes=codes)
+        if snapshot is None or snapshot.empty:
             return None
+        return snapshot.drop(columns=['code']).to_dict('records')
     
-    def get_financial_statements(self, codes):
+    def get_financial_statements(self, codes=None, date=None):
         """
         財務諸表情報を取得
         
         Args:
             codes (list): 証券コードのリスト
+            date (str): 開示日（YYYY-MM-DD形式、指定した場合はその日の全開示を取得）
         
         Returns:
             list: 財務諸表情報のリスト
         """
-        if not self._ensure_authenticated():
-            return None
-        
-        if not codes:
+        if not codes and not date:
             return []
         
         try:
-            url = f"{self.base_url}/fins/statements"
-            headers = {
-                'Authorization': f'Bearer {self.id_token}'
-            }
-            
-            params = {
-                'code': ','.join(map(str, codes))
-            }
-            
-            response = self.session.get(url, headers=headers, params=params, timeout=config.timeout)
-            response.raise_for_status()
-            
-            data = response.json()
+            if date:
+                statements = self._get_records('fins/statements', {'date': date}, 'statements')
+                if codes:
+                    target_codes = {normalize_code(code) for code in codes}
+                    statements = [
+                        item for item in statements
+                        if normalize_code(item.get('LocalCode')) in target_codes
+                    ]
+            else:
+                # fins/statementsは銘柄コードを1件ずつ受け付ける
+                statements = []
+                for code in codes:
+                    statements.extend(self._get_records('fins/statements', {'code': str(code)}, 'statements'))
             
-            if 'statements' in data:
-                self.logger.info(f"j-Quantsから{len(data['statements'])}件の財務諸表情報を取得しました")
-                return data['statements']
+            if statements:
+                self.logger.info(f"j-Quantsから{len(statements)}件の財務諸表情報を取得しました")
+                return statements
             else:
                 self.logger.warning("j-Quantsから有効な財務諸表情報を取得できませんでした")
                 return None
@@ -272,6 +518,14 @@ def main():
                 
                 if prices:
                     print(f"株価情報取得数: {len(prices)}")
+                
+                # 直近営業日の全市場スナップショットを取得
+                snapshot = client.get_daily_quotes_snapshot(codes=prime_codes)
+                if snapshot is not None:
+                    print(f"株価スナップショット取得数: {len(snapshot)}")
+            
+            if client.cache is not None:
+                print(f"キャッシュ統計: {client.cache.get_statistics()}")
         else:
             print("認証失敗")
             
@@ -0,0 +1,294 @@
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+import argparse
+import logging
+import pandas as pd
+
+class StubDataset:
+    """
+    スタブサーバーが返す上場企業・株価・開示データ
+
+    合成データを生成するか、記録済みのJSONファイルを読み込む。
+    """
+
+    SECTORS = ['水産・農林業', '建設業', '食料品', '化学', '医薬品', '電気機器', '輸送用機器', '銀行業', '情報・通信業', 'サービス業']
+
+    def __init__(self, num_codes=1600, days=60, seed=0, data_dir=None):
+        if data_dir:
+            self._load(Path(data_dir))
+        else:
+            self._generate(num_codes, days, seed)
+
+        # 日付・銘柄コードでの検索用インデックス
+        self.quotes_by_date = {}
+        self.quotes_by_code = {}
+        for quote in self.daily_quotes:
+            self.quotes_by_date.setdefault(quote['Date'], []).append(quote)
+            self.quotes_by_code.setdefault(quote['Code'], []).append(quote)
+
+        self.statements_by_date = {}
+        self.statements_by_code = {}
+        for statement in self.statements:
+            self.statements_by_date.setdefault(statement['DisclosedDate'], []).append(statement)
+            self.statements_by_code.setdefault(statement['LocalCode'], []).append(statement)
+
+    def _load(self, data_dir):
+        """
+        記録済みデータ（listed_info.json, daily_quotes.json, statements.json）を読み込み
+        """
+        def read(name):
+            path = data_dir / name
+            if not path.exists():
+                return []
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+
+        self.listed_info = read('listed_info.json')
+        self.daily_quotes = read('daily_quotes.json')
+        self.statements = read('statements.json')
+        self.trading_days = sorted({q['Date'] for q in self.daily_quotes})
+
+    def _generate(self, num_codes, days, seed):
+        """
+        合成データを生成
+        """
+        rng = random.Random(seed)
+        end = datetime.now() - timedelta(days=1)
+        self.trading_days = [d.strftime('%Y-%m-%d') for d in pd.bdate_range(end=end, periods=days)]
+
+        self.listed_info = []
+        self.daily_quotes = []
+        self.statements = []
+
+        for i in range(num_codes):
+            code = f"{1300 + i * 5:04d}0"
+            self.listed_info.append({
+                'Date': self.trading_days[-1],
+                'Code': code,
+                'CompanyName': f"銘柄{code[:4]}",
+                'MarketCodeName': 'プライム' if i % 5 else 'スタンダード',
+                'Sector33CodeName': self.SECTORS[i % len(self.SECTORS)],
+            })
+
+            price = rng.uniform(300, 10000)
+            for date in self.trading_days:
+                price = max(price * (1 + rng.gauss(0, 0.015)), 1)
+                self.daily_quotes.append({'Date': date, 'Code': code, 'Close': round(price, 1)})
+
+            bps = price / rng.uniform(0.4, 3.0)
+            for quarter in range(0, days, 63):
+                date = self.trading_days[min(quarter + rng.randint(0, 20), days - 1)]
+                eps = bps * rng.uniform(-0.02, 0.2)
+                self.statements.append({
+                    'DisclosedDate': date,
+                    'DisclosedTime': '15:00:00',
+                    'LocalCode': code,
+                    'TypeOfDocument': '3QFinancialStatements_Consolidated_JP',
+                    'ForecastEarningsPerShare': f"{eps:.2f}",
+                    'BookValuePerShare': f"{bps:.2f}",
+                    'ForecastDividendPerShareAnnual': f"{max(eps, 0) * 0.3:.2f}",
+                    'Equity': f"{bps * 1e7:.0f}",
+                })
+
+class StubState:
+    """
+    スタブサーバーの障害注入設定と統計
+    """
+
+    def __init__(self, dataset, latency_ms=0, throttle_rate=0.0, error_rate=0.0, rate_limit=None, page_size=1000):
+        self.dataset = dataset
+        self.latency_ms = latency_ms
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.page_size = page_size
+
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'throttled': 0, 'errors': 0}
+        self._window_start = time.time()
+        self._window_count = 0
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def over_rate_limit(self):
+        """
+        1秒あたりのリクエスト数の上限を超えているかを判定
+        """
+        if not self.rate_limit:
+            return False
+
+        with self.lock:
+            now = time.time()
+            if now - self._window_start >= 1:
+                self._window_start = now
+                self._window_count = 0
+            self._window_count += 1
+            return self._window_count > self.rate_limit
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    """
+    j-Quants API互換のリクエストハンドラ
+    """
+
+    state = None
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(format % args)
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _inject_faults(self):
+        """
+        遅延・レート制限・エラーを注入（応答済みの場合はTrue）
+        """
+        state = self.state
+        state.count('requests')
+
+        if state.latency_ms:
+            time.sleep(state.latency_ms / 1000)
+
+        if state.over_rate_limit() or random.random() < state.throttle_rate:
+            state.count('throttled')
+            self._send_json(429, {'message': 'Too Many Requests'}, {'Retry-After': '0.2'})
+            return True
+
+        if random.random() < state.error_rate:
+            state.count('errors')
+            self._send_json(500, {'message': 'Internal Server Error'})
+            return True
+
+        return False
+
+    def _paginate(self, records, params, data_key):
+        """
+        レコードをページ単位で返す
+        """
+        offset = int(params.get('pagination_key', '0') or 0)
+        page = records[offset:offset + self.state.page_size]
+        payload = {data_key: page}
+        if offset + self.state.page_size < len(records):
+            payload['pagination_key'] = str(offset + self.state.page_size)
+        return payload
+
+    def do_POST(self):
+        if self._inject_faults():
+            return
+
+        path = urlparse(self.path).path
+        if path.endswith('/token/auth_refresh'):
+            self._send_json(200, {'idToken': 'stub-id-token'})
+        else:
+            self._send_json(404, {'message': 'Not Found'})
+
+    def do_GET(self):
+        if self._inject_faults():
+            return
+
+        if self.headers.get('Authorization') != 'Bearer stub-id-token':
+            self._send_json(401, {'message': 'The incoming token is invalid or expired.'})
+            return
+
+        parsed = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        dataset = self.state.dataset
+        path = parsed.path
+
+        if path.endswith('/listed/info'):
+            self._send_json(200, self._paginate(dataset.listed_info, params, 'info'))
+
+        elif path.endswith('/prices/daily_quotes'):
+            if 'code' in params:
+                code = params['code'] if len(params['code']) == 5 else params['code'] + '0'
+                records = [q for q in dataset.quotes_by_code.get(code, [])
+                           if 'date' not in params or q['Date'] == params['date']]
+            else:
+                records = dataset.quotes_by_date.get(params.get('date'), [])
+            self._send_json(200, self._paginate(records, params, 'daily_quotes'))
+
+        elif path.endswith('/fins/statements'):
+            if 'code' in params:
+                code = params['code'] if len(params['code']) == 5 else params['code'] + '0'
+                records = dataset.statements_by_code.get(code, [])
+            else:
+                records = dataset.statements_by_date.get(params.get('date'), [])
+            self._send_json(200, self._paginate(records, params, 'statements'))
+
+        elif path.endswith('/markets/trading_calendar'):
+            start, end = params.get('from', ''), params.get('to', '9999-12-31')
+            records = [{'Date': d, 'HolidayDivision': '1'}
+                       for d in dataset.trading_days if start <= d <= end]
+            self._send_json(200, self._paginate(records, params, 'trading_calendar'))
+
+        else:
+            self._send_json(404, {'message': 'Not Found'})
+
+def start_server(state, host='127.0.0.1', port=0):
+    """
+    スタブサーバーをバックグラウンドスレッドで起動
+
+    Args:
+        state (StubState): サーバー設定
+        host (str): ホスト
+        port (int): ポート（0の場合は空きポート）
+
+    Returns:
+        tuple: (サーバー, ベースURL)
+    """
+    handler = type('BoundStubRequestHandler', (StubRequestHandler,), {'state': state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    base_url = f"http://{host}:{server.server_address[1]}/v1"
+    return server, base_url
+
+def main():
+    """
+    メイン実行関数
+    """
+    parser = argparse.ArgumentParser(description='j-Quants API互換のローカルスタブサーバー')
+    parser.add_argument('--port', type=int, default=8765, help='ポート')
+    parser.add_argument('--codes', type=int, default=1600, help='合成データの銘柄数')
+    parser.add_argument('--days', type=int, default=60, help='合成データの営業日数')
+    parser.add_argument('--data-dir', type=str, default=None, help='記録済みデータのディレクトリ')
+    parser.add_argument('--latency-ms', type=float, default=0, help='応答遅延（ミリ秒）')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='429を返す確率')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='500を返す確率')
+    parser.add_argument('--rate-limit', type=int, default=None, help='1秒あたりの最大リクエスト数')
+    parser.add_argument('--page-size', type=int, default=1000, help='1ページのレコード数')
+    args = parser.parse_args()
+
+    dataset = StubDataset(num_codes=args.codes, days=args.days, data_dir=args.data_dir)
+    state = StubState(dataset, latency_ms=args.latency_ms, throttle_rate=args.throttle_rate,
+                      error_rate=args.error_rate, rate_limit=args.rate_limit, page_size=args.page_size)
+    server, base_url = start_server(state, port=args.port)
+
+    print(f"スタブサーバーを起動しました: {base_url}")
+    print(f"JQUANTS_BASE_URL={base_url} を設定するとクライアントの接続先になります")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(f"統計: {state.stats}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+import os
+import csv
+import json
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from pathlib import Path
+import logging
+from src.frame_schema import normalize_codes
+from src.storage import file_lock, write_csv_atomic, write_json_atomic
+
+class OutputStore:
+    """
+    data/output.csv を証券コードをキーに更新するクラス
+
+    本体（output.csv）に加えて、部分的なスクレイピング結果を追記する
+    ジャーナル（output.journal.csv）を持つ。upsertはジャーナルへの追記だけで
+    済むため、変更した行数に比例したコストで終わる。読み込み時は本体と
+    ジャーナルを合わせ、同じコードは scraped_at が新しい行を採用する
+    （同時刻の場合は後から書かれた行）。ジャーナルが大きくなったら本体に
+    まとめて書き直す（コンパクション）。本体・ジャーナルの行数は
+    output.meta.json に記録し、upsertのたびにファイル全体を読み直さない。
+    """
+
+    TIMESTAMP_COLUMN = 'scraped_at'
+
+    # ジャーナルの行数が本体の行数のこの割合（かつ最小行数）を超えたらコンパクションする
+    COMPACT_RATIO = 0.5
+    COMPACT_MIN_ROWS = 500
+
+    def __init__(self, path='data/output.csv', encoding='utf-8-sig'):
+        self.path = Path(path)
+        self.journal_path = self.path.with_name(f"{self.path.stem}.journal{self.path.suffix}")
+        self.meta_path = self.path.with_name(f"{self.path.stem}.meta.json")
+        self.encoding = encoding
+        self.logger = logging.getLogger(__name__)
+
+    def _prepare(self, data, scraped_at=None):
+        """
+        コードを正規化し、scraped_at がなければ付与
+        """
+        data = data.copy()
+        data['code'] = normalize_codes(data['code'])
+        if self.TIMESTAMP_COLUMN not in data.columns:
+            data[self.TIMESTAMP_COLUMN] = scraped_at or datetime.now().isoformat(timespec='seconds')
+        else:
+            data[self.TIMESTAMP_COLUMN] = data[self.TIMESTAMP_COLUMN].fillna(
+                scraped_at or datetime.now().isoformat(timespec='seconds')
+            )
+        return data
+
+    def _read_file(self, path):
+        if not path.exists() or path.stat().st_size == 0:
+            return None
+        data = pd.read_csv(path, encoding=self.encoding, dtype={'code': str})
+        if 'code' in data.columns:
+            data['code'] = normalize_codes(data['code'])
+        return data
+
+    @classmethod
+    def _resolve(cls, frames):
+        """
+        本体とジャーナルを結合し、コードごとに scraped_at が最新の行を残す
+        """
+        frames = [frame for frame in frames if frame is not None and not frame.empty]
+        if not frames:
+            return pd.DataFrame()
+
+        combined = pd.concat(frames, ignore_index=True)
+        if cls.TIMESTAMP_COLUMN not in combined.columns:
+            combined[cls.TIMESTAMP_COLUMN] = np.nan
+
+        # 元の並び（本体の順、新規コードは末尾）を保つため、コードが最初に現れた位置を控える
+        position = pd.Series(pd.factorize(combined['code'])[0], index=combined.index)
+
+        # scraped_at のない行（移行前の本体）は最も古いものとして扱う。安定ソートなので同時刻は後の行が残る
+        order = combined[cls.TIMESTAMP_COLUMN].fillna('').astype(str)
+        combined = combined.iloc[np.argsort(order.to_numpy(), kind='stable')]
+        combined = combined.drop_duplicates('code', keep='last')
+
+        return combined.iloc[np.argsort(position[combined.index].to_numpy())].reset_index(drop=True)
+
+    def read(self):
+        """
+        本体とジャーナルを合わせた最新のデータを読み込み
+
+        Returns:
+            pd.DataFrame: コードごとに1行のデータ（ファイルがない場合は空）
+        """
+        base = self._read_file(self.path)
+        journal = self._read_file(self.journal_path)
+        if journal is None:
+            return base if base is not None else pd.DataFrame()
+        return self._resolve([base, journal])
+
+    def codes(self):
+        """
+        保存済みの証券コードの集合
+        """
+        data = self.read()
+        return set(data['code']) if 'code' in data.columns else set()
+
+    def last_modified(self):
+        """
+        本体・ジャーナルの最終更新時刻（どちらもない場合はNone）
+        """
+        mtimes = [p.stat().st_mtime for p in (self.path, self.journal_path) if p.exists()]
+        return max(mtimes) if mtimes else None
+
+    def upsert(self, data, scraped_at=None, compact=None):
+        """
+        行をコードをキーに追加・更新（ジャーナルへの追記）
+
+        Args:
+            data (pd.DataFrame): code 列を持つデータ
+            scraped_at (str): 取得時刻（ISO形式、Noneの場合は現在時刻。data に列があればそちらを優先）
+            compact (bool): 追記後にコンパクションするか（Noneの場合はジャーナルの大きさで判断）
+
+        Returns:
+            int: 追記した行数
+        """
+        if data is None or data.empty:
+            return 0
+        if 'code' not in data.columns:
+            raise ValueError("code列がないデータは保存できません")
+
+        rows = self._prepare(data, scraped_at)
+
+        with file_lock(self.path):
+            base_rows, journal_rows = self._row_counts()
+            header = self._read_header(self.journal_path)
+
+            # 列構成が変わった場合はジャーナルを書き直し、そうでなければ末尾に追記する（ヘッダー行だけ比較する）
+            if header is not None and header != list(rows.columns):
+                journal = self._read_file(self.journal_path)
+                write_csv_atomic(pd.concat([journal, rows], ignore_index=True), self.journal_path,
+                                 encoding=self.encoding)
+                journal_rows = len(journal)
+            elif header is None:
+                write_csv_atomic(rows, self.journal_path, encoding=self.encoding)
+                journal_rows = 0
+            else:
+                with open(self.journal_path, 'a', encoding='utf-8', newline='') as f:
+                    rows.to_csv(f, index=False, header=False)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+            journal_rows += len(rows)
+            self._save_row_counts(base_rows, journal_rows)
+            if compact is None:
+                compact = journal_rows >= max(self.COMPACT_MIN_ROWS, base_rows * self.COMPACT_RATIO)
+            if compact:
+                self._compact_locked()
+
+        self.logger.info(f"{len(rows)}行を{self.path.name}に反映しました")
+        return len(rows)
+
+    def _count_rows(self, path):
+        if not path.exists():
+            return 0
+        with open(path, 'rb') as f:
+            return max(sum(1 for _ in f) - 1, 0)
+
+    def _read_header(self, path):
+        """
+        CSVのヘッダー行の列名（ファイルがない・空の場合はNone）
+        """
+        if not path.exists() or path.stat().st_size == 0:
+            return None
+        with open(path, 'r', encoding=self.encoding, newline='') as f:
+            return next(csv.reader(f), None)
+
+    @staticmethod
+    def _signature(path):
+        """
+        ファイルの更新時刻とサイズ（行数の記録が最新かの確認に使う）
+        """
+        if not path.exists():
+            return None
+        stat = path.stat()
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def _row_counts(self):
+        """
+        本体・ジャーナルの行数（記録がファイルと一致しない場合だけ数え直す。ロック取得済みで呼ぶ）
+        """
+        meta = {}
+        if self.meta_path.exists():
+            try:
+                with open(self.meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                meta = {}
+
+        counts = []
+        for name, path in (('base', self.path), ('journal', self.journal_path)):
+            signature = self._signature(path)
+            if signature is None:
+                counts.append(0)
+            elif meta.get(f'{name}_signature') == signature:
+                counts.append(meta[f'{name}_rows'])
+            else:
+                counts.append(self._count_rows(path))
+        return tuple(counts)
+
+    def _save_row_counts(self, base_rows, journal_rows):
+        """
+        本体・ジャーナルの行数を現在のファイルの更新時刻・サイズとともに記録（ロック取得済みで呼ぶ）
+        """
+        write_json_atomic({
+            'base_rows': base_rows,
+            'base_signature': self._signature(self.path),
+            'journal_rows': journal_rows,
+            'journal_signature': self._signature(self.journal_path),
+        }, self.meta_path)
+
+    def _compact_locked(self):
+        """
+        本体とジャーナルをまとめて本体を書き直す（ロック取得済みで呼ぶ）
+        """
+        merged = self._resolve([self._read_file(self.path), self._read_file(self.journal_path)])
+        if merged.empty:
+            return
+
+        # 本体を先に置き換え、ジャーナルを消す（途中で止まっても再適用は同じ結果になる）
+        write_csv_atomic(merged, self.path, encoding=self.encoding)
+        if self.journal_path.exists():
+            self.journal_path.unlink()
+        self._save_row_counts(len(merged), 0)
+        self.logger.info(f"{self.path.name}をコンパクションしました: {len(merged)}行")
+
+    def compact(self):
+        """
+        ジャーナルを本体にまとめる
+        """
+        with file_lock(self.path):
+            self._compact_locked()
+
+    def replace(self, data, scraped_at=None):
+        """
+        全件の取得結果で本体を置き換え、ジャーナルを破棄
+
+        Args:
+            data (pd.DataFrame): code 列を持つデータ
+            scraped_at (str): 取得時刻（ISO形式、Noneの場合は現在時刻）
+        """
+        rows = self._prepare(data, scraped_at)
+        with file_lock(self.path):
+            write_csv_atomic(rows, self.path, encoding=self.encoding)
+            if self.journal_path.exists():
+                self.journal_path.unlink()
+            self._save_row_counts(len(rows), 0)
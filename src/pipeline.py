@@ -0,0 +1,444 @@
+"""
+日次パイプラインの各スクリプトを、入出力の内容で実行要否を判定して動かすランナー
+
+各ステージは入力・出力のファイル（ディレクトリ可）を宣言する。ステージ間の依存は
+「あるステージの出力を入力に含むステージは、その後に動く」という make と同じ規則で
+導く。実行前に入力の内容のハッシュを計算し、前回の実行時と同じで出力も前回のまま
+残っていればスキップする。外部のデータを取りに行くステージ（external）は、
+--offline を指定しない限り毎回実行する。依存のないステージは並列に実行する。
+
+--in-process を指定すると、スクリプトを別プロセスで動かさずに1プロセスで実行する。
+取得結果・処理結果・グラフはメモリ上で次の処理に渡し（CSVやキャッシュの読み直し、
+HTMLの解析し直しをしない）、成果物は最後にまとめて1度だけ書き込む。
+"""
+import os
+import ast
+import sys
+import json
+import time
+import hashlib
+import subprocess
+import concurrent.futures
+from pathlib import Path
+from datetime import datetime
+import argparse
+import logging
+from src.config import config
+from src.output_store import OutputStore
+from src.sector_master import SectorMaster
+from src.storage import atomic_write, file_hash, file_lock, write_json_atomic
+
+class Stage:
+    """
+    パイプラインの1ステージ
+
+    実行するスクリプトと、そこから（間接的に）インポートする src 配下のモジュールは
+    自動的に入力に加わる（all_inputs）。inputs にはデータのファイルだけを書けばよい。
+
+    Args:
+        name (str): ステージ名
+        command (list): 実行するコマンド（sys.executable からの引数）
+        inputs (list): 入力のファイル・ディレクトリ（スクリプトとモジュール以外）
+        outputs (list): 出力のファイル・ディレクトリ
+        external (bool): 外部のデータを取得するか（入力が同じでも毎回実行する）
+    """
+
+    def __init__(self, name, command, inputs=(), outputs=(), external=False):
+        self.name = name
+        self.command = list(command)
+        self.inputs = [Path(p) for p in inputs]
+        self.outputs = [Path(p) for p in outputs]
+        self.external = external
+
+    def __repr__(self):
+        return f"Stage({self.name!r})"
+
+    def all_inputs(self):
+        """
+        宣言した入力に、スクリプトとそのインポートするモジュールを加えた入力
+        """
+        script = self.command[0] if self.command and self.command[0].endswith('.py') else None
+        modules = module_dependencies(script) if script else []
+        return modules + [p for p in self.inputs if p not in modules]
+
+def _imported_modules(path):
+    """
+    ソースファイルがインポートする src 配下のモジュールのパス（関数内のインポートも含む）
+    """
+    tree = ast.parse(Path(path).read_text(encoding='utf-8'), filename=str(path))
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+            names.add(node.module)
+            # from src import data_processing の形式
+            names.update(f"{node.module}.{alias.name}" for alias in node.names)
+
+    paths = []
+    for name in names:
+        parts = name.split('.')
+        # スクリプトとして実行した場合の src を省いたインポート（from data_processing import ...）も対象にする
+        if parts[0] != 'src':
+            parts = ['src'] + parts
+        candidate = Path(*parts).with_suffix('.py')
+        if len(parts) == 2 and candidate.is_file():
+            paths.append(candidate)
+    return paths
+
+def module_dependencies(script):
+    """
+    スクリプトと、そこから推移的にインポートされる src 配下のモジュールのパス
+
+    Args:
+        script (str): スクリプトのパス（カレントディレクトリからの相対パス）
+
+    Returns:
+        list: パスのリスト（スクリプト自身を含む。パス順）
+    """
+    pending = [Path(script)]
+    seen = set()
+    while pending:
+        path = pending.pop()
+        if path in seen or not path.is_file():
+            continue
+        seen.add(path)
+        pending.extend(_imported_modules(path))
+    return sorted(seen)
+
+# 日次パイプライン（スクリプトとインポートするモジュールは自動的に入力に加わり、コードの変更でも再実行する）
+DEFAULT_STAGES = [
+    Stage('fetch_codes', ['src/stock_code_fetcher_secure.py'],
+          outputs=['data/codes.csv'], external=True),
+    Stage('scrape', ['src/scraper_parallel.py'],
+          inputs=['data/codes.csv'],
+          outputs=['data/output.csv'], external=True),
+    Stage('process', ['src/data_processing.py'],
+          inputs=['data/output.csv', 'data/output.journal.csv', 'data/data_j.xls',
+                  # J-Quantsで更新した業種マスタ（sector_master.py --jquants）も反映する
+                  'data/sector_master.parquet', 'data/sector_master.csv', 'data/sector_master.json'],
+          outputs=['data/processed_cache']),
+    Stage('visualize', ['src/visualize.py'],
+          inputs=['data/processed_cache'],
+          outputs=['docs/all_graphs.html', 'data/indicators.csv']),
+    Stage('time_series', ['src/time_series_visualizer.py'],
+          inputs=['data/history/metadata.json', 'data/history/rollups'],
+          outputs=['docs/charts']),
+    Stage('update_html', ['src/update_html.py'],
+          inputs=['docs/all_graphs.html'],
+          outputs=['docs/index.html']),
+]
+
+def path_hash(path):
+    """
+    ファイル・ディレクトリの内容のハッシュ（存在しない場合は空文字列）
+
+    ディレクトリは配下のファイルの相対パスと内容のハッシュから計算する
+    （ロックファイルと一時ファイルは除く）。
+    """
+    path = Path(path)
+    if path.is_file():
+        return file_hash(path)
+    if not path.is_dir():
+        return ''
+
+    digest = hashlib.sha256()
+    for child in sorted(p for p in path.rglob('*') if p.is_file()):
+        if child.suffix in ('.lock', '.tmp'):
+            continue
+        digest.update(f"{child.relative_to(path)}\0{file_hash(child)}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+def paths_hash(paths):
+    """
+    複数のパスの内容をまとめたハッシュ
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(f"{path}\0{path_hash(path)}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+def _overlaps(output, path):
+    """
+    出力パスと入力パスが同じか、一方が他方の配下にあるか
+    """
+    return output == path or output in path.parents or path in output.parents
+
+class PipelineRunner:
+    """
+    ステージの依存関係を解決し、変更のあったステージだけを並列に実行するクラス
+
+    前回の実行結果（ステージごとの入力・出力のハッシュ）は
+    <CACHE_DIR>/pipeline_state.json に保存する。
+    """
+
+    def __init__(self, stages=None, state_file=None, max_workers=2, offline=False):
+        self.stages = {stage.name: stage for stage in (stages or DEFAULT_STAGES)}
+        self.state_file = Path(state_file or Path(config.cache_dir) / 'pipeline_state.json')
+        self.max_workers = max_workers
+        self.offline = offline
+        self.logger = logging.getLogger(__name__)
+        self.dependencies = self._resolve_dependencies()
+
+    def _resolve_dependencies(self):
+        """
+        ステージ名 → 先に実行するステージ名の集合（出力を入力に含む関係から導く）
+        """
+        dependencies = {}
+        for stage in self.stages.values():
+            dependencies[stage.name] = {
+                other.name for other in self.stages.values()
+                if other is not stage and any(_overlaps(o, i) for o in other.outputs for i in stage.inputs)
+            }
+        return dependencies
+
+    def _load_state(self):
+        if not self.state_file.exists():
+            return {}
+        with open(self.state_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_stage_state(self, name, entry):
+        """
+        1ステージ分の実行結果を記録（並列実行中のほかのステージの記録を消さないよう読み直して更新）
+        """
+        with file_lock(self.state_file):
+            state = self._load_state()
+            state[name] = entry
+            write_json_atomic(state, self.state_file, indent=2)
+
+    def _select(self, only=None):
+        """
+        実行対象のステージ名（only を指定した場合はそのステージと、その後に続くステージ）
+        """
+        if not only:
+            return list(self.stages)
+
+        unknown = [name for name in only if name not in self.stages]
+        if unknown:
+            raise ValueError(f"未知のステージ: {unknown}")
+
+        selected = set(only)
+        changed = True
+        while changed:
+            changed = False
+            for name, dependencies in self.dependencies.items():
+                if name not in selected and dependencies & selected:
+                    selected.add(name)
+                    changed = True
+        return [name for name in self.stages if name in selected]
+
+    def _run_stage(self, stage, state, force):
+        """
+        1ステージを（必要なら）実行
+
+        Returns:
+            tuple: (状態, 所要秒数)。状態は 'ran'、'skipped' または 'failed'
+        """
+        started = time.perf_counter()
+        inputs = stage.all_inputs()
+        input_hash = paths_hash(inputs)
+        previous = state.get(stage.name, {})
+
+        up_to_date = (
+            not force
+            and not (stage.external and not self.offline)
+            and previous.get('inputs') == input_hash
+            and previous.get('outputs') == paths_hash(stage.outputs)
+        )
+        if up_to_date or (stage.external and self.offline and all(p.exists() for p in stage.outputs)):
+            return 'skipped', time.perf_counter() - started
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.getcwd(), env.get('PYTHONPATH')]))
+        self.logger.info(f"ステージ {stage.name} を実行します: {' '.join(stage.command)}")
+        result = subprocess.run([sys.executable, *stage.command], env=env)
+        elapsed = time.perf_counter() - started
+        if result.returncode != 0:
+            self.logger.error(f"ステージ {stage.name} が失敗しました（終了コード {result.returncode}）")
+            return 'failed', elapsed
+
+        # ステージ自身が入力を更新する場合（集計の作成など）もあるため、実行後の内容を記録する
+        self._save_stage_state(stage.name, {
+            'inputs': paths_hash(inputs),
+            'outputs': paths_hash(stage.outputs),
+            'seconds': round(elapsed, 3),
+            'finished_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        })
+        return 'ran', elapsed
+
+    def run(self, only=None, force=False):
+        """
+        パイプラインを実行
+
+        Args:
+            only (list): 実行するステージ（後続のステージも含む。Noneの場合はすべて）
+            force (bool): 入力が変わっていなくても実行するか
+
+        Returns:
+            dict: ステージ名 → (状態, 所要秒数)。失敗したステージの後続は 'blocked'
+        """
+        selected = self._select(only)
+        state = self._load_state()
+        results = {}
+        pending = set(selected)
+        running = {}
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                # 先行ステージがすべて終わったステージを起動（先行ステージが失敗したものは実行しない）
+                for name in [n for n in selected if n in pending]:
+                    dependencies = self.dependencies[name] & set(selected)
+                    if any(results.get(d, ('',))[0] in ('failed', 'blocked') for d in dependencies):
+                        results[name] = ('blocked', 0.0)
+                        pending.discard(name)
+                    elif all(d in results for d in dependencies):
+                        running[executor.submit(self._run_stage, self.stages[name], state, force)] = name
+                        pending.discard(name)
+
+                if not running:
+                    if pending:
+                        raise ValueError(f"ステージの依存関係が循環しています: {sorted(pending)}")
+                    break
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+
+        return {name: results[name] for name in selected}
+
+def run_in_process(offline=False, charts=True, incremental=True):
+    """
+    日次パイプラインを1プロセスで実行し、成果物は最後にまとめて書き込む
+
+    Args:
+        offline (bool): 銘柄コードの取得とスクレイピングをせず、保存済みの output.csv を使うか
+        charts (bool): 時系列チャートも作成するか
+        incremental (bool): 前回の処理結果との差分だけを処理するか
+
+    Returns:
+        dict: ステップ名 → (状態, 所要秒数)
+    """
+    from src import data_processing, update_html, visualize
+    from src.indicators import export_indicators
+
+    results = {}
+    lap = [time.perf_counter()]
+
+    def record(name, status='ran'):
+        now = time.perf_counter()
+        results[name] = (status, now - lap[0])
+        lap[0] = now
+
+    store = OutputStore('data/output.csv')
+    if offline:
+        codes = scraping_df = merged_df = scraped_at = None
+        record('fetch_codes', 'skipped')
+        record('scrape', 'skipped')
+
+        # 保存済みの取得結果を処理（処理結果のキャッシュがあればそれを使う）
+        grouped_data = data_processing.process_data(incremental=incremental)
+    else:
+        from src.scraper_parallel import ParallelScraper, build_output_frame
+        from src.stock_code_fetcher_secure import SecureStockCodeFetcher
+
+        fetcher = SecureStockCodeFetcher()
+        codes = fetcher.get_prime_stock_codes()
+        if not codes:
+            raise RuntimeError("銘柄コードの取得に失敗しました")
+        record('fetch_codes')
+
+        scraped_at = time.time()
+        scraping_df = build_output_frame(ParallelScraper(max_workers=4).scrape_all_stocks(codes))
+        scraping_df[OutputStore.TIMESTAMP_COLUMN] = datetime.fromtimestamp(scraped_at).isoformat(timespec='seconds')
+        record('scrape')
+
+        # output.csv を経由せずに取得結果をそのまま処理
+        sector_master = SectorMaster()
+        merged_df, grouped_data = data_processing.process_frame(
+            data_processing.prepare_input(scraping_df, sector_master), incremental
+        )
+    record('process')
+
+    if not grouped_data:
+        raise RuntimeError("処理データが空です")
+
+    # グラフのHTMLから index.html まで文字列のまま組み立てる
+    scraping_datetime = visualize.get_scraping_datetime(scraped_at)
+    fig = visualize.build_figure(grouped_data, scraping_datetime)
+    all_graphs_html = visualize.build_html(fig, scraping_datetime)
+    index_html = update_html.decorate_html(all_graphs_html)
+    record('visualize')
+
+    chart_figures = {}
+    if charts:
+        from src.time_series_visualizer import TimeSeriesVisualizer
+
+        time_series = TimeSeriesVisualizer()
+        chart_figures = {
+            'pbr_trend.html': time_series.create_pbr_trend_chart(top_n=10),
+            'market_overview.html': time_series.create_market_overview_chart(),
+        }
+        record('time_series')
+    else:
+        record('time_series', 'skipped')
+
+    # 成果物の書き込み（各1回）
+    if codes is not None:
+        fetcher.save_codes_to_file(codes)
+    if scraping_df is not None:
+        store.replace(scraping_df)
+        # 書き込んだ output.csv から決まるキーで保存し、次回のファイル経由の処理でも使えるようにする
+        data_processing.store_result(data_processing.get_cache_key(sector_master), merged_df, grouped_data)
+    visualize.save_html(all_graphs_html, 'docs/all_graphs.html')
+    with atomic_write('docs/index.html', 'w', encoding='utf-8') as f:
+        f.write(index_html)
+    export_indicators(grouped_data, 'data/indicators.csv')
+    for filename, chart in chart_figures.items():
+        time_series.save_chart_to_html(chart, filename)
+    record('write')
+
+    return results
+
+def print_summary(results, elapsed):
+    """
+    ステージごとの所要時間を表示
+    """
+    labels = {'ran': '実行', 'skipped': 'スキップ', 'failed': '失敗', 'blocked': '未実行（先行ステージの失敗）'}
+    width = max(len(name) for name in results) if results else 0
+    print("=== パイプライン実行結果 ===")
+    for name, (status, seconds) in results.items():
+        print(f"{name.ljust(width)}  {seconds:8.2f}s  {labels[status]}")
+    print(f"{'合計'.ljust(width)}  {elapsed:8.2f}s")
+
+def main():
+    """
+    メイン実行関数
+    """
+    parser = argparse.ArgumentParser(description='日次パイプラインを変更のあったステージだけ実行')
+    parser.add_argument('stages', nargs='*', help='実行するステージ（後続も実行。省略時はすべて）')
+    parser.add_argument('--force', action='store_true', help='入力が変わっていなくても実行する')
+    parser.add_argument('--offline', action='store_true', help='外部データを取得するステージは出力があればスキップする')
+    parser.add_argument('--workers', type=int, default=2, help='並列に実行するステージ数')
+    parser.add_argument('--in-process', action='store_true', help='全ステージを1プロセスで実行し、成果物は最後にまとめて書き込む')
+    parser.add_argument('--no-charts', action='store_true', help='--in-process で時系列チャートを作成しない')
+    parser.add_argument('--full', action='store_true', help='--in-process で差分処理をせずに全件を処理する')
+    args = parser.parse_args()
+
+    if args.in_process:
+        if args.stages:
+            parser.error("--in-process ではステージを指定できません")
+        started = time.perf_counter()
+        results = run_in_process(offline=args.offline, charts=not args.no_charts, incremental=not args.full)
+        print_summary(results, time.perf_counter() - started)
+        return
+
+    runner = PipelineRunner(max_workers=args.workers, offline=args.offline)
+    started = time.perf_counter()
+    results = runner.run(only=args.stages or None, force=args.force)
+    print_summary(results, time.perf_counter() - started)
+
+    if any(status == 'failed' for status, _ in results.values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+import sqlite3
+import json
+import zlib
+import time
+import threading
+from contextlib import closing, contextmanager
+from datetime import datetime
+from pathlib import Path
+import logging
+from src.config import config
+
+class ResponseCache:
+    """
+    j-Quants APIレスポンスの永続キャッシュクラス（SQLite）
+
+    エンドポイントと正規化したパラメータをキーにレスポンスを保存し、
+    エンドポイントごとのTTLとサイズ上限（LRU削除）で管理する。
+    """
+
+    # エンドポイントごとのTTL（秒）。Noneは無期限
+    DEFAULT_TTLS = {
+        'listed/info': 6 * 3600,
+        'prices/daily_quotes': 3600,
+        'fins/statements': 6 * 3600,
+        'markets/trading_calendar': 24 * 3600,
+    }
+
+    # 過去日付を指定したリクエストは内容が変わらないためのTTL
+    HISTORICAL_TTL = None
+
+    # 不明なエンドポイントのTTL
+    FALLBACK_TTL = 3600
+
+    def __init__(self, db_path=None, max_bytes=None, ttls=None):
+        self.db_path = Path(db_path or Path(config.cache_dir) / 'jquants_responses.sqlite')
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes if max_bytes is not None else config.jquants_cache_max_mb * 1024 * 1024
+        self.ttls = dict(self.DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+
+        self.logger = logging.getLogger(__name__)
+
+        # ヒット・ミスの統計（エンドポイント別）
+        self._lock = threading.Lock()
+        self._stats = {}
+
+        self._init_db()
+
+    def _connect(self):
+        """
+        SQLite接続を作成
+        """
+        conn = sqlite3.connect(str(self.db_path), timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """
+        1トランザクション分の接続（終了時にコミットまたはロールバックし、接続を閉じる）
+        """
+        with closing(self._connect()) as conn:
+            with conn:
+                yield conn
+
+    def _init_db(self):
+        """
+        テーブルとインデックスを作成
+        """
+        with self._transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    endpoint TEXT NOT NULL,
+                    body BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access)')
+
+    @staticmethod
+    def make_key(endpoint, params=None, base_url=None):
+        """
+        接続先・エンドポイント・パラメータからキャッシュキーを生成
+
+        Args:
+            endpoint (str): エンドポイント
+            params (dict): クエリパラメータ
+            base_url (str): APIのベースURL（スタブサーバー等の別の接続先のレスポンスと混ざらないようにする）
+
+        Returns:
+            str: キャッシュキー
+        """
+        normalized = {
+            str(k): str(v).strip()
+            for k, v in (params or {}).items()
+            if v is not None and k != 'pagination_key'
+        }
+        key = f"{endpoint.strip('/')}?{json.dumps(normalized, sort_keys=True, ensure_ascii=False)}"
+        return f"{base_url.rstrip('/')}/{key}" if base_url else key
+
+    def ttl_for(self, endpoint, params=None):
+        """
+        エンドポイントとパラメータに応じたTTLを取得
+
+        Args:
+            endpoint (str): エンドポイント
+            params (dict): クエリパラメータ
+
+        Returns:
+            float: TTL（秒、Noneは無期限）
+        """
+        endpoint = endpoint.strip('/')
+        params = params or {}
+
+        # 過去日付の株価・開示・上場銘柄一覧は確定しているため無期限
+        if endpoint in ('prices/daily_quotes', 'fins/statements', 'listed/info'):
+            date = params.get('date') or params.get('to')
+            if date and str(date) < datetime.now().strftime('%Y-%m-%d'):
+                return self.HISTORICAL_TTL
+
+        return self.ttls.get(endpoint, self.FALLBACK_TTL)
+
+    def _record(self, endpoint, hit):
+        """
+        ヒット・ミスを記録
+        """
+        with self._lock:
+            stats = self._stats.setdefault(endpoint, {'hits': 0, 'misses': 0})
+            stats['hits' if hit else 'misses'] += 1
+
+    def get(self, endpoint, params=None, base_url=None):
+        """
+        キャッシュからレスポンスを取得
+
+        Args:
+            endpoint (str): エンドポイント
+            params (dict): クエリパラメータ
+            base_url (str): APIのベースURL
+
+        Returns:
+            キャッシュされた値（存在しないか期限切れの場合はNone）
+        """
+        key = self.make_key(endpoint, params, base_url)
+        now = time.time()
+
+        try:
+            with self._transaction() as conn:
+                row = conn.execute(
+                    'SELECT body, expires_at FROM responses WHERE key = ?', (key,)
+                ).fetchone()
+
+                if row is None or (row[1] is not None and row[1] <= now):
+                    self._record(endpoint, hit=False)
+                    return None
+
+                conn.execute('UPDATE responses SET last_access = ? WHERE key = ?', (now, key))
+
+            self._record(endpoint, hit=True)
+            return json.loads(zlib.decompress(row[0]).decode('utf-8'))
+
+        except Exception as e:
+            self.logger.warning(f"キャッシュの読み込みに失敗: {e}")
+            self._record(endpoint, hit=False)
+            return None
+
+    def set(self, endpoint, params, value, base_url=None):
+        """
+        レスポンスをキャッシュに保存
+
+        Args:
+            endpoint (str): エンドポイント
+            params (dict): クエリパラメータ
+            value: 保存する値（JSONシリアライズ可能なもの）
+            base_url (str): APIのベースURL
+        """
+        key = self.make_key(endpoint, params, base_url)
+        ttl = self.ttl_for(endpoint, params)
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        body = zlib.compress(json.dumps(value, ensure_ascii=False).encode('utf-8'))
+
+        try:
+            with self._transaction() as conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO responses '
+                    '(key, endpoint, body, size, created_at, expires_at, last_access) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (key, endpoint.strip('/'), body, len(body), now, expires_at, now)
+                )
+                self._evict(conn)
+        except Exception as e:
+            self.logger.warning(f"キャッシュの保存に失敗: {e}")
+
+    def _evict(self, conn):
+        """
+        期限切れのエントリを削除し、サイズ上限を超えた分を古い順に削除
+        """
+        conn.execute('DELETE FROM responses WHERE expires_at IS NOT NULL AND expires_at <= ?', (time.time(),))
+
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        evicted = 0
+        for key, size in conn.execute('SELECT key, size FROM responses ORDER BY last_access').fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+            total -= size
+            evicted += 1
+
+        self.logger.info(f"キャッシュのサイズ上限により{evicted}件を削除しました")
+
+    def clear(self):
+        """
+        キャッシュをすべて削除
+        """
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM responses')
+
+    def get_statistics(self):
+        """
+        キャッシュの統計情報を取得
+
+        Returns:
+            dict: 統計情報
+        """
+        with self._transaction() as conn:
+            entries, total_bytes = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses'
+            ).fetchone()
+
+        with self._lock:
+            endpoints = {k: dict(v) for k, v in self._stats.items()}
+
+        hits = sum(v['hits'] for v in endpoints.values())
+        misses = sum(v['misses'] for v in endpoints.values())
+
+        return {
+            'entries': entries,
+            'total_bytes': total_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else 0,
+            'endpoints': endpoints
+        }
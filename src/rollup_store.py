@@ -0,0 +1,261 @@
+import numpy as np
+import pandas as pd
+from pathlib import Path
+import logging
+from src.frame_schema import normalize_codes
+from src.storage import write_csv_atomic
+
+class RollupStore:
+    """
+    市場全体・33業種別の日次/週次/月次の集計表を保持するクラス
+
+    日次データの保存時にその日の集計（件数・合計・二乗和・平均・中央値・標準偏差）を
+    rollups/daily.csv に追記し、その日を含む週・月の行だけを日次の行から再計算する。
+    概況チャートはこの小さな表だけを読めばよく、履歴の長さに比例して重くならない。
+    週次・月次の平均と標準偏差は期間内の全銘柄・全日の値を合算したもので、
+    中央値は日次中央値の中央値とする。
+    """
+
+    METRICS = ['price', 'last_price', 'expected_per', 'expected_dividend_yield', 'expected_roe', 'actual_pbr']
+    GRANULARITIES = ['daily', 'weekly', 'monthly']
+    COLUMNS = ['date', 'scope', 'metric', 'count', 'sum', 'sum_sq', 'mean', 'median', 'std']
+
+    # 市場全体を表すスコープ名
+    ALL = 'all'
+
+    def __init__(self, rollup_dir):
+        self.rollup_dir = Path(rollup_dir)
+        self.rollup_dir.mkdir(parents=True, exist_ok=True)
+        self.logger = logging.getLogger(__name__)
+        self._tables = {}
+
+    @classmethod
+    def _empty(cls):
+        """
+        列の型を揃えた空の集計表
+        """
+        return pd.DataFrame({
+            column: pd.Series(dtype=object if column in ('date', 'scope', 'metric') else float)
+            for column in cls.COLUMNS
+        })
+
+    def _path(self, granularity):
+        return self.rollup_dir / f"{granularity}.csv"
+
+    def _load(self, granularity):
+        """
+        集計表を読み込み（更新時刻が変わらない限りメモリ上の表を使う）
+        """
+        path = self._path(granularity)
+        mtime = path.stat().st_mtime_ns if path.exists() else None
+        cached = self._tables.get(granularity)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        if mtime is None:
+            table = self._empty()
+        else:
+            table = pd.read_csv(path, dtype={'date': str, 'scope': str, 'metric': str})
+        self._tables[granularity] = (mtime, table)
+        return table
+
+    def _save(self, granularity, table):
+        """
+        集計表を一時ファイル経由で置き換える
+        """
+        path = self._path(granularity)
+        table = table.sort_values(['date', 'scope', 'metric']).reset_index(drop=True)
+        write_csv_atomic(table, path, encoding='utf-8')
+        self._tables[granularity] = (path.stat().st_mtime_ns, table)
+
+    @staticmethod
+    def period_start(dates, granularity):
+        """
+        日付を週（月曜始まり）・月の開始日に変換
+
+        Args:
+            dates (pd.Series): YYYY-MM-DD形式の日付
+            granularity (str): 'daily'、'weekly' または 'monthly'
+
+        Returns:
+            pd.Series: 期間の開始日（YYYY-MM-DD形式）
+        """
+        if granularity == 'daily':
+            return dates
+        timestamps = pd.to_datetime(dates)
+        if granularity == 'weekly':
+            starts = timestamps - pd.to_timedelta(timestamps.dt.weekday, unit='D')
+        else:
+            starts = timestamps.dt.to_period('M').dt.start_time
+        return starts.dt.strftime('%Y-%m-%d')
+
+    def compute_daily(self, date, data, sector_map=None):
+        """
+        1日分のデータから市場全体・業種別の集計行を作成
+
+        Args:
+            date (str): 日付（YYYY-MM-DD形式）
+            data (pd.DataFrame): code と指標列を持つデータ
+            sector_map (dict): 証券コード → 33業種区分
+
+        Returns:
+            pd.DataFrame: 集計行
+        """
+        metrics = [m for m in self.METRICS if m in data.columns]
+        if not metrics:
+            return self._empty()
+
+        # 読み込み時にfloat32にした列も、二乗和の桁落ちを避けるためfloat64で集計する
+        values = data[metrics].apply(pd.to_numeric, errors='coerce').astype('float64')
+        scopes = pd.Series(self.ALL, index=data.index)
+
+        frames = [self._aggregate(values, scopes)]
+        if sector_map and 'code' in data.columns:
+            sectors = normalize_codes(data['code']).map(sector_map)
+            known = sectors.notna()
+            if known.any():
+                frames.append(self._aggregate(values[known], sectors[known]))
+
+        rows = pd.concat(frames, ignore_index=True)
+        rows.insert(0, 'date', date)
+        return rows[self.COLUMNS]
+
+    @staticmethod
+    def _aggregate(values, scopes):
+        """
+        スコープごと・指標ごとに件数・合計・二乗和・平均・中央値・標準偏差を集計
+        """
+        grouped = values.groupby(scopes.to_numpy())
+        squared = (values ** 2).groupby(scopes.to_numpy())
+        stats = {
+            'count': grouped.count(),
+            'sum': grouped.sum(),
+            'sum_sq': squared.sum(),
+            'mean': grouped.mean(),
+            'median': grouped.median(),
+            'std': grouped.std(ddof=1),
+        }
+        rows = []
+        for metric in values.columns:
+            metric_rows = pd.DataFrame({name: table[metric] for name, table in stats.items()})
+            metric_rows.insert(0, 'metric', metric)
+            metric_rows.insert(0, 'scope', metric_rows.index)
+            rows.append(metric_rows)
+        return pd.concat(rows, ignore_index=True)
+
+    def _combine(self, daily_rows, granularity):
+        """
+        日次の集計行から週次・月次の集計行を作成
+        """
+        rows = daily_rows.assign(date=self.period_start(daily_rows['date'], granularity))
+        grouped = rows.groupby(['date', 'scope', 'metric'])
+        combined = grouped[['count', 'sum', 'sum_sq']].sum()
+        combined['median'] = grouped['median'].median()
+
+        count = combined['count']
+        combined['mean'] = (combined['sum'] / count).where(count > 0)
+        variance = (combined['sum_sq'] - count * combined['mean'] ** 2) / (count - 1)
+        combined['std'] = np.sqrt(variance.clip(lower=0)).where(count > 1)
+        return combined.reset_index()[self.COLUMNS]
+
+    def update(self, date, data, sector_map=None):
+        """
+        1日分の集計を登録し、その日を含む週・月の集計を更新（既存の日付は置き換え）
+
+        Args:
+            date (str): 日付（YYYY-MM-DD形式）
+            data (pd.DataFrame): code と指標列を持つデータ
+            sector_map (dict): 証券コード → 33業種区分
+        """
+        self.update_many({date: data}, sector_map)
+
+    def update_many(self, frames, sector_map=None):
+        """
+        複数日の集計をまとめて登録（週次・月次の再計算と書き込みは1回だけ行う）
+
+        Args:
+            frames (dict): 日付 → データ
+            sector_map (dict): 証券コード → 33業種区分
+        """
+        if not frames:
+            return
+
+        self.add_daily_rows(pd.concat([self.compute_daily(date, data, sector_map) for date, data in frames.items()],
+                                      ignore_index=True))
+
+    def add_daily_rows(self, rows):
+        """
+        compute_dailyで作成した集計行を登録（同じ日付の既存行は置き換え）
+
+        Args:
+            rows (pd.DataFrame): 集計行
+        """
+        if rows.empty:
+            return
+
+        dates = list(pd.unique(rows['date']))
+        daily = self._load('daily')
+        daily = pd.concat([daily[~daily['date'].isin(dates)], rows], ignore_index=True)
+        self._save('daily', daily)
+
+        self._update_periods(daily, dates)
+
+    def remove(self, dates):
+        """
+        日付の集計を削除し、該当する週・月の集計を再計算
+        """
+        dates = list(dates)
+        daily = self._load('daily')
+        if daily.empty or not dates:
+            return
+
+        daily = daily[~daily['date'].isin(dates)]
+        self._save('daily', daily)
+        self._update_periods(daily, dates)
+
+    def _update_periods(self, daily, dates):
+        """
+        指定日を含む週・月の集計だけを日次の集計行から再計算
+        """
+        for granularity in ['weekly', 'monthly']:
+            periods = set(self.period_start(pd.Series(dates), granularity))
+            affected = daily[self.period_start(daily['date'], granularity).isin(periods)]
+            table = self._load(granularity)
+            table = pd.concat([table[~table['date'].isin(periods)], self._combine(affected, granularity)],
+                              ignore_index=True)
+            self._save(granularity, table)
+
+    def dates(self):
+        """
+        日次集計が登録済みの日付
+        """
+        return set(self._load('daily')['date'])
+
+    def read(self, granularity='daily', start_date=None, end_date=None, scope=ALL, metrics=None):
+        """
+        集計表を読み込み
+
+        Args:
+            granularity (str): 'daily'、'weekly' または 'monthly'
+            start_date (str): 開始日（YYYY-MM-DD形式）
+            end_date (str): 終了日（YYYY-MM-DD形式）
+            scope (str): 'all' または33業種区分（Noneの場合はすべて）
+            metrics (list): 指標のリスト（Noneの場合はすべて）
+
+        Returns:
+            pd.DataFrame: 集計行（date, scope, metric 順）
+        """
+        if granularity not in self.GRANULARITIES:
+            raise ValueError(f"未知の集計単位: {granularity}")
+
+        table = self._load(granularity)
+        mask = pd.Series(True, index=table.index)
+        if start_date is not None:
+            mask &= table['date'] >= self.period_start(pd.Series([start_date]), granularity).iloc[0]
+        if end_date is not None:
+            mask &= table['date'] <= end_date
+        if scope is not None:
+            mask &= table['scope'] == scope
+        if metrics is not None:
+            mask &= table['metric'].isin(metrics)
+        return table[mask].reset_index(drop=True)
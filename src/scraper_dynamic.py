@@ -16,6 +16,8 @@ import argparse
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 from src.stock_code_fetcher_working import WorkingStockCodeFetcher
 from src.data_manager import DataManager
+from src.frame_schema import normalize_codes
+from src.output_store import OutputStore
 
 class DynamicStockScraper:
     """
@@ -225,7 +227,7 @@ class DynamicStockScraper:
         """
         try:
             # コードを4桁ゼロ埋めの文字列に正規化
-            normalized_codes = [str(code).strip().zfill(4) for code in self.codes]
+            normalized_codes = normalize_codes(pd.Series(self.codes, dtype=object)).tolist()
 
             # 可視化・処理系と時系列系の両方に互換のある列名で保存
             results_df = pd.DataFrame({
@@ -253,22 +255,8 @@ class DynamicStockScraper:
             if missing:
                 raise ValueError(f"出力に必須列が不足しています: {missing}")
             
-            # 既存ファイルがあればマージ（codeキーで上書き追加）
-            if os.path.exists(filename):
-                try:
-                    existing = pd.read_csv(filename)
-                    if 'code' in existing.columns:
-                        existing['code'] = existing['code'].astype(str).str.strip().str.replace('.0', '', regex=False)
-                        existing['code'] = existing['code'].apply(lambda x: str(int(x)).zfill(4) if x.isdigit() else x)
-                    merged = existing.set_index('code')
-                    merged.update(results_df.set_index('code'))
-                    new_only = results_df[~results_df['code'].isin(merged.index)].set_index('code')
-                    merged = pd.concat([merged, new_only])
-                    merged.reset_index().to_csv(filename, index=False, encoding='utf-8-sig')
-                except Exception:
-                    results_df.to_csv(filename, index=False, encoding='utf-8-sig')
-            else:
-                results_df.to_csv(filename, index=False, encoding='utf-8-sig')
+            # codeキーで上書き追加（ジャーナルへの追記のみ。競合は取得時刻が新しい方を採用）
+            OutputStore(filename).upsert(results_df)
             print(f"結果を{filename}に保存しました（マージ済み）")
             
             # 時系列データとしても保存
@@ -292,11 +280,10 @@ class DynamicStockScraper:
             
             # 再開・開始位置・件数の制御
             codes_to_scrape = list(self.codes)
-            if resume and os.path.exists('data/output.csv'):
+            if resume:
                 try:
-                    existing = pd.read_csv('data/output.csv')
-                    if 'code' in existing.columns:
-                        existing_codes = set(existing['code'].astype(str).str.strip().apply(lambda x: str(int(x)).zfill(4) if x.isdigit() else x))
+                    existing_codes = OutputStore('data/output.csv').codes()
+                    if existing_codes:
                         codes_to_scrape = [c for c in codes_to_scrape if c not in existing_codes]
                         print(f"再開モード: 既存{len(existing_codes)}件スキップ、対象{len(codes_to_scrape)}件")
                 except Exception as e:
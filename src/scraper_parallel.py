@@ -13,6 +13,7 @@ import threading
 from queue import Queue
 import logging
 from src.config import config
+from src.output_store import OutputStore
 
 class ParallelScraper:
     """
@@ -228,31 +229,46 @@ class ParallelScraper:
         
         return results
 
-def main():
+# output.csv に保存する列
+OUTPUT_COLUMNS = ['code', 'current_url', 'name', 'price', 'expected_per',
+                  'expected_dividend_yield', 'expected_roe', 'actual_pbr']
+
+def read_codes(path='data/codes.csv'):
     """
-    メイン実行関数
+    銘柄コードの一覧を読み込み
     """
-    # CSVの読み込み
-    c = pd.read_csv('data/codes.csv', header=None)
+    c = pd.read_csv(path, header=None)
     codes = []
     for cv in c.values:
         codes.append(cv[0])
+    return codes
+
+def build_output_frame(results):
+    """
+    スクレイピング結果から output.csv に保存するDataFrameを生成
+    """
+    # DataFrameの生成
+    df = pd.DataFrame(results)
+    
+    # 必要な列のみを選択
+    return df[OUTPUT_COLUMNS]
+
+def main():
+    """
+    メイン実行関数
+    """
+    # CSVの読み込み
+    codes = read_codes('data/codes.csv')
     
     # 並列スクレイパーの初期化
     scraper = ParallelScraper(max_workers=4)
     
     # スクレイピング実行
     results = scraper.scrape_all_stocks(codes)
+    df_final = build_output_frame(results)
     
-    # DataFrameの生成
-    df = pd.DataFrame(results)
-    
-    # 必要な列のみを選択
-    df_final = df[['code', 'current_url', 'name', 'price', 'expected_per', 
-                   'expected_dividend_yield', 'expected_roe', 'actual_pbr']]
-    
-    # ファイルに保存
-    df_final.to_csv("data/output.csv", index=False, encoding="UTF-8")
+    # ファイルに保存（他のプロセスの書き込み中に読まれても壊れたファイルが見えないようにする）
+    OutputStore("data/output.csv").replace(df_final)
     print(f"スクレイピング完了: {len(results)}件の銘柄を処理しました")
 
 if __name__ == "__main__":
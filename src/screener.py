@@ -0,0 +1,462 @@
+"""
+処理済みデータ・履歴データに対するスクリーニング（条件検索）エンジン
+
+クエリは小さな条件式で書く:
+
+    pbr < 1 and roe > 8 and sector == '銀行業'
+    per between 5 and 15 and not sector in ('銀行業', '保険業')
+    (yield >= 3 or pbr_gap < 0) and date >= '2025-01-01'
+
+- 数値・日付などの範囲条件は、列ごとの整列済みインデックスを二分探索して解く
+- 業種などのカテゴリ列の一致条件は、値ごとのビットマップ（packbits）で解く
+- 条件の組み合わせ（and / or / not）はビットマップのビット演算で行う
+
+インデックスは列ごとに初回の問い合わせ時に作成し、結果はデータのバージョンと
+クエリの組ごとにキャッシュする。
+"""
+import re
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+import argparse
+import logging
+from src.indicators import SECTOR_COLUMN, compute_indicators
+
+# クエリで使える列の別名
+ALIASES = {
+    'pbr': 'actual_pbr',
+    'per': 'expected_per',
+    'roe': 'expected_roe',
+    'yield': 'expected_dividend_yield',
+    'dividend_yield': 'expected_dividend_yield',
+    'sector': SECTOR_COLUMN,
+    'implied_pbr': 'pbr_indicator',
+}
+
+# ビットマップで解く列（カテゴリ型の列も対象）
+BITMAP_COLUMNS = [SECTOR_COLUMN]
+
+_TOKEN = re.compile(r"""
+    \s*(?:
+        (?P<number>-?\d+(?:\.\d+)?(?:[eE]-?\d+)?)
+      | '(?P<squote>[^']*)'
+      | "(?P<dquote>[^"]*)"
+      | (?P<op><=|>=|==|!=|<|>|=)
+      | (?P<punct>[(),])
+      | (?P<word>[^\s()<>=!,'"]+)
+    )""", re.VERBOSE)
+
+KEYWORDS = {'and', 'or', 'not', 'in', 'between'}
+
+class QueryError(ValueError):
+    """クエリの構文・列名の誤り"""
+
+def tokenize(query):
+    """
+    クエリを (種類, 値) のトークン列に分解
+    """
+    tokens = []
+    position = 0
+    query = query.strip()
+    while position < len(query):
+        match = _TOKEN.match(query, position)
+        if match is None or match.end() == position:
+            raise QueryError(f"解釈できない文字があります: {query[position:]!r}")
+        position = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'number':
+            tokens.append(('value', float(value)))
+        elif kind in ('squote', 'dquote'):
+            tokens.append(('value', value))
+        elif kind == 'word' and value.lower() in KEYWORDS:
+            tokens.append(('keyword', value.lower()))
+        else:
+            tokens.append((kind, value))
+    return tokens
+
+def parse(query):
+    """
+    クエリを構文木に変換
+
+    構文木は ('and', 左, 右)、('or', 左, 右)、('not', 式)、
+    ('range', 列, 下限, 下限を含むか, 上限, 上限を含むか)、('in', 列, 値のタプル) のタプル。
+
+    Returns:
+        tuple: 構文木
+    """
+    tokens = tokenize(query)
+    position = 0
+
+    def peek(kind=None, value=None):
+        if position >= len(tokens):
+            return False
+        token = tokens[position]
+        return (kind is None or token[0] == kind) and (value is None or token[1] == value)
+
+    def take(kind=None, value=None):
+        nonlocal position
+        if not peek(kind, value):
+            found = tokens[position][1] if position < len(tokens) else '（終端）'
+            raise QueryError(f"{value or kind}が必要な位置に{found!r}があります")
+        position += 1
+        return tokens[position - 1][1]
+
+    def parse_or():
+        node = parse_and()
+        while peek('keyword', 'or'):
+            take()
+            node = ('or', node, parse_and())
+        return node
+
+    def parse_and():
+        node = parse_not()
+        while peek('keyword', 'and'):
+            take()
+            node = ('and', node, parse_not())
+        return node
+
+    def parse_not():
+        if peek('keyword', 'not'):
+            take()
+            return ('not', parse_not())
+        if peek('punct', '('):
+            take()
+            node = parse_or()
+            take('punct', ')')
+            return node
+        return parse_predicate()
+
+    def parse_predicate():
+        name = take('word')
+        column = ALIASES.get(name.lower(), name)
+        negate = False
+        if peek('keyword', 'not'):
+            take()
+            negate = True
+
+        if peek('keyword', 'in'):
+            take()
+            take('punct', '(')
+            values = [take('value')]
+            while peek('punct', ','):
+                take()
+                values.append(take('value'))
+            take('punct', ')')
+            node = ('in', column, tuple(values))
+        elif peek('keyword', 'between'):
+            take()
+            low = take('value')
+            take('keyword', 'and')
+            node = ('range', column, low, True, take('value'), True)
+        else:
+            op = take('op')
+            value = take('value')
+            node = {
+                '<': ('range', column, None, False, value, False),
+                '<=': ('range', column, None, False, value, True),
+                '>': ('range', column, value, False, None, False),
+                '>=': ('range', column, value, True, None, False),
+                '==': ('in', column, (value,)),
+                '=': ('in', column, (value,)),
+                '!=': ('not', ('in', column, (value,))),
+            }[op]
+            if op == '!=':
+                # 欠損値は != でも一致しない
+                node = ('and', node, ('range', column, None, False, None, False))
+        return ('not', node) if negate else node
+
+    if not tokens:
+        raise QueryError("クエリが空です")
+    tree = parse_or()
+    if position != len(tokens):
+        raise QueryError(f"余分なトークンがあります: {tokens[position][1]!r}")
+    return tree
+
+class ScreeningIndex:
+    """
+    1つのデータに対する列ごとの整列済みインデックスとビットマップ
+
+    整列済みインデックスは欠損値を除いた (値の昇順, 行番号) の配列で、範囲条件は
+    二分探索で該当範囲を求めてビットマップにする。ビットマップは行数ビットを
+    np.packbits で詰めたuint8配列。
+    """
+
+    def __init__(self, data):
+        self.data = data.reset_index(drop=True)
+        self.rows = len(self.data)
+        self._sorted = {}
+        self._bitmaps = {}
+        self.logger = logging.getLogger(__name__)
+
+    def _column(self, column):
+        if column not in self.data.columns:
+            raise QueryError(f"未知の列です: {column}")
+        return self.data[column]
+
+    def _is_bitmap_column(self, column):
+        return column in BITMAP_COLUMNS or isinstance(self._column(column).dtype, pd.CategoricalDtype)
+
+    def pack(self, mask):
+        return np.packbits(mask)
+
+    def unpack(self, bitmap):
+        return np.unpackbits(bitmap, count=self.rows).astype(bool)
+
+    def none(self):
+        return np.zeros((self.rows + 7) // 8, dtype=np.uint8)
+
+    def sorted_index(self, column):
+        """
+        列の整列済みインデックス（値の配列, 行番号の配列）
+        """
+        if column not in self._sorted:
+            values = self._column(column)
+            present = values.notna().to_numpy()
+            if pd.api.types.is_float_dtype(values):
+                # float32の列はfloat32のまま比較し、pandasでの比較と結果をそろえる
+                array = values.to_numpy(dtype=values.dtype, na_value=np.nan)
+            elif pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+                array = values.to_numpy(dtype='float64', na_value=np.nan)
+            else:
+                # 日付・コードなどの文字列は文字列の順で並べる
+                array = values.astype(object).astype(str).to_numpy(dtype=object)
+
+            rows = np.flatnonzero(present)
+            order = np.argsort(array[present], kind='stable')
+            self._sorted[column] = (array[present][order], rows[order])
+        return self._sorted[column]
+
+    def bitmap(self, column, value):
+        """
+        カテゴリ列の値ごとのビットマップ
+        """
+        if column not in self._bitmaps:
+            codes, uniques = pd.factorize(self._column(column))
+            self._bitmaps[column] = {
+                value: self.pack(codes == code) for code, value in enumerate(uniques)
+            }
+        empty = self.none()
+        return self._bitmaps[column].get(value, empty)
+
+    def _range(self, column, low, low_inclusive, high, high_inclusive):
+        values, rows = self.sorted_index(column)
+        low, high = (self._bound(values, column, bound) for bound in (low, high))
+
+        start = 0 if low is None else np.searchsorted(values, low, side='left' if low_inclusive else 'right')
+        end = len(values) if high is None else np.searchsorted(values, high, side='right' if high_inclusive else 'left')
+
+        mask = np.zeros(self.rows, dtype=bool)
+        if end > start:
+            mask[rows[start:end]] = True
+        return self.pack(mask)
+
+    @staticmethod
+    def _bound(values, column, bound):
+        """
+        比較する値を列の型に合わせる（文字列列では数値も文字列として比較）
+        """
+        if bound is None:
+            return None
+        if values.dtype == object:
+            return f"{bound:g}" if isinstance(bound, float) else bound
+        try:
+            return values.dtype.type(bound)
+        except ValueError:
+            raise QueryError(f"数値の列 {column} を文字列 {bound!r} と比較できません") from None
+
+    def evaluate(self, node):
+        """
+        構文木を評価してビットマップを返す
+        """
+        kind = node[0]
+        if kind == 'and':
+            return self.evaluate(node[1]) & self.evaluate(node[2])
+        if kind == 'or':
+            return self.evaluate(node[1]) | self.evaluate(node[2])
+        if kind == 'not':
+            # 末尾の余りビットは unpack 時に切り捨てられる
+            return ~self.evaluate(node[1])
+        if kind == 'range':
+            return self._range(*node[1:])
+
+        column, values = node[1], node[2]
+        if self._is_bitmap_column(column):
+            result = self.none()
+            for value in values:
+                result |= self.bitmap(column, value)
+            return result
+
+        result = self.none()
+        for value in values:
+            result |= self._range(column, value, True, value, True)
+        return result
+
+    def positions(self, node, order_by=None, ascending=True):
+        """
+        条件に一致する行番号（order_by を指定した場合はその列の順、欠損値は末尾）
+        """
+        mask = self.unpack(self.evaluate(node))
+        if order_by is None:
+            return np.flatnonzero(mask)
+
+        _, rows = self.sorted_index(order_by)
+        ordered = rows[mask[rows]]
+        if not ascending:
+            ordered = ordered[::-1]
+        missing = np.setdiff1d(np.flatnonzero(mask), ordered, assume_unique=True)
+        return np.concatenate([ordered, missing])
+
+class Screener:
+    """
+    スクリーニングAPI
+
+    データのバージョン（処理済みデータのキャッシュキーや履歴の更新状況）ごとに
+    インデックスと検索結果をキャッシュする。同じバージョンでは2回目以降の
+    問い合わせはインデックスの作成もデータの読み込みも行わない。
+    """
+
+    # キャッシュするインデックス（データのバージョン）の数と検索結果の数
+    MAX_INDEXES = 4
+    MAX_RESULTS = 256
+
+    def __init__(self, data_manager=None):
+        self.data_manager = data_manager
+        self._indexes = OrderedDict()
+        self._results = OrderedDict()
+        self.logger = logging.getLogger(__name__)
+
+    def index(self, version, loader):
+        """
+        バージョンに対応するインデックス（なければ loader() のデータから作成）
+        """
+        if version in self._indexes:
+            self._indexes.move_to_end(version)
+            return self._indexes[version]
+
+        data = loader()
+        index = ScreeningIndex(data)
+        index.source = data
+        self._indexes[version] = index
+        while len(self._indexes) > self.MAX_INDEXES:
+            stale, _ = self._indexes.popitem(last=False)
+            for key in [k for k in self._results if k[0] == stale]:
+                del self._results[key]
+        return index
+
+    def screen(self, query, data=None, version=None, loader=None, columns=None,
+               order_by=None, ascending=True, limit=None):
+        """
+        クエリに一致する行を取得
+
+        Args:
+            query (str): クエリ
+            data (pd.DataFrame): 対象データ（loader を指定した場合は不要）
+            version (str): データのバージョン（Noneの場合はデータの内容から計算）
+            loader (callable): データを返す関数（インデックスがない場合だけ呼ぶ）
+            columns (list): 返す列（Noneの場合はすべて）
+            order_by (str): 並べ替える列（別名も可）
+            ascending (bool): 昇順か
+            limit (int): 最大件数
+
+        Returns:
+            pd.DataFrame: 一致した行
+        """
+        if loader is None:
+            if data is None:
+                raise ValueError("data か loader を指定してください")
+            loader = lambda: data
+            if version is None:
+                # インデックスが元のデータを参照し続けるため、キャッシュ中に id が再利用されることはない
+                version = f"frame:{id(data)}"
+
+        tree = parse(query)
+        order_by = ALIASES.get(order_by, order_by) if order_by else None
+        index = self.index(version, loader)
+
+        key = (version, repr(tree), order_by, ascending)
+        positions = self._results.get(key)
+        if positions is None:
+            positions = index.positions(tree, order_by, ascending)
+            self._results[key] = positions
+            while len(self._results) > self.MAX_RESULTS:
+                self._results.popitem(last=False)
+        else:
+            self._results.move_to_end(key)
+
+        if limit is not None:
+            positions = positions[:limit]
+        result = index.data.iloc[positions]
+        if columns:
+            result = result[[ALIASES.get(c, c) for c in columns]]
+        return result.reset_index(drop=True)
+
+    def screen_processed(self, query, **kwargs):
+        """
+        process_data() の処理結果（全業種）をスクリーニング
+        """
+        from src.data_processing import SectorMaster, get_cache_key, process_data
+
+        version = f"processed:{get_cache_key(SectorMaster())}"
+
+        def load():
+            grouped_data = process_data()
+            return pd.concat(list(grouped_data.values()), ignore_index=True) if grouped_data else pd.DataFrame()
+
+        return self.screen(query, version=version, loader=load, **kwargs)
+
+    def screen_history(self, query, start_date=None, end_date=None, **kwargs):
+        """
+        履歴データ（日付×業種ごとの指標付き）をスクリーニング
+        """
+        from src.data_manager import DataManager
+        from src.sector_master import SectorMaster
+
+        if self.data_manager is None:
+            self.data_manager = DataManager()
+        data_manager = self.data_manager
+        files = data_manager.metadata['files']
+        dates = [d for d in data_manager.dates
+                 if (start_date is None or d >= start_date) and (end_date is None or d <= end_date)]
+        stamp = json.dumps([(d, files[d].get('created_at'), files[d].get('rows')) for d in dates])
+        version = f"history:{hashlib.sha256(stamp.encode('utf-8')).hexdigest()[:16]}"
+
+        def load():
+            history = data_manager.get_time_series_data(start_date, end_date)
+            if history.empty:
+                return history
+            history[SECTOR_COLUMN] = SectorMaster().lookup(history['code']).astype('category')
+            return compute_indicators(history, group_columns=('date', SECTOR_COLUMN))
+
+        return self.screen(query, version=version, loader=load, **kwargs)
+
+def main():
+    """
+    メイン実行関数
+    """
+    parser = argparse.ArgumentParser(description='処理済みデータ・履歴データのスクリーニング')
+    parser.add_argument('query', type=str, help="条件式（例: \"pbr < 1 and roe > 8 and sector == '銀行業'\"）")
+    parser.add_argument('--history', action='store_true', help='履歴データを対象にする')
+    parser.add_argument('--start-date', type=str, default=None, help='履歴の開始日（YYYY-MM-DD形式）')
+    parser.add_argument('--end-date', type=str, default=None, help='履歴の終了日（YYYY-MM-DD形式）')
+    parser.add_argument('--order-by', type=str, default=None, help='並べ替える列')
+    parser.add_argument('--desc', action='store_true', help='降順に並べる')
+    parser.add_argument('--limit', type=int, default=50, help='最大件数')
+    args = parser.parse_args()
+
+    screener = Screener()
+    options = dict(order_by=args.order_by, ascending=not args.desc, limit=args.limit)
+    if args.history:
+        result = screener.screen_history(args.query, args.start_date, args.end_date, **options)
+    else:
+        result = screener.screen_processed(args.query, **options)
+
+    columns = [c for c in ['date', 'code', 'name', SECTOR_COLUMN, 'actual_pbr', 'expected_per',
+                           'expected_roe', 'expected_dividend_yield', 'pbr_gap'] if c in result.columns]
+    print(result[columns].to_string(index=False))
+    print(f"{len(result)}件")
+
+if __name__ == "__main__":
+    main()
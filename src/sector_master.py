@@ -0,0 +1,226 @@
+import json
+import pandas as pd
+from datetime import datetime
+from pathlib import Path
+import argparse
+import logging
+from src.frame_schema import normalize_codes
+from src.storage import atomic_write, file_hash, file_lock, write_csv_atomic, write_json_atomic
+
+try:
+    import pyarrow  # noqa: F401 (Parquetでの保存に使用)
+except ImportError:
+    pyarrow = None
+
+# 業種マスタの辞書のキャッシュ（マスタのパス → (更新時刻, 証券コード → 33業種区分)）
+_SECTOR_MAP_CACHE = {}
+
+class SectorMaster:
+    """
+    東証の銘柄一覧（data_j.xls）を変換した業種マスタを管理するクラス
+
+    data_j.xls の解析は重いため、1度だけ読み込んで sector_master.parquet
+    （pyarrowがない場合は sector_master.csv）に変換し、元ファイルのハッシュを
+    sector_master.json に記録する。以降は元ファイルのハッシュが変わった場合だけ
+    作り直す。J-Quantsの上場銘柄一覧（listed/info）の業種で更新することもできる。
+    """
+
+    COLUMNS = ['code', '銘柄名', '市場・商品区分', '33業種区分', '17業種区分']
+
+    # listed/info の項目 → マスタの列
+    JQUANTS_FIELDS = {
+        'Code': 'code',
+        'CompanyName': '銘柄名',
+        'MarketCodeName': '市場・商品区分',
+        'Sector33CodeName': '33業種区分',
+        'Sector17CodeName': '17業種区分',
+    }
+
+    def __init__(self, source='data/data_j.xls', master_dir='data'):
+        self.source = Path(source)
+        self.master_dir = Path(master_dir)
+        suffix = 'parquet' if pyarrow is not None else 'csv'
+        self.table_path = self.master_dir / f"sector_master.{suffix}"
+        self.meta_path = self.master_dir / "sector_master.json"
+        self.logger = logging.getLogger(__name__)
+
+    def _load_meta(self):
+        if not self.meta_path.exists():
+            return {}
+        with open(self.meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def is_stale(self):
+        """
+        マスタが未作成か、元ファイルの内容が変わっているか
+        """
+        if not self.table_path.exists():
+            return True
+        if not self.source.exists():
+            return False
+        return self._load_meta().get('source_hash') != file_hash(self.source)
+
+    def ensure(self):
+        """
+        必要な場合だけマスタを作り直す
+
+        Returns:
+            Path: マスタのパス（元ファイルもマスタもない場合はNone）
+        """
+        if self.is_stale():
+            with file_lock(self.table_path):
+                if self.is_stale():
+                    if not self.source.exists():
+                        return None
+                    self.rebuild()
+        return self.table_path
+
+    def rebuild(self):
+        """
+        data_j.xls からマスタを作成
+        """
+        type_data = pd.read_excel(self.source, usecols=[c if c != 'code' else 'コード' for c in self.COLUMNS],
+                                  dtype={'コード': str})
+        table = type_data.rename(columns={'コード': 'code'})
+        self._write(table, source=self.source.name)
+        self.logger.info(f"{self.source.name}から業種マスタを作成しました: {len(table)}件")
+
+    def refresh_from_jquants(self, client=None):
+        """
+        J-Quantsの上場銘柄一覧の業種でマスタを更新
+
+        Args:
+            client (JQuantsClient): クライアント（Noneの場合は作成する）
+
+        Returns:
+            bool: 更新できたか
+        """
+        if client is None:
+            from src.jquants_client import JQuantsClient
+            client = JQuantsClient()
+
+        listed_info = client.get_listed_info()
+        if not listed_info:
+            self.logger.warning("上場銘柄一覧を取得できなかったため業種マスタを更新しません")
+            return False
+
+        table = pd.DataFrame(listed_info).reindex(columns=list(self.JQUANTS_FIELDS))
+        table = table.rename(columns=self.JQUANTS_FIELDS)
+        # listed/info は5桁コード（末尾0）のため4桁にそろえる
+        codes = table['code'].astype(str).str.strip()
+        table['code'] = codes.where(~(codes.str.len().eq(5) & codes.str.endswith('0')), codes.str[:4])
+
+        with file_lock(self.table_path):
+            self._write(table, source='jquants')
+        self.logger.info(f"J-Quantsの上場銘柄一覧から業種マスタを更新しました: {len(table)}件")
+        return True
+
+    def _write(self, table, source):
+        """
+        マスタを書き込み、元ファイルのハッシュを記録（ロック取得済みで呼ぶ）
+        """
+        table = table.reindex(columns=self.COLUMNS)
+        table['code'] = normalize_codes(table['code'])
+        table = table.drop_duplicates('code', keep='last').sort_values('code').reset_index(drop=True)
+        for column in self.COLUMNS:
+            table[column] = table[column].astype(str).where(table[column].notna())
+
+        if self.table_path.suffix == '.parquet':
+            with atomic_write(self.table_path, 'wb') as f:
+                table.to_parquet(f, index=False)
+        else:
+            write_csv_atomic(table, self.table_path, encoding='utf-8')
+
+        # J-Quantsで更新した場合も元ファイルのハッシュを残し、元ファイルが変わるまでは作り直さない
+        write_json_atomic({
+            'source': source,
+            'source_hash': file_hash(self.source),
+            'updated_at': datetime.now().isoformat(timespec='seconds'),
+            'rows': len(table),
+        }, self.meta_path, indent=2)
+
+    def table(self):
+        """
+        業種マスタを読み込み
+
+        Returns:
+            pd.DataFrame: COLUMNS の列を持つマスタ（元ファイルもマスタもない場合は空）
+        """
+        if self.ensure() is None:
+            return pd.DataFrame(columns=self.COLUMNS)
+        if self.table_path.suffix == '.parquet':
+            return pd.read_parquet(self.table_path)
+        return pd.read_csv(self.table_path, dtype=str, encoding='utf-8')
+
+    def sector_map(self):
+        """
+        証券コード → 33業種区分 の辞書（マスタの更新時刻が変わらない限り再利用）
+
+        Returns:
+            dict: 4桁の証券コード → 33業種区分
+        """
+        if self.ensure() is None:
+            return {}
+
+        key = str(self.table_path.resolve())
+        mtime = self.table_path.stat().st_mtime_ns
+        cached = _SECTOR_MAP_CACHE.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        table = self.table()
+        sector_map = dict(zip(table['code'], table['33業種区分']))
+        _SECTOR_MAP_CACHE[key] = (mtime, sector_map)
+        return sector_map
+
+    def lookup(self, codes):
+        """
+        証券コードの列を33業種区分に変換
+
+        Args:
+            codes (pd.Series): 証券コードの列
+
+        Returns:
+            pd.Series: 33業種区分（マスタにない銘柄は欠損値）
+        """
+        return normalize_codes(codes).map(self.sector_map())
+
+def load_sector_map(path='data/data_j.xls'):
+    """
+    証券コード → 33業種区分 の辞書を業種マスタから取得
+
+    Args:
+        path (str): 銘柄一覧（data_j.xls）のパス
+
+    Returns:
+        dict: 4桁の証券コード → 33業種区分（ファイルがない場合は空）
+    """
+    try:
+        return SectorMaster(path, Path(path).parent).sector_map()
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"業種データの読み込みに失敗: {e}")
+        return {}
+
+def main():
+    """
+    メイン実行関数
+    """
+    parser = argparse.ArgumentParser(description='data_j.xls から業種マスタを作成・更新')
+    parser.add_argument('--source', type=str, default='data/data_j.xls', help='銘柄一覧（data_j.xls）')
+    parser.add_argument('--rebuild', action='store_true', help='元ファイルが変わっていなくても作り直す')
+    parser.add_argument('--jquants', action='store_true', help='J-Quantsの上場銘柄一覧で更新')
+    args = parser.parse_args()
+
+    master = SectorMaster(args.source, Path(args.source).parent)
+    if args.jquants:
+        master.refresh_from_jquants()
+    elif args.rebuild:
+        with file_lock(master.table_path):
+            master.rebuild()
+    else:
+        master.ensure()
+
+    print(f"業種マスタ: {master.table_path} ({len(master.sector_map())}銘柄)")
+
+if __name__ == "__main__":
+    main()
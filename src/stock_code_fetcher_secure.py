@@ -49,8 +49,8 @@ class SecureStockCodeFetcher:
             return None
         
         try:
-            # 認証を実行
-            if not self.jquants_client.authenticate():
+            # 認証状態を確認（共有ストアに有効なIDトークンがあれば再認証しない）
+            if not self.jquants_client._ensure_authenticated():
                 self.logger.error("j-Quants API認証に失敗しました")
                 return None
             
@@ -0,0 +1,157 @@
+"""
+共有ファイルの書き込みを安全に行うための小さなストレージ層
+
+- file_lock: 同じファイルを更新するプロセス・スレッドをアドバイザリロックで直列化する
+- atomic_write: 一時ファイルに書いて fsync し、rename で置き換える
+  （読み込み側は常に書き込み前か書き込み後の完全なファイルだけを見る）
+- file_hash: ファイル内容のハッシュ（入力が変わったかの判定に使う）
+"""
+import os
+import json
+import hashlib
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+def lock_path(path):
+    """
+    ファイルに対応するロックファイルのパス
+    """
+    path = Path(path)
+    return path.with_name(path.name + '.lock')
+
+@contextmanager
+def file_lock(path, shared=False):
+    """
+    ファイルのアドバイザリロックを取得（fcntlがない環境では何もしない）
+
+    Args:
+        path (str or Path): ロック対象のファイル（ロックは <ファイル名>.lock に対して取る）
+        shared (bool): 共有ロック（読み込み用）にするか
+    """
+    lock_file = lock_path(path)
+    lock_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_file, 'a') as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+def _fsync_directory(directory):
+    """
+    rename をディスクに反映させるためにディレクトリを fsync（非対応の環境では無視）
+    """
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+@contextmanager
+def atomic_write(path, mode='w', encoding='utf-8', permissions=None, **kwargs):
+    """
+    一時ファイルに書き込み、完了時に fsync して置き換える（例外時は元のファイルを残す）
+
+    Args:
+        path (str or Path): 書き込み先
+        mode (str): 'w' または 'wb'
+        encoding (str): テキストモードの文字コード
+        permissions (int): ファイルのパーミッション（Noneの場合はumaskに従う通常の値）
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    fd, tmp_name = tempfile.mkstemp(prefix=f".{path.name}.", suffix='.tmp', dir=path.parent)
+    try:
+        if permissions is None:
+            umask = os.umask(0)
+            os.umask(umask)
+            permissions = 0o666 & ~umask
+        os.chmod(tmp_name, permissions)
+
+        if 'b' in mode:
+            f = os.fdopen(fd, mode, **kwargs)
+        else:
+            f = os.fdopen(fd, mode, encoding=encoding, **kwargs)
+        with f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_name, path)
+        _fsync_directory(path.parent)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+        raise
+
+def write_csv_atomic(data, path, encoding='utf-8-sig', **kwargs):
+    """
+    DataFrameをCSVとしてアトミックに書き込み
+
+    Args:
+        data (pd.DataFrame): データ
+        path (str or Path): 書き込み先
+        encoding (str): 文字コード
+        **kwargs: DataFrame.to_csv に渡す引数（index=Falseが既定）
+    """
+    kwargs.setdefault('index', False)
+    with atomic_write(path, 'w', encoding=encoding, newline='') as f:
+        data.to_csv(f, **kwargs)
+
+def write_json_atomic(obj, path, permissions=None, **kwargs):
+    """
+    オブジェクトをJSONとしてアトミックに書き込み
+
+    Args:
+        obj: JSONに変換できるオブジェクト
+        path (str or Path): 書き込み先
+        permissions (int): ファイルのパーミッション
+        **kwargs: json.dump に渡す引数
+    """
+    kwargs.setdefault('ensure_ascii', False)
+    with atomic_write(path, 'w', permissions=permissions) as f:
+        json.dump(obj, f, **kwargs)
+
+# ファイル内容のハッシュ（パス → ((更新時刻, サイズ), ハッシュ)）。同じプロセス内での再計算を省く
+_FILE_HASHES = {}
+
+def file_hash(path):
+    """
+    ファイル内容のSHA-256（更新時刻とサイズが変わらない限り再計算しない）
+
+    Args:
+        path (str or Path): ファイル
+
+    Returns:
+        str: 16進数のハッシュ（ファイルがない場合は空文字列）
+    """
+    path = Path(path)
+    if not path.exists():
+        return ''
+
+    stat = path.stat()
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    cached = _FILE_HASHES.get(str(path))
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    _FILE_HASHES[str(path)] = (stamp, digest.hexdigest())
+    return digest.hexdigest()
@@ -0,0 +1,97 @@
+import json
+import numpy as np
+import pandas as pd
+from pathlib import Path
+import logging
+from src.storage import file_lock
+
+class StringDictionary:
+    """
+    日次データ間で共有する文字列の辞書（インターンテーブル）クラス
+
+    文字列は strings.jsonl に1行1件のJSON文字列として追記のみで保存し、
+    行番号をIDとする。一度振ったIDは変わらないため、過去の日次データは
+    IDだけを保持すればよい。欠損値のIDは -1。
+    """
+
+    MISSING = -1
+
+    def __init__(self, dictionary_file):
+        self.dictionary_file = Path(dictionary_file)
+        self.dictionary_file.parent.mkdir(parents=True, exist_ok=True)
+
+        self.strings = []
+        self.ids = {}
+        self._offset = 0
+
+        self.logger = logging.getLogger(__name__)
+
+    def _refresh(self):
+        """
+        前回読み込んだ位置以降に追記された文字列を読み込む
+        """
+        if not self.dictionary_file.exists() or self.dictionary_file.stat().st_size == self._offset:
+            return
+
+        with open(self.dictionary_file, 'rb') as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                value = json.loads(line)
+                self.ids[value] = len(self.strings)
+                self.strings.append(value)
+                self._offset += len(line)
+
+    def encode(self, values):
+        """
+        文字列の列をIDの配列に変換（未登録の文字列は辞書に追加）
+
+        Args:
+            values (pd.Series): 文字列の列
+
+        Returns:
+            np.ndarray: int32のID配列
+        """
+        values = pd.Series(values)
+        present = values.notna()
+        uniques = pd.unique(values[present].astype(str))
+
+        self._refresh()
+        if any(value not in self.ids for value in uniques):
+            with file_lock(self.dictionary_file):
+                self._refresh()
+                new_values = [value for value in uniques if value not in self.ids]
+                with open(self.dictionary_file, 'ab') as f:
+                    for value in new_values:
+                        f.write(json.dumps(value, ensure_ascii=False).encode('utf-8') + b'\n')
+                self._refresh()
+
+        ids = np.full(len(values), self.MISSING, dtype=np.int32)
+        ids[present.to_numpy()] = values[present].astype(str).map(self.ids).to_numpy(dtype=np.int32)
+        return ids
+
+    def decode(self, ids):
+        """
+        IDの配列を、使われている文字列だけをカテゴリに持つカテゴリ型に変換
+
+        Args:
+            ids (array-like): IDの配列（-1は欠損値）
+
+        Returns:
+            pd.Categorical: カテゴリ型の値
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        used = np.unique(ids[ids != self.MISSING])
+        if len(used) and used[-1] >= len(self.strings):
+            self._refresh()
+
+        categories = pd.Index([self.strings[i] for i in used], dtype=object)
+        codes = np.full(len(ids), -1, dtype=np.int32)
+        mask = ids != self.MISSING
+        codes[mask] = np.searchsorted(used, ids[mask])
+        return pd.Categorical.from_codes(codes, categories=categories)
+
+    def __len__(self):
+        self._refresh()
+        return len(self.strings)
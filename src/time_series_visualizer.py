@@ -6,6 +6,7 @@ import numpy as np
 from datetime import datetime, timedelta
 import logging
 from src.data_manager import DataManager
+from src.frame_schema import normalize_codes
 from pathlib import Path
 
 class TimeSeriesVisualizer:
@@ -13,8 +14,8 @@ class TimeSeriesVisualizer:
     時系列データ可視化クラス
     """
     
-    def __init__(self):
-        self.data_manager = DataManager()
+    def __init__(self, data_manager=None):
+        self.data_manager = data_manager or DataManager()
         self.logger = logging.getLogger(__name__)
     
     def create_pbr_trend_chart(self, start_date=None, end_date=None, top_n=20):
@@ -29,20 +30,18 @@ class TimeSeriesVisualizer:
         Returns:
             plotly.graph_objects.Figure: チャート
         """
-        # 時系列データを取得
-        data = self.data_manager.get_time_series_data(
-            start_date=start_date, 
-            end_date=end_date,
-            columns=['code', 'stock_name', 'actual_pbr', 'last_price']
-        )
+        # 期間内の最新日を特定
+        dates = [
+            d for d in self.data_manager.get_available_dates()
+            if (start_date is None or d >= start_date) and (end_date is None or d <= end_date)
+        ]
         
-        if data.empty:
+        if not dates:
             self.logger.warning("時系列データがありません")
             return None
         
-        # 最新日のデータで上位銘柄を特定
-        latest_date = data['date'].max()
-        latest_data = data[data['date'] == latest_date]
+        # 最新日の横断データで上位銘柄を特定
+        latest_data = self.data_manager.get_cross_section(dates[0], columns=['code', 'actual_pbr'])
         
         # PBRが有効なデータのみフィルタリング
         latest_data = latest_data[latest_data['actual_pbr'].notna()]
@@ -56,8 +55,13 @@ class TimeSeriesVisualizer:
         top_stocks = latest_data.nsmallest(top_n, 'actual_pbr')
         top_codes = top_stocks['code'].tolist()
         
-        # 選択された銘柄の時系列データをフィルタリング
-        filtered_data = data[data['code'].isin(top_codes)]
+        # 選択された銘柄の時系列データだけを取得
+        filtered_data = self.data_manager.get_code_history(
+            top_codes,
+            start_date=start_date,
+            end_date=end_date,
+            columns=['code', 'stock_name', 'actual_pbr', 'last_price']
+        )
         
         # チャートを作成
         fig = go.Figure()
@@ -99,20 +103,14 @@ class TimeSeriesVisualizer:
         Returns:
             plotly.graph_objects.Figure: チャート
         """
-        # 時系列データを取得
-        data = self.data_manager.get_time_series_data(
-            start_date=start_date, 
+        # 指定された銘柄の時系列データだけを取得
+        filtered_data = self.data_manager.get_code_history(
+            codes,
+            start_date=start_date,
             end_date=end_date,
             columns=['code', 'stock_name', 'last_price']
         )
         
-        if data.empty:
-            self.logger.warning("時系列データがありません")
-            return None
-        
-        # 指定された銘柄のデータをフィルタリング
-        filtered_data = data[data['code'].isin(codes)]
-        
         if filtered_data.empty:
             self.logger.warning("指定された銘柄のデータがありません")
             return None
@@ -120,8 +118,9 @@ class TimeSeriesVisualizer:
         # チャートを作成
         fig = go.Figure()
         
-        for code in codes:
-            stock_data = filtered_data[filtered_data['code'] == code]
+        normalized_codes = normalize_codes(filtered_data['code'])
+        for code in normalize_codes(pd.Series(codes, dtype=object)):
+            stock_data = filtered_data[normalized_codes == code]
             if not stock_data.empty:
                 stock_name = stock_data['stock_name'].iloc[0]
                 
@@ -157,25 +156,13 @@ class TimeSeriesVisualizer:
         Returns:
             plotly.graph_objects.Figure: チャート
         """
-        # 時系列データを取得
-        data = self.data_manager.get_time_series_data(
-            start_date=start_date, 
-            end_date=end_date,
-            columns=['code', 'actual_pbr', 'expected_per', 'expected_dividend_yield', 'last_price']
-        )
+        # 保存時に作成した集計表から日次統計を取得
+        daily_stats = self._daily_stats_from_rollups(start_date, end_date)
         
-        if data.empty:
+        if daily_stats.empty:
             self.logger.warning("時系列データがありません")
             return None
         
-        # 日次統計を計算
-        daily_stats = data.groupby('date').agg({
-            'actual_pbr': ['mean', 'median', 'std'],
-            'expected_per': ['mean', 'median'],
-            'expected_dividend_yield': ['mean', 'median'],
-            'last_price': ['mean', 'median']
-        }).reset_index()
-        
         # マルチサブプロットを作成
         fig = make_subplots(
             rows=2, cols=2,
@@ -262,6 +249,32 @@ class TimeSeriesVisualizer:
         
         return fig
     
+    def _daily_stats_from_rollups(self, start_date=None, end_date=None):
+        """
+        集計表から日次統計を取得（履歴の日次データは読まない）
+        
+        Returns:
+            pd.DataFrame: create_market_overview_chart と同じ形式の統計（集計がない場合は空）
+        """
+        aggregations = {
+            'actual_pbr': ['mean', 'median', 'std'],
+            'expected_per': ['mean', 'median'],
+            'expected_dividend_yield': ['mean', 'median'],
+            'last_price': ['mean', 'median']
+        }
+        
+        rollups = self.data_manager.get_rollups('daily', start_date, end_date, metrics=list(aggregations))
+        if rollups.empty:
+            return pd.DataFrame()
+        
+        wide = rollups.pivot(index='date', columns='metric', values=['mean', 'median', 'std']).sort_index()
+        stats = {('date', ''): wide.index.to_numpy()}
+        for column, funcs in aggregations.items():
+            for func in funcs:
+                stats[(column, func)] = wide[(func, column)].to_numpy() if (func, column) in wide.columns else np.nan
+        
+        return pd.DataFrame(stats)
+    
     def save_chart_to_html(self, fig, filename):
         """
         チャートをHTMLファイルに保存
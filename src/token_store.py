@@ -0,0 +1,96 @@
+import json
+import hashlib
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+import logging
+from src.config import config
+from src.storage import file_lock, write_json_atomic
+
+class TokenStore:
+    """
+    j-Quants IDトークンをプロセス間で共有する永続ストアクラス
+
+    IDトークンと有効期限をロック付きのローカルファイルに保存し、
+    同じリフレッシュトークンを使うすべてのプロセス・ジョブで再利用する。
+    """
+
+    def __init__(self, refresh_token, token_file=None):
+        self.token_file = Path(token_file or Path(config.cache_dir) / 'jquants_token.json')
+        self.token_file.parent.mkdir(parents=True, exist_ok=True)
+
+        # リフレッシュトークン自体は保存せず、ハッシュで識別する
+        self.refresh_token_hash = hashlib.sha256(refresh_token.encode('utf-8')).hexdigest()
+
+        self.logger = logging.getLogger(__name__)
+
+    @contextmanager
+    def lock(self):
+        """
+        トークンファイルの排他ロックを取得
+        """
+        with file_lock(self.token_file):
+            yield
+
+    def load(self):
+        """
+        保存済みのIDトークンを読み込み
+
+        Returns:
+            tuple: (IDトークン, 有効期限のdatetime)。存在しない場合はNone
+        """
+        if not self.token_file.exists():
+            return None
+
+        try:
+            with open(self.token_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+
+            if data.get('refresh_token_hash') != self.refresh_token_hash:
+                return None
+
+            return data['id_token'], datetime.fromisoformat(data['expires_at'])
+
+        except Exception as e:
+            self.logger.warning(f"IDトークンの読み込みに失敗: {e}")
+            return None
+
+    def save(self, id_token, expires_at):
+        """
+        IDトークンを保存
+
+        Args:
+            id_token (str): IDトークン
+            expires_at (datetime): 有効期限
+        """
+        data = {
+            'refresh_token_hash': self.refresh_token_hash,
+            'id_token': id_token,
+            'expires_at': expires_at.isoformat(),
+            'saved_at': datetime.now().isoformat()
+        }
+
+        try:
+            # 所有者のみ読み書き可能な一時ファイルに書いてから置き換える
+            write_json_atomic(data, self.token_file, permissions=0o600)
+
+        except Exception as e:
+            self.logger.warning(f"IDトークンの保存に失敗: {e}")
+
+    def invalidate(self, id_token=None):
+        """
+        保存済みのIDトークンを破棄
+
+        Args:
+            id_token (str): 失効したIDトークン（指定した場合は保存済みのトークンと同じときだけ破棄し、
+                他のプロセスが再認証して保存した新しいトークンは残す）
+        """
+        with self.lock():
+            if id_token is not None:
+                stored = self.load()
+                if stored is None or stored[0] != id_token:
+                    return
+            try:
+                self.token_file.unlink()
+            except FileNotFoundError:
+                pass
@@ -1,4 +1,5 @@
-from bs4 import BeautifulSoup
+import re
+from src.storage import atomic_write
 
 
 # BootstrapのCSSとJavaScriptのリンク
@@ -29,28 +30,49 @@ FOOTER = """
 <script src="script.js"></script>
 """
 
-# all_graphs.htmlから内容を読み込む
-with open('docs/all_graphs.html', 'r') as file:
-    all_graphs_content = file.read()
+def decorate_html(html_content):
+    """
+    グラフのHTMLにBootstrap、ナビゲーションバー、フッターを追加（index.html の内容）
 
-# BeautifulSoupオブジェクトを作成
-soup = BeautifulSoup(all_graphs_content, 'html.parser')
+    Plotlyが出力した構造は変えずに文字列として挿入するため、HTMLを解析し直さない。
+    Plotlyが自動生成する描画ターゲットdivのidはスクリプト内で参照されるため、
+    idを書き換えない（高さ調整はフロントのscriptで`.plotly-graph-div`に対して行う）。
 
-# Plotlyが自動生成する描画ターゲットdivのidはスクリプト内で参照されるため、
-# idを書き換えない（高さ調整はフロントのscriptで`.plotly-graph-div`に対して行う）
+    Args:
+        html_content (str): all_graphs.html の内容
 
-# headタグにBootstrapのリンクを追加
-head = soup.head
-head.insert(1, BeautifulSoup(BOOTSTRAP_LINKS, 'html.parser'))
+    Returns:
+        str: HTML
+    """
+    head = re.search(r'<head[^>]*>', html_content, re.IGNORECASE)
+    body = re.search(r'<body[^>]*>', html_content, re.IGNORECASE)
+    body_end = html_content.lower().rfind('</body>')
+    if head is None or body is None or body_end < body.end():
+        raise ValueError("HTMLにhead・bodyタグが見つかりません")
 
-# bodyタグの最初にナビゲーションバーを追加
-body = soup.body
-body.insert(0, BeautifulSoup(NAVBAR, 'html.parser'))
+    return ''.join([
+        # headタグの先頭にBootstrapのリンクを追加
+        html_content[:head.end()], BOOTSTRAP_LINKS,
+        html_content[head.end():body.end()],
+        # bodyタグの最初にナビゲーションバーを追加
+        NAVBAR,
+        html_content[body.end():body_end],
+        # bodyタグの最後にフッターを追加
+        FOOTER,
+        html_content[body_end:],
+    ])
 
+def main():
+    """
+    メイン実行関数
+    """
+    # all_graphs.htmlから内容を読み込む
+    with open('docs/all_graphs.html', 'r', encoding='utf-8') as file:
+        all_graphs_content = file.read()
 
-# bodyタグの最後にフッターを追加
-body.append(BeautifulSoup(FOOTER, 'html.parser'))
+    # 結果を新しいHTMLファイルに書き出す
+    with atomic_write('docs/index.html', 'w', encoding='utf-8') as file:
+        file.write(decorate_html(all_graphs_content))
 
-# 結果を新しいHTMLファイルに書き出す
-with open('docs/index.html', 'w') as file:
-    file.write(str(soup))
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+import pandas as pd
+import numpy as np
+import concurrent.futures
+from datetime import datetime, timedelta
+import argparse
+import logging
+from src.config import config
+from src.jquants_client import JQuantsClient, normalize_code
+from src.data_manager import DataManager
+from src.output_store import OutputStore
+
+# data/output.csv と同じ列構成
+OUTPUT_COLUMNS = [
+    'code', 'name', 'price', 'expected_per', 'expected_dividend_yield', 'expected_roe', 'actual_pbr',
+    'stock_name', 'last_price',
+    'last_news_text', 'last_news_url', 'last_disclosure', 'last_disclosure_url'
+]
+
+# fins/statements の数値項目と内部列名の対応
+STATEMENT_COLUMNS = {
+    'ForecastEarningsPerShare': 'forecast_eps',
+    'NextYearForecastEarningsPerShare': 'next_year_forecast_eps',
+    'BookValuePerShare': 'bps',
+    'ForecastDividendPerShareAnnual': 'forecast_dividend',
+    'NextYearForecastDividendPerShareAnnual': 'next_year_forecast_dividend',
+    'Equity': 'equity',
+    'NumberOfIssuedAndOutstandingSharesAtTheEndOfFiscalYearIncludingTreasuryStock': 'issued_shares',
+    'NumberOfTreasuryStockAtTheEndOfFiscalYear': 'treasury_shares',
+}
+
+class ValuationEngine:
+    """
+    j-Quantsの財務情報と株価からPER・PBR・ROE・配当利回りを算出するクラス
+
+    日経のページをブラウザで読む代わりに、全銘柄分の開示と株価を一括取得し、
+    NumPy/pandasのベクトル演算で指標を計算する。
+    """
+
+    # 最新の開示を探す期間（四半期開示の間隔をカバーする日数）
+    STATEMENT_LOOKBACK_DAYS = 120
+
+    def __init__(self, client=None, max_workers=4):
+        self.client = client or JQuantsClient()
+        self.max_workers = max_workers
+        self.logger = logging.getLogger(__name__)
+
+    def fetch_listed_info(self, date=None):
+        """
+        上場企業情報を取得
+
+        Args:
+            date (str): 基準日（YYYY-MM-DD形式。Noneの場合は最新）
+
+        Returns:
+            pd.DataFrame: code, name, market, sector33 列を持つデータ
+        """
+        listed_info = self.client.get_listed_info(date=date) or []
+        listed = pd.DataFrame.from_records(listed_info)
+        if listed.empty:
+            return pd.DataFrame(columns=['code', 'name', 'market', 'sector33'])
+
+        listed = pd.DataFrame({
+            'code': listed['Code'].map(normalize_code),
+            'name': listed.get('CompanyName'),
+            'market': listed.get('MarketCodeName'),
+            'sector33': listed.get('Sector33CodeName'),
+        })
+        return listed.drop_duplicates('code', keep='last').reset_index(drop=True)
+
+    def fetch_statements(self, end_date, start_date=None):
+        """
+        期間内に開示された全銘柄の財務情報を開示日単位で並列取得
+
+        Args:
+            end_date (str): 終了日（YYYY-MM-DD形式）
+            start_date (str): 開始日（Noneの場合は終了日からSTATEMENT_LOOKBACK_DAYS日前）
+
+        Returns:
+            pd.DataFrame: 開示データ
+        """
+        if start_date is None:
+            start_date = (datetime.strptime(end_date, '%Y-%m-%d')
+                          - timedelta(days=self.STATEMENT_LOOKBACK_DAYS)).strftime('%Y-%m-%d')
+
+        disclosure_dates = self.client.get_trading_calendar(start_date, end_date)
+        if not disclosure_dates:
+            disclosure_dates = [d.strftime('%Y-%m-%d') for d in pd.bdate_range(start_date, end_date)]
+
+        records = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for statements in executor.map(lambda d: self.client.get_financial_statements(date=d),
+                                           disclosure_dates):
+                if statements:
+                    records.extend(statements)
+
+        self.logger.info(f"{start_date} ～ {end_date} の開示を取得しました: {len(records)}件")
+        return pd.DataFrame.from_records(records)
+
+    @staticmethod
+    def prepare_statements(statements):
+        """
+        開示データを数値型の内部形式に変換
+
+        Args:
+            statements (pd.DataFrame): fins/statements のレコード
+
+        Returns:
+            pd.DataFrame: code, disclosed_date と数値列を持つデータ（開示日順）
+        """
+        if statements is None or statements.empty:
+            return pd.DataFrame(columns=['code', 'disclosed_date'] + list(STATEMENT_COLUMNS.values()))
+
+        prepared = pd.DataFrame({
+            'code': statements['LocalCode'].map(normalize_code),
+            'disclosed_date': statements['DisclosedDate'].astype(str),
+        })
+        for source, target in STATEMENT_COLUMNS.items():
+            if source in statements.columns:
+                prepared[target] = pd.to_numeric(statements[source], errors='coerce')
+            else:
+                prepared[target] = np.nan
+
+        # 本決算の開示では当期予想が空欄になり、翌期予想が今後の予想となる
+        prepared['forecast_eps'] = prepared['forecast_eps'].fillna(prepared['next_year_forecast_eps'])
+        prepared['forecast_dividend'] = prepared['forecast_dividend'].fillna(prepared['next_year_forecast_dividend'])
+
+        # BPSが開示されていない場合は純資産と自己株式控除後の株数から算出
+        outstanding = prepared['issued_shares'] - prepared['treasury_shares'].fillna(0)
+        derived_bps = prepared['equity'] / outstanding.where(outstanding > 0)
+        prepared['bps'] = prepared['bps'].fillna(derived_bps)
+
+        sort_keys = ['disclosed_date']
+        if 'DisclosedTime' in statements.columns:
+            prepared['disclosed_time'] = statements['DisclosedTime'].astype(str)
+            sort_keys.append('disclosed_time')
+
+        return prepared.sort_values(sort_keys, kind='stable').reset_index(drop=True)
+
+    @staticmethod
+    def latest_fundamentals(prepared, as_of=None):
+        """
+        銘柄ごとに最新の開示値を取得（項目ごとに直近の非欠損値を採用）
+
+        Args:
+            prepared (pd.DataFrame): prepare_statements の結果
+            as_of (str): 基準日（この日までに開示されたものだけを使う）
+
+        Returns:
+            pd.DataFrame: code をインデックスとする最新値
+        """
+        if as_of is not None:
+            prepared = prepared[prepared['disclosed_date'] <= as_of]
+
+        return prepared.groupby('code')[['forecast_eps', 'bps', 'forecast_dividend', 'equity']].last()
+
+    @staticmethod
+    def compute(quotes, fundamentals, listed):
+        """
+        株価と財務の最新値から指標を一括計算
+
+        Args:
+            quotes (pd.DataFrame): code, Close 列を持つ株価データ
+            fundamentals (pd.DataFrame): latest_fundamentals の結果
+            listed (pd.DataFrame): fetch_listed_info の結果
+
+        Returns:
+            pd.DataFrame: data/output.csv と同じ列構成のデータ
+        """
+        frame = listed[['code', 'name']].merge(
+            quotes[['code', 'Close']].drop_duplicates('code', keep='last'), on='code', how='inner'
+        ).merge(fundamentals, left_on='code', right_index=True, how='left')
+
+        price = pd.to_numeric(frame['Close'], errors='coerce').to_numpy(dtype='float64')
+        eps = frame['forecast_eps'].to_numpy(dtype='float64')
+        bps = frame['bps'].to_numpy(dtype='float64')
+        dividend = frame['forecast_dividend'].to_numpy(dtype='float64')
+
+        # 赤字予想・債務超過は日経と同様に指標なしとする
+        valid_eps = np.where(eps > 0, eps, np.nan)
+        valid_bps = np.where(bps > 0, bps, np.nan)
+        valid_price = np.where(price > 0, price, np.nan)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result = pd.DataFrame({
+                'code': frame['code'],
+                'name': frame['name'],
+                'price': price,
+                'expected_per': np.round(valid_price / valid_eps, 2),
+                'expected_dividend_yield': np.round(dividend / valid_price * 100, 2),
+                'expected_roe': np.round(eps / valid_bps * 100, 2),
+                'actual_pbr': np.round(valid_price / valid_bps, 2),
+            })
+
+        result['stock_name'] = result['name']
+        result['last_price'] = result['price']
+        for column in ['last_news_text', 'last_news_url', 'last_disclosure', 'last_disclosure_url']:
+            result[column] = None
+
+        return result[OUTPUT_COLUMNS].sort_values('code').reset_index(drop=True)
+
+    def build(self, date=None, codes=None):
+        """
+        全銘柄の指標を算出
+
+        Args:
+            date (str): 基準日（YYYY-MM-DD形式、Noneの場合は直近の営業日）
+            codes (list): 対象の証券コード（Noneの場合は東証プライム全銘柄）
+
+        Returns:
+            pd.DataFrame: data/output.csv と同じ列構成のデータ
+        """
+        listed = self.fetch_listed_info()
+        if codes is not None:
+            target_codes = {normalize_code(code) for code in codes}
+            listed = listed[listed['code'].isin(target_codes)]
+        else:
+            listed = listed[listed['market'] == 'プライム']
+
+        quotes = self.client.get_daily_quotes_snapshot(date=date, codes=listed['code'].tolist())
+        if quotes is None or quotes.empty:
+            self.logger.error("株価スナップショットを取得できませんでした")
+            return pd.DataFrame(columns=OUTPUT_COLUMNS)
+
+        quote_date = str(quotes['Date'].iloc[0]) if 'Date' in quotes.columns else (date or datetime.now().strftime('%Y-%m-%d'))
+        statements = self.prepare_statements(self.fetch_statements(quote_date))
+        fundamentals = self.latest_fundamentals(statements, as_of=quote_date)
+
+        result = self.compute(quotes, fundamentals, listed)
+        result.attrs['date'] = quote_date
+        self.logger.info(f"{quote_date}の指標を算出しました: {len(result)}銘柄")
+        return result
+
+def main():
+    """
+    メイン実行関数
+    """
+    parser = argparse.ArgumentParser(description='J-Quantsの開示と株価から指標を算出してdata/output.csvを生成')
+    parser.add_argument('--date', type=str, default=None, help='基準日（YYYY-MM-DD、省略時は直近の営業日）')
+    parser.add_argument('--output', type=str, default=config.output_file, help='出力ファイル')
+    parser.add_argument('--no-history', action='store_true', help='時系列データとして保存しない')
+    args = parser.parse_args()
+
+    engine = ValuationEngine()
+    result = engine.build(date=args.date)
+
+    if result.empty:
+        print("指標を算出できませんでした")
+        return
+
+    OutputStore(args.output).replace(result)
+    print(f"{len(result)}銘柄の指標を{args.output}に保存しました")
+
+    if not args.no_history:
+        DataManager().save_daily_data(result, date=result.attrs.get('date', args.date))
+        print("時系列データとして保存しました")
+
+if __name__ == "__main__":
+    main()
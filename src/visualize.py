@@ -1,135 +1,14 @@
 import numpy as np
 import pandas as pd
-from data_processing import process_data
+from src.data_processing import process_data
+from src.output_store import OutputStore
+from src.indicators import export_indicators
+from src.storage import atomic_write
 import plotly.graph_objects as go
 from datetime import datetime
-import os
 
-
-# 処理済データの受け取り
-data = process_data()
-
-# データが空の場合のフェイルセーフ
-if not data:
-    raise RuntimeError("処理データが空です。まず'src/scraper_dynamic.py'で'data/output.csv'を生成してください。")
-
-# スクレイピング日時を取得（ファイルの作成日時を使用）
-output_file_path = 'data/output.csv'
-if os.path.exists(output_file_path):
-    file_timestamp = os.path.getmtime(output_file_path)
-    scraping_datetime = datetime.fromtimestamp(file_timestamp).strftime('%Y年%m月%d日 %H:%M')
-else:
-    scraping_datetime = datetime.now().strftime('%Y年%m月%d日 %H:%M')
-
-# 日経のベースURL
-nikkei_base_url = 'https://www.nikkei.com/nkd/company/?scode='
-
-# 初期のfigオブジェクトを作成
-fig = go.Figure()
-
-# ドロップダウンメニューのボタンを格納するリスト
-buttons = []
-
-# グラフの表示
-for index, (genre, group_df) in enumerate(data.items()):
-    # 数値のフォーマット関数
-    def format_price(price):
-        if pd.isna(price):
-            return "N/A"
-        return f"{price:,.0f}円"
-    
-    def format_percentage(value):
-        if pd.isna(value):
-            return "N/A"
-        return f"{value:.1f}%"
-    
-    def format_pbr(value):
-        if pd.isna(value):
-            return "N/A"
-        return f"{value:.2f}倍"
-    
-    # hovertemplateの設定（日本語化と単位付与、リンクは削除）
-    hovertemplate = (
-        "<b>銘柄コード:</b> %{customdata[0]}<br>"
-        "<b>銘柄名:</b> %{customdata[1]}<br>"
-        "<b>直近終値:</b> %{customdata[2]}<br>"
-        "<b>期待ROE:</b> %{customdata[3]}<br>"
-        "<b>期待PER:</b> %{customdata[4]}<br>"
-        "<b>PBR実績値:</b> %{customdata[5]}<br>"
-        "<b>期待配当率:</b> %{customdata[6]}<br>"
-        "<b>情報取得日時:</b> " + scraping_datetime + "<br>"
-        "<b>操作:</b> クリックで詳細パネルを表示"
-        "<extra></extra>"  # 余分な情報を表示しないための設定
-    )
-
-    # カスタムデータの準備
-    custom_data = []
-    for _, row in group_df.iterrows():
-        # 数値のフォーマット
-        formatted_price = format_price(row['price'])
-        formatted_roe = format_percentage(row['expected_roe'])
-        formatted_per = format_percentage(row['expected_per'])
-        formatted_pbr = format_pbr(row['actual_pbr'])
-        formatted_dividend = format_percentage(row['expected_dividend_yield'])
-        
-        # 日経のURLを生成
-        nikkei_url = nikkei_base_url + str(row['code'])
-        
-        custom_data.append([
-            row['code'],
-            row['name'],
-            formatted_price,
-            formatted_roe,
-            formatted_per,
-            formatted_pbr,
-            formatted_dividend,
-            nikkei_url
-        ])
-
-    # scatter plotの追加
-    scatter = go.Scatter(
-        x=group_df['expected_per'],
-        y=group_df['expected_roe'],
-        mode='markers',
-        marker=dict(
-            color=group_df['expected_dividend_yield'],
-            colorscale='Viridis',
-            size=group_df['price'] / 50,
-            colorbar=dict(title="配当利回り (%)")
-        ),
-        customdata=custom_data,
-        hovertemplate=hovertemplate,
-        visible=(index == 0),  # 最初のジャンルのグラフのみを表示
-        hoverinfo='all'
-    )
-    fig.add_trace(scatter)
-
-    # pbr指標の追加
-    x_values = np.linspace(2, max(group_df['expected_per']) * 1.1, 2000)
-    y_values = 100 / x_values
-    pbr_line = go.Scatter(x=x_values, y=y_values, mode='lines', name='PBR *1 line', visible=(index == 0))
-    fig.add_trace(pbr_line)
-
-    # ドロップダウンメニューのボタンを追加
-    visible_list = [False] * len(data) * 2  # すべてのトレースを非表示に設定
-    visible_list[index * 2] = True  # 選択されたジャンルのscatter plotを表示
-    visible_list[index * 2 + 1] = True  # 選択されたジャンルのpbr lineを表示
-    buttons.append(dict(label=genre, method="update", args=[{"visible": visible_list}]))
-
-# ドロップダウンメニューを作成
-fig.update_layout(
-    updatemenus=[dict(type="dropdown", direction="down", buttons=buttons, showactive=True)]
-)
-
-# カスタムJavaScriptを含むHTMLを生成
-html_content = fig.to_html(
-    include_plotlyjs=True,
-    config={'responsive': True},
-    full_html=True
-)
-
-# カスタムCSSとJavaScriptを追加
-custom_css_js = """
+# 詳細パネルのCSSとJavaScript（__SCRAPING_DATETIME__ は情報取得日時に置き換える）
+DETAIL_PANEL = """
 <style>
 #detail-panel {
     position: fixed;
@@ -259,9 +138,21 @@ function showDetailPanel(customData) {
             <span class="detail-label">期待配当率:</span>
             <span class="detail-value">${customData[6]}</span>
         </div>
+        <div class="detail-item">
+            <span class="detail-label">理論PBR:</span>
+            <span class="detail-value">${customData[8]}</span>
+        </div>
+        <div class="detail-item">
+            <span class="detail-label">PBRギャップ:</span>
+            <span class="detail-value">${customData[9]}</span>
+        </div>
+        <div class="detail-item">
+            <span class="detail-label">業種内PBR:</span>
+            <span class="detail-value">${customData[10]}</span>
+        </div>
         <div class="detail-item">
             <span class="detail-label">情報取得日時:</span>
-            <span class="detail-value">""" + scraping_datetime + """</span>
+            <span class="detail-value">__SCRAPING_DATETIME__</span>
         </div>
         <a href="${customData[7]}" target="_blank" class="nikkei-link">
             日経新聞で詳細を見る
@@ -285,9 +176,189 @@ document.addEventListener('keydown', function(event) {
 </script>
 """
 
-# JavaScriptをHTMLに挿入
-html_content = html_content.replace('</head>', custom_css_js + '</head>')
+# 数値のフォーマット関数
+def format_price(price):
+    if pd.isna(price):
+        return "N/A"
+    return f"{price:,.0f}円"
+
+def format_percentage(value):
+    if pd.isna(value):
+        return "N/A"
+    return f"{value:.1f}%"
+
+def format_pbr(value):
+    if pd.isna(value):
+        return "N/A"
+    return f"{value:.2f}倍"
+
+def get_scraping_datetime(timestamp=None):
+    """
+    表示用の情報取得日時
+
+    Args:
+        timestamp (float): 取得時刻のUNIX時刻（Noneの場合は output.csv とジャーナルの更新日時）
+
+    Returns:
+        str: 「YYYY年MM月DD日 HH:MM」形式の日時
+    """
+    if timestamp is None:
+        timestamp = OutputStore('data/output.csv').last_modified()
+    if timestamp is None:
+        return datetime.now().strftime('%Y年%m月%d日 %H:%M')
+    return datetime.fromtimestamp(timestamp).strftime('%Y年%m月%d日 %H:%M')
+
+def build_figure(data, scraping_datetime):
+    """
+    業種ごとの散布図をドロップダウンで切り替えるグラフを作成
+
+    Args:
+        data (dict): 業種 → 処理済みデータ（process_data の戻り値）
+        scraping_datetime (str): 表示する情報取得日時
+
+    Returns:
+        go.Figure: グラフ
+    """
+    # 日経のベースURL
+    nikkei_base_url = 'https://www.nikkei.com/nkd/company/?scode='
+    
+    # 初期のfigオブジェクトを作成
+    fig = go.Figure()
+    
+    # ドロップダウンメニューのボタンを格納するリスト
+    buttons = []
+    
+    # グラフの表示
+    for index, (genre, group_df) in enumerate(data.items()):
+        # hovertemplateの設定（日本語化と単位付与、リンクは削除）
+        hovertemplate = (
+            "<b>銘柄コード:</b> %{customdata[0]}<br>"
+            "<b>銘柄名:</b> %{customdata[1]}<br>"
+            "<b>直近終値:</b> %{customdata[2]}<br>"
+            "<b>期待ROE:</b> %{customdata[3]}<br>"
+            "<b>期待PER:</b> %{customdata[4]}<br>"
+            "<b>PBR実績値:</b> %{customdata[5]}<br>"
+            "<b>期待配当率:</b> %{customdata[6]}<br>"
+            "<b>理論PBR (ROE×PER):</b> %{customdata[8]}<br>"
+            "<b>PBRギャップ (実績−理論):</b> %{customdata[9]}<br>"
+            "<b>業種内PBR:</b> %{customdata[10]}<br>"
+            "<b>情報取得日時:</b> " + scraping_datetime + "<br>"
+            "<b>操作:</b> クリックで詳細パネルを表示"
+            "<extra></extra>"  # 余分な情報を表示しないための設定
+        )
+    
+        # カスタムデータの準備
+        custom_data = []
+        for _, row in group_df.iterrows():
+            # 数値のフォーマット
+            formatted_price = format_price(row['price'])
+            formatted_roe = format_percentage(row['expected_roe'])
+            formatted_per = format_percentage(row['expected_per'])
+            formatted_pbr = format_pbr(row['actual_pbr'])
+            formatted_dividend = format_percentage(row['expected_dividend_yield'])
+            
+            # 日経のURLを生成
+            nikkei_url = nikkei_base_url + str(row['code'])
+            
+            # 業種内での位置（中央値とパーセンタイル）
+            if pd.isna(row['actual_pbr_sector_pct']):
+                sector_pbr = "N/A"
+            else:
+                sector_pbr = f"中央値 {format_pbr(row['actual_pbr_sector_median'])} / 低い方から{row['actual_pbr_sector_pct'] * 100:.0f}%"
+            
+            custom_data.append([
+                row['code'],
+                row['name'],
+                formatted_price,
+                formatted_roe,
+                formatted_per,
+                formatted_pbr,
+                formatted_dividend,
+                nikkei_url,
+                format_pbr(row['pbr_indicator']),
+                format_pbr(row['pbr_gap']),
+                sector_pbr
+            ])
+    
+        # scatter plotの追加
+        scatter = go.Scatter(
+            x=group_df['expected_per'],
+            y=group_df['expected_roe'],
+            mode='markers',
+            marker=dict(
+                color=group_df['expected_dividend_yield'],
+                colorscale='Viridis',
+                size=group_df['price'] / 50,
+                colorbar=dict(title="配当利回り (%)")
+            ),
+            customdata=custom_data,
+            hovertemplate=hovertemplate,
+            visible=(index == 0),  # 最初のジャンルのグラフのみを表示
+            hoverinfo='all'
+        )
+        fig.add_trace(scatter)
+    
+        # pbr指標の追加
+        x_values = np.linspace(2, max(group_df['expected_per']) * 1.1, 2000)
+        y_values = 100 / x_values
+        pbr_line = go.Scatter(x=x_values, y=y_values, mode='lines', name='PBR *1 line', visible=(index == 0))
+        fig.add_trace(pbr_line)
+    
+        # ドロップダウンメニューのボタンを追加
+        visible_list = [False] * len(data) * 2  # すべてのトレースを非表示に設定
+        visible_list[index * 2] = True  # 選択されたジャンルのscatter plotを表示
+        visible_list[index * 2 + 1] = True  # 選択されたジャンルのpbr lineを表示
+        buttons.append(dict(label=genre, method="update", args=[{"visible": visible_list}]))
+    
+    # ドロップダウンメニューを作成
+    fig.update_layout(
+        updatemenus=[dict(type="dropdown", direction="down", buttons=buttons, showactive=True)]
+    )
+    return fig
+
+def build_html(fig, scraping_datetime):
+    """
+    グラフに詳細パネルのCSSとJavaScriptを加えたHTML（all_graphs.html の内容）
+
+    Args:
+        fig (go.Figure): build_figure で作成したグラフ
+        scraping_datetime (str): 表示する情報取得日時
+
+    Returns:
+        str: HTML
+    """
+    html_content = fig.to_html(
+        include_plotlyjs=True,
+        config={'responsive': True},
+        full_html=True
+    )
+    custom_css_js = DETAIL_PANEL.replace('__SCRAPING_DATETIME__', scraping_datetime)
+    return html_content.replace('</head>', custom_css_js + '</head>')
+
+def save_html(html_content, path='docs/all_graphs.html'):
+    """
+    HTMLを保存
+    """
+    with atomic_write(path, 'w', encoding='utf-8') as f:
+        f.write(html_content)
+
+def main():
+    """
+    メイン実行関数
+    """
+    # 処理済データの受け取り
+    data = process_data()
+
+    # データが空の場合のフェイルセーフ
+    if not data:
+        raise RuntimeError("処理データが空です。まず'src/scraper_dynamic.py'で'data/output.csv'を生成してください。")
+
+    scraping_datetime = get_scraping_datetime()
+    fig = build_figure(data, scraping_datetime)
+    save_html(build_html(fig, scraping_datetime), 'docs/all_graphs.html')
+
+    # 銘柄ごとの指標をCSVにも出力
+    export_indicators(data, 'data/indicators.csv')
 
-# HTMLファイルに保存
-with open('docs/all_graphs.html', 'w', encoding='utf-8') as f:
-    f.write(html_content)
+if __name__ == "__main__":
+    main()
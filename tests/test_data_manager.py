@@ -0,0 +1,35 @@
+import pandas as pd
+import pytest
+from src.data_manager import DataManager
+
+
+def _daily_frame(offset=0):
+    return pd.DataFrame({
+        'code': ['1301', '1332', '7203'],
+        'name': ['極洋', 'ニッスイ', 'トヨタ自動車'],
+        'price': [4540.0 + offset, 972.6 + offset, 2800.0 + offset],
+        'expected_per': [6.5, 11.7, 9.8],
+        'expected_dividend_yield': [3.3, 2.87, 2.5],
+        'expected_roe': [12.3, 9.0, 11.0],
+        'actual_pbr': [0.78, 1.08, 1.1],
+    })
+
+
+@pytest.mark.parametrize('backend', ['parquet', 'sqlite', 'delta'])
+def test_switching_backend_migrates_existing_csv_history(tmp_path, monkeypatch, backend):
+    """CSVで保存済みの履歴があっても、別の保存形式で初期化すると移行される"""
+    monkeypatch.chdir(tmp_path)
+
+    csv_manager = DataManager(backend='csv')
+    csv_manager.save_daily_data(_daily_frame(), date='2024-01-04')
+    csv_manager.save_daily_data(_daily_frame(10), date='2024-01-05')
+    assert sorted(p.name for p in (tmp_path / 'data/history').glob('daily_*.csv')) == [
+        'daily_2024-01-04.csv', 'daily_2024-01-05.csv'
+    ]
+
+    manager = DataManager(backend=backend)
+
+    assert sorted(manager.get_available_dates()) == ['2024-01-04', '2024-01-05']
+    latest = manager.get_cross_section('2024-01-05').sort_values('code').reset_index(drop=True)
+    assert latest['code'].tolist() == ['1301', '1332', '7203']
+    assert latest['price'].tolist() == pytest.approx([4550.0, 982.6, 2810.0])